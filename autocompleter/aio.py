@@ -0,0 +1,262 @@
+"""
+asyncio versions of Autocompleter.suggest and exact_suggest, awaiting Redis with redis.asyncio
+instead of blocking a thread on it. Queries are built, and results allocated to providers, by
+the same methods the synchronous versions use, with the same caching and single flight
+semantics. Needs Python 3.7; use them through Autocompleter.asuggest and aexact_suggest.
+"""
+import asyncio
+from collections import OrderedDict
+import time
+import uuid
+
+from autocompleter import scripts, settings, utils
+from autocompleter.base import CACHE_BASE_NAME, CACHE_LOCK_NAME, CACHE_LOCK_POLL_INTERVAL, CACHE_TAG_BASE_NAME, \
+    EXACT_CACHE_BASE_NAME, EXACT_CACHE_TAG_BASE_NAME, REDIS, get_read_client, get_script_source
+from autocompleter.connections import LazyClient
+
+# The asyncio client of each synchronous client, by synchronous client
+_async_clients = {}
+
+
+def get_async_client(client):
+    """
+    The redis.asyncio client connecting to the same server as the given client.
+    """
+    if client.asynchronous:
+        return client
+    async_client = _async_clients.get(client)
+    if async_client is None:
+        async_client = _async_clients.setdefault(
+            client, LazyClient(client.connection, cluster=client.cluster, asynchronous=True))
+    return async_client
+
+
+ASYNC_REDIS = get_async_client(REDIS)
+
+RELEASE_LOCK_SCRIPT = ASYNC_REDIS.register_script(get_script_source(scripts.RELEASE_LOCK))
+
+
+def _get_async_clients(clients):
+    return OrderedDict((provider_name, get_async_client(client)) for provider_name, client in clients.items())
+
+
+async def execute_pipelines(pipes):
+    """
+    Execute a dict mapping clients to pipelines concurrently, and return a dict mapping each
+    client to the results of its pipeline.
+    """
+    results = await asyncio.gather(*[pipe.execute() for pipe in pipes.values()])
+    return OrderedDict(zip(pipes.keys(), results))
+
+
+class _Failed(object):
+    pass
+
+
+class SingleFlight(object):
+    """
+    Coalesces concurrent calls computing the same thing in an event loop, like
+    autocompleter.cache.SingleFlight does for threads. The first caller of a key computes the
+    value, and callers asking for the same key meanwhile await it and share it, so it must not
+    be mutated.
+    """
+    def __init__(self):
+        self._calls = {}
+        self.coalesced = 0
+
+    async def do(self, key, fn, timeout=None):
+        """
+        Return await fn(), or the value the leader of key computes. Callers that wait longer than
+        timeout seconds, or whose leader failed, await fn themselves.
+        """
+        loop = asyncio.get_event_loop()
+        call_key = (loop, key)
+        future = self._calls.get(call_key)
+        if future is not None:
+            self.coalesced += 1
+            try:
+                value = await asyncio.wait_for(asyncio.shield(future), timeout)
+            except asyncio.TimeoutError:
+                value = _Failed
+            if value is not _Failed:
+                return value
+            return await fn()
+
+        future = self._calls[call_key] = loop.create_future()
+        value = _Failed
+        try:
+            value = await fn()
+            return value
+        finally:
+            del self._calls[call_key]
+            future.set_result(value)
+
+
+# Coalesces the identical suggest and exact_suggest calls of each event loop of this process
+single_flight = SingleFlight()
+
+
+async def suggest(autocompleter, term, facets=[]):
+    """
+    Suggest matching objects, given a term
+    """
+    providers = autocompleter._get_all_providers_by_autocompleter()
+    if providers is None:
+        return []
+
+    query_key = autocompleter._get_suggest_query_key(term, facets)
+    local_cache_key, cached_results = autocompleter._get_local_cached_results(query_key)
+    if cached_results is not None:
+        return cached_results
+
+    # All reads of a call from the default server go to the same replica. Results of short
+    # prefixes may have been precomputed, and are read along with the cached ones.
+    client = get_async_client(get_read_client())
+    clients = _get_async_clients(autocompleter._get_read_clients(providers, client))
+    keyspaces, (cache_key,), (cached_results,), invalidation_counts = await _get_keyspaces_and_cached_results(
+        autocompleter, client, clients, CACHE_BASE_NAME, [query_key],
+        [autocompleter._get_precomputed_key(term, facets)])
+    if cached_results is not None:
+        return autocompleter._load_cached_results(cached_results, local_cache_key, providers, 'prefix',
+            autocompleter._get_longest_words(utils.get_norm_term_variations(term)))
+
+    return await _single_flight(autocompleter, query_key, cache_key,
+        lambda: _suggest(autocompleter, clients, providers, keyspaces, term, facets, cache_key, local_cache_key,
+                         invalidation_counts))
+
+
+async def _suggest(autocompleter, clients, providers, keyspaces, term, facets, cache_key, local_cache_key,
+                   invalidation_counts):
+    norm_terms = utils.get_norm_term_variations(term)
+    if len(norm_terms) == 0:
+        return []
+
+    query_clients = _get_async_clients(autocompleter._get_query_clients(clients, providers))
+    pipes = autocompleter._get_pipelines(None, query_clients)
+    autocompleter._queue_suggest(pipes, query_clients, providers, keyspaces, term, norm_terms, facets)
+    provider_results, provider_payloads = autocompleter._parse_suggest(
+        await execute_pipelines(pipes), query_clients, providers, term)
+    results = await _get_results(autocompleter, provider_results, provider_payloads, keyspaces, clients)
+
+    longest_words = autocompleter._get_longest_words(norm_terms)
+    if cache_key is not None:
+        pipe = ASYNC_REDIS.pipeline()
+        autocompleter._queue_cache_results(pipe, cache_key, results, providers, CACHE_TAG_BASE_NAME, longest_words,
+                                           invalidation_counts)
+        await pipe.execute()
+    autocompleter._set_local_cache(local_cache_key, results, providers, 'prefix', longest_words)
+    return results
+
+
+async def exact_suggest(autocompleter, term):
+    """
+    Suggest matching objects exacting matching term given, given a term
+    """
+    providers = autocompleter._get_all_providers_by_autocompleter()
+    if providers is None:
+        return []
+
+    query_key = ('exact_suggest', autocompleter.name, term)
+    local_cache_key, cached_results = autocompleter._get_local_cached_results(query_key)
+    if cached_results is not None:
+        return cached_results
+
+    client = get_async_client(get_read_client())
+    clients = _get_async_clients(autocompleter._get_read_clients(providers, client))
+    keyspaces, (cache_key,), (cached_results,), invalidation_counts = await _get_keyspaces_and_cached_results(
+        autocompleter, client, clients, EXACT_CACHE_BASE_NAME, [query_key])
+    if cached_results is not None:
+        return autocompleter._load_cached_results(cached_results, local_cache_key, providers, 'exact',
+            utils.get_norm_term_variations(term))
+
+    return await _single_flight(autocompleter, query_key, cache_key,
+        lambda: _exact_suggest(autocompleter, clients, providers, keyspaces, term, cache_key, local_cache_key,
+                               invalidation_counts))
+
+
+async def _exact_suggest(autocompleter, clients, providers, keyspaces, term, cache_key, local_cache_key,
+                         invalidation_counts):
+    norm_terms = utils.get_norm_term_variations(term)
+    if len(norm_terms) == 0:
+        return []
+
+    query_clients = _get_async_clients(autocompleter._get_query_clients(clients, providers))
+    pipes = autocompleter._get_pipelines(None, query_clients)
+    autocompleter._queue_exact_suggest(pipes, query_clients, providers, keyspaces, norm_terms)
+    provider_results, provider_payloads = autocompleter._parse_exact_suggest(
+        await execute_pipelines(pipes), query_clients, providers)
+    results = await _get_results(autocompleter, provider_results, provider_payloads, keyspaces, clients)
+
+    if cache_key is not None:
+        pipe = ASYNC_REDIS.pipeline()
+        autocompleter._queue_cache_results(pipe, cache_key, results, providers, EXACT_CACHE_TAG_BASE_NAME, norm_terms,
+                                           invalidation_counts)
+        await pipe.execute()
+    autocompleter._set_local_cache(local_cache_key, results, providers, 'exact', norm_terms)
+    return results
+
+
+async def _get_keyspaces_and_cached_results(autocompleter, client, clients, cache_base_name, query_keys,
+                                            precomputed_keys=None):
+    pipes = autocompleter._get_pipelines(client, clients)
+    cache_generation = autocompleter._queue_keyspaces_and_cached_results(
+        pipes, client, clients, cache_base_name, query_keys, precomputed_keys)
+    keyspaces, cache_keys, cached_results, invalidation_counts, stale = \
+        autocompleter._parse_keyspaces_and_cached_results(await execute_pipelines(pipes), client, clients,
+                                                          cache_base_name, query_keys, cache_generation,
+                                                          precomputed_keys)
+    if stale:
+        uncached = [i for i, results in enumerate(cached_results) if results is None]
+        pipe = client.pipeline()
+        for i in uncached:
+            pipe.get(cache_keys[i])
+        for i, results in zip(uncached, await pipe.execute()):
+            cached_results[i] = results
+    return keyspaces, cache_keys, cached_results, invalidation_counts
+
+
+async def _get_results(autocompleter, provider_results, provider_payloads, keyspaces, clients):
+    if settings.CLUSTER_MODE:
+        # Payloads could not be fetched along with the result IDs
+        pipes = autocompleter._get_pipelines(None, clients)
+        autocompleter._queue_payloads(pipes, clients, provider_results, keyspaces)
+        provider_payloads = autocompleter._parse_payloads(await execute_pipelines(pipes), clients, provider_results)
+    return autocompleter._get_results_from_payloads(provider_results, provider_payloads)
+
+
+async def _single_flight(autocompleter, key, cache_key, compute):
+    """
+    Same as Autocompleter._single_flight, for a coroutine function compute.
+    """
+    if settings.SINGLE_FLIGHT_LOCK and cache_key is not None:
+        compute_results = compute
+        compute = lambda: _compute_with_lock(autocompleter, cache_key, compute_results)
+    if settings.SINGLE_FLIGHT:
+        return await single_flight.do(key, compute, settings.SINGLE_FLIGHT_TIMEOUT)
+    return await compute()
+
+
+async def _compute_with_lock(autocompleter, cache_key, compute):
+    """
+    Same as Autocompleter._compute_with_lock, for a coroutine function compute.
+    """
+    lock_key = CACHE_LOCK_NAME % (cache_key,)
+    token = str(uuid.uuid4())
+    if await ASYNC_REDIS.set(lock_key, token, nx=True, px=int(settings.SINGLE_FLIGHT_TIMEOUT * 1000)):
+        try:
+            return await compute()
+        finally:
+            await RELEASE_LOCK_SCRIPT(keys=[lock_key], args=[token])
+
+    deadline = time.time() + settings.SINGLE_FLIGHT_TIMEOUT
+    while time.time() < deadline:
+        await asyncio.sleep(CACHE_LOCK_POLL_INTERVAL)
+        pipe = ASYNC_REDIS.pipeline()
+        pipe.get(cache_key)
+        pipe.exists(lock_key)
+        cached_results, locked = await pipe.execute()
+        if cached_results is not None:
+            return autocompleter.__class__._deserialize_data(cached_results)
+        if not locked:
+            break
+    return await compute()
@@ -1,14 +1,20 @@
 from django.apps import AppConfig
 
+from autocompleter.base import check_cluster_mode_settings
+
 
 class SimpleAutocompleterConfig(AppConfig):
     """ Simple AppConfig which does not do automatic discovery. """
     name = 'autocompleter'
     verbose_name = 'Autocompleter'
 
+    def ready(self):
+        check_cluster_mode_settings()
+
 
 class AutocompleterConfig(SimpleAutocompleterConfig):
     """ The default AppConfig for autocompleter which does autodiscovery. """
 
     def ready(self):
         self.module.autodiscover()
+        super(AutocompleterConfig, self).ready()
@@ -0,0 +1,7 @@
+from django.conf.urls import *
+from autocompleter.async_views import AsyncExactSuggestView, AsyncSuggestView
+
+urlpatterns = [
+    url(r'^suggest/(?P<name>[0-9A-Za-z_-]+)$', AsyncSuggestView.as_view(), name='suggest'),
+    url(r'^exact_suggest/(?P<name>[0-9A-Za-z_-]+)$', AsyncExactSuggestView.as_view(), name='exact_suggest'),
+]
@@ -0,0 +1,61 @@
+"""
+Async versions of the views in autocompleter.views, which await Autocompleter.asuggest and
+aexact_suggest instead of blocking a worker thread on Redis. Serve them from an ASGI server,
+see autocompleter.async_urls. Needs Python 3.7.
+"""
+import asyncio
+import json
+
+from django.http import HttpResponse, HttpResponseBadRequest, HttpResponseServerError
+
+from autocompleter import settings
+from autocompleter import Autocompleter
+from autocompleter.views import ExactSuggestView, SuggestView
+
+
+class AsyncViewMixin(object):
+    @classmethod
+    def as_view(cls, **initkwargs):
+        # Django only runs class based views as coroutines from 4.1 on, so the view is wrapped
+        # in a coroutine function for Django to tell it apart
+        view = super(AsyncViewMixin, cls).as_view(**initkwargs)
+
+        async def async_view(request, *args, **kwargs):
+            response = view(request, *args, **kwargs)
+            if asyncio.iscoroutine(response):
+                response = await response
+            return response
+        async_view.view_class = view.view_class
+        async_view.view_initkwargs = view.view_initkwargs
+        return async_view
+
+
+class AsyncSuggestView(AsyncViewMixin, SuggestView):
+    async def get(self, request, name):
+        if settings.SUGGEST_PARAMETER_NAME in request.GET:
+            term = request.GET[settings.SUGGEST_PARAMETER_NAME]
+            ac = Autocompleter(name)
+            if settings.FACET_PARAMETER_NAME in request.GET:
+                facets = request.GET[settings.FACET_PARAMETER_NAME]
+                facets = json.loads(facets)
+                if not self.validate_facets(facets):
+                    return HttpResponseBadRequest('Malformed facet parameter.')
+                results = await ac.asuggest(term, facets=facets)
+            else:
+                results = await ac.asuggest(term)
+
+            json_response = json.dumps(results)
+            return HttpResponse(json_response, content_type='application/json')
+        return HttpResponseServerError('Search parameter not found.')
+
+
+class AsyncExactSuggestView(AsyncViewMixin, ExactSuggestView):
+    async def get(self, request, name):
+        if settings.SUGGEST_PARAMETER_NAME in request.GET:
+            term = request.GET[settings.SUGGEST_PARAMETER_NAME]
+            ac = Autocompleter(name)
+            results = await ac.aexact_suggest(term)
+
+            json_response = json.dumps(results)
+            return HttpResponse(json_response, content_type='application/json')
+        return HttpResponseServerError('Search parameter not found.')
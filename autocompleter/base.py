@@ -1,15 +1,31 @@
 from collections import OrderedDict
 from hashlib import sha1
+import logging
+import functools
+import math
+import multiprocessing
 import redis
 import json
 import itertools
+import sys
+import threading
+import time
+import traceback
 import uuid
 
-from autocompleter import registry, settings, utils
+from django.core.exceptions import ImproperlyConfigured
 
-REDIS = redis.Redis(host=settings.REDIS_CONNECTION['host'],
-    port=settings.REDIS_CONNECTION['port'],
-    db=settings.REDIS_CONNECTION['db'])
+from autocompleter import registry, scripts, settings, utils
+from autocompleter.cache import local_cache, single_flight
+from autocompleter.connections import LazyClient, import_client_class
+
+# Clients are created the first time they are used in each process
+REDIS = LazyClient(settings.REDIS_CONNECTION, cluster=settings.CLUSTER_MODE)
+
+REPLICAS = [LazyClient(connection, cluster=settings.CLUSTER_MODE)
+            for connection in settings.REDIS_REPLICA_CONNECTIONS]
+# Number of seconds between measurements of the replicas' latency, when picking the fastest one
+REPLICA_LATENCY_INTERVAL = 10
 
 if settings.TEST_DATA:
     AUTO_BASE_NAME = 'djac.test.%s'
@@ -19,11 +35,35 @@ else:
     AUTO_BASE_NAME = 'djac.%s'
     RESULT_SET_BASE_NAME = 'djac.results.%s'
 
-CACHE_BASE_NAME = AUTO_BASE_NAME + '.c.%s.%s'
-EXACT_CACHE_BASE_NAME = AUTO_BASE_NAME + '.ce.%s'
+# Cache keys include the autocompleter's cache generation, which clear_cache bumps
+CACHE_BASE_NAME = AUTO_BASE_NAME + '.c.%s.%s.%s'
+EXACT_CACHE_BASE_NAME = AUTO_BASE_NAME + '.ce.%s.%s'
+CACHE_GENERATION_BASE_NAME = AUTO_BASE_NAME + '.cg'
+# Per provider sets of the cache keys of results that may include objects with a given prefix
+# or exact match term, so storing or removing an object only drops the results it can be part of
+CACHE_TAG_BASE_NAME = AUTO_BASE_NAME + '.ct.%s'
+EXACT_CACHE_TAG_BASE_NAME = AUTO_BASE_NAME + '.cte.%s'
+# Per provider count of the times its tagged results were dropped. Results are only cached if it
+# did not change while they were computed, see Autocompleter._queue_cache_results.
+CACHE_INVALIDATIONS_BASE_NAME = AUTO_BASE_NAME + '.ci'
+# Pub/sub channel telling in-process caches of all workers which results to drop
+CACHE_INVALIDATION_CHANNEL = AUTO_BASE_NAME % ('cache_invalidations',)
+# Lock held by the process computing the results missing from a cache key
+CACHE_LOCK_NAME = '%s.lock'
+# Number of seconds between checks of whether a locked cache key has been filled
+CACHE_LOCK_POLL_INTERVAL = 0.01
 
 PREFIX_BASE_NAME = AUTO_BASE_NAME + '.p.%s'
+# Precomputed suggest results of an autocompleter's short prefixes, see Autocompleter.precompute
+PRECOMPUTED_BASE_NAME = AUTO_BASE_NAME + '.pc.%s'
+# Count of the times an autocompleter's results were precomputed, and map of each prefix to the
+# count its precomputed results were computed at, so results computed from older data are never
+# written over those computed from newer data
+PRECOMPUTED_SEQUENCE_NAME = AUTO_BASE_NAME + '.pcs'
+PRECOMPUTED_VERSIONS_NAME = AUTO_BASE_NAME + '.pcv'
 PREFIX_SET_BASE_NAME = AUTO_BASE_NAME + '.ps'
+# Set of the prefixes whose sorted sets had IDs trimmed off by PREFIX_SET_MAX_SIZE
+PREFIX_TRIMMED_SET_BASE_NAME = AUTO_BASE_NAME + '.pt'
 
 EXACT_BASE_NAME = AUTO_BASE_NAME + '.e.%s'
 EXACT_SET_BASE_NAME = AUTO_BASE_NAME + '.es'
@@ -34,8 +74,256 @@ FACET_BASE_NAME = AUTO_BASE_NAME + '.f'
 FACET_SET_BASE_NAME = FACET_BASE_NAME + '.%s.%s'
 FACET_MAP_BASE_NAME = AUTO_BASE_NAME + '.fm'
 
+FINGERPRINT_MAP_BASE_NAME = AUTO_BASE_NAME + '.fp'
+
+# Map of obj_id to score, kept when prefix sets are capped so queries can score objects
+# missing from them
+SCORE_MAP_BASE_NAME = AUTO_BASE_NAME + '.sm'
+
+# Pointer to the generation of a provider's keys that is currently live. Generation 0 lives
+# directly under the provider's key name, later generations under GENERATION_NAME.
+GENERATION_BASE_NAME = AUTO_BASE_NAME + '.gen'
+GENERATION_NAME = '%s.g%s'
+
+# Name a provider's keys are formed from. In cluster mode it is a hash tag, so all keys of a
+# provider, of every generation, and the temporary keys used to query it live in one slot.
+PROVIDER_KEY_NAME = '{%s}' if settings.CLUSTER_MODE else '%s'
+
 RESULT_SET_BASE_NAME = 'djac.results.%s'
 
+logger = logging.getLogger(__name__)
+
+
+def get_script_source(script):
+    """
+    Source of one of the Lua scripts in autocompleter.scripts, preceded by the shared
+    helper functions and the key name templates they use.
+    """
+    key_names = [
+        ('AUTO_BASE_NAME', AUTO_BASE_NAME),
+        ('PREFIX_BASE_NAME', PREFIX_BASE_NAME),
+        ('PREFIX_SET_BASE_NAME', PREFIX_SET_BASE_NAME),
+        ('PREFIX_TRIMMED_SET_BASE_NAME', PREFIX_TRIMMED_SET_BASE_NAME),
+        ('EXACT_BASE_NAME', EXACT_BASE_NAME),
+        ('EXACT_SET_BASE_NAME', EXACT_SET_BASE_NAME),
+        ('TERM_MAP_BASE_NAME', TERM_MAP_BASE_NAME),
+        ('FACET_SET_BASE_NAME', FACET_SET_BASE_NAME),
+        ('FACET_MAP_BASE_NAME', FACET_MAP_BASE_NAME),
+        ('FINGERPRINT_MAP_BASE_NAME', FINGERPRINT_MAP_BASE_NAME),
+        ('SCORE_MAP_BASE_NAME', SCORE_MAP_BASE_NAME),
+        ('GENERATION_NAME', GENERATION_NAME),
+        ('PROVIDER_KEY_NAME', PROVIDER_KEY_NAME),
+        ('CACHE_TAG_BASE_NAME', CACHE_TAG_BASE_NAME),
+        ('EXACT_CACHE_TAG_BASE_NAME', EXACT_CACHE_TAG_BASE_NAME),
+        ('CACHE_INVALIDATIONS_BASE_NAME', CACHE_INVALIDATIONS_BASE_NAME),
+        ('CACHE_INVALIDATION_CHANNEL', CACHE_INVALIDATION_CHANNEL),
+    ]
+    header = ''.join(['local %s = %s\n' % (name, json.dumps(value)) for name, value in key_names])
+    return header + scripts.HELPERS + script
+
+
+# Scripts are sent with EVALSHA, and loaded with SCRIPT LOAD the first time Redis does not know them
+STORE_SCRIPT = REDIS.register_script(get_script_source(scripts.STORE))
+REMOVE_SCRIPT = REDIS.register_script(get_script_source(scripts.REMOVE))
+ADD_CAPPED_SCRIPT = REDIS.register_script(get_script_source(scripts.ADD_CAPPED))
+REMOVE_MEMBER_SCRIPT = REDIS.register_script(get_script_source(scripts.REMOVE_MEMBER))
+INVALIDATE_SCRIPT = REDIS.register_script(get_script_source(scripts.INVALIDATE))
+CACHE_RESULTS_SCRIPT = REDIS.register_script(get_script_source(scripts.CACHE_RESULTS))
+SET_PRECOMPUTED_SCRIPT = REDIS.register_script(get_script_source(scripts.SET_PRECOMPUTED))
+RANGE_SCRIPT = REDIS.register_script(get_script_source(scripts.RANGE))
+QUERY_SCRIPT = REDIS.register_script(get_script_source(scripts.QUERY))
+RELEASE_LOCK_SCRIPT = REDIS.register_script(get_script_source(scripts.RELEASE_LOCK))
+
+
+def get_provider_key_name(provider_name):
+    """
+    Name that takes the place of the provider name in the keys of a provider that are not
+    specific to a generation, see PROVIDER_KEY_NAME.
+    """
+    return PROVIDER_KEY_NAME % (provider_name,)
+
+
+def get_keyspace_name(provider_name, generation=0):
+    """
+    Name that takes the place of the provider name in all of a provider's keys
+    for the given generation.
+    """
+    if generation == 0:
+        return get_provider_key_name(provider_name)
+    return GENERATION_NAME % (get_provider_key_name(provider_name), generation,)
+
+
+# Clients of the servers of providers whose REDIS_CONNECTION setting differs from the global one,
+# by connection parameters
+_provider_clients = {}
+
+
+def get_provider_client(provider):
+    """
+    Client of the Redis server holding a provider's keys: REDIS, unless the provider's
+    REDIS_CONNECTION setting points to another server.
+    """
+    connection = registry.get_provider_setting(provider, 'REDIS_CONNECTION')
+    if connection == settings.REDIS_CONNECTION:
+        return REDIS
+    key = json.dumps(connection, sort_keys=True)
+    client = _provider_clients.get(key)
+    if client is None:
+        client = _provider_clients.setdefault(key, LazyClient(connection, cluster=settings.CLUSTER_MODE))
+    return client
+
+
+def execute_pipelines(pipes):
+    """
+    Execute pipelines of different servers concurrently, so the round trips take as long as the
+    slowest server rather than adding up. Returns the results of each pipeline, in order.
+    """
+    results = [None] * len(pipes)
+    errors = []
+
+    def execute(i):
+        try:
+            results[i] = pipes[i].execute()
+        except Exception as e:
+            errors.append(e)
+    threads = [threading.Thread(target=execute, args=(i,)) for i in range(1, len(pipes))]
+    for thread in threads:
+        thread.start()
+    if len(pipes) > 0:
+        execute(0)
+    for thread in threads:
+        thread.join()
+    if len(errors) > 0:
+        raise errors[0]
+    return results
+
+
+_replica_counter = itertools.count()
+_replica_latencies = {'measured_at': None, 'latencies': [], 'thread': None}
+_replica_latencies_lock = threading.Lock()
+
+
+def get_read_client():
+    """
+    Client to send reads to: one of the read replicas in REDIS_REPLICA_CONNECTIONS, picked in
+    turn or by lowest latency depending on REDIS_REPLICA_SELECTION, or the primary when there are
+    none. With least latency selection, the primary is used when no replica can be reached, and
+    replicas are used in turn until their latency was first measured.
+    """
+    if len(REPLICAS) == 0:
+        return REDIS
+    if settings.REDIS_REPLICA_SELECTION == 'least_latency':
+        latencies = get_replica_latencies()
+        if len(latencies) == len(REPLICAS):
+            reachable = [i for i, latency in enumerate(latencies) if latency is not None]
+            if len(reachable) == 0:
+                return REDIS
+            return REPLICAS[min(reachable, key=lambda i: latencies[i])]
+    return REPLICAS[next(_replica_counter) % len(REPLICAS)]
+
+
+def get_replica_latencies():
+    """
+    Round trip time of a PING to each replica in seconds, or None for replicas that can not be
+    reached, as last measured, or an empty list until they first were. They are measured in a
+    background thread at most every REPLICA_LATENCY_INTERVAL seconds, so callers never wait for
+    a replica, which would block the event loop of asyncio callers.
+    """
+    now = time.time()
+    with _replica_latencies_lock:
+        measured_at = _replica_latencies['measured_at']
+        thread = _replica_latencies['thread']
+        if (measured_at is None or now - measured_at >= REPLICA_LATENCY_INTERVAL) and \
+                (thread is None or not thread.is_alive()):
+            _replica_latencies['measured_at'] = now
+            thread = _replica_latencies['thread'] = threading.Thread(
+                target=_measure_replica_latencies, name='autocompleter-replica-latencies')
+            thread.daemon = True
+            thread.start()
+    return _replica_latencies['latencies']
+
+
+def _measure_replica_latencies():
+    latencies = []
+    for replica in list(REPLICAS):
+        start = time.time()
+        try:
+            replica.ping()
+            latencies.append(time.time() - start)
+        except redis.RedisError:
+            latencies.append(None)
+    _replica_latencies['latencies'] = latencies
+
+
+def publish_cache_invalidation(client, message):
+    """
+    Drop the entries of this process's in-process cache affected by an invalidation message (see
+    LocalResultCache.invalidate), and publish it so every other process does the same. Nothing
+    happens when the in-process cache is off. The client may be a pipeline.
+    """
+    if not settings.LOCAL_CACHE_SIZE:
+        return
+    local_cache.invalidate(message)
+    client.publish(CACHE_INVALIDATION_CHANNEL, json.dumps(message))
+
+
+def check_cluster_mode_settings():
+    """
+    Raise ImproperlyConfigured if CLUSTER_MODE is on along with settings cluster mode does not
+    support, set globally or for any registered provider, or with a redis-py without a cluster client.
+    """
+    if not settings.CLUSTER_MODE:
+        return
+    import_client_class('redis.cluster', 'RedisCluster', '4.1')
+    unsupported = [setting_name for setting_name in ('LUA_WRITES', 'READ_ONLY_QUERIES')
+                   if getattr(settings, setting_name)]
+    for provider in registry.get_all_providers():
+        unsupported += [setting_name for setting_name in
+                        ('INVALIDATE_CACHE_ON_STORE', 'PREFIX_SET_MAX_SIZE', 'STOP_WORDS', 'STOP_WORD_MIN_SHARE')
+                        if registry.get_provider_setting(provider, setting_name) and setting_name not in unsupported]
+    if len(unsupported) > 0:
+        raise ImproperlyConfigured('AUTOCOMPLETER_CLUSTER_MODE does not support %s' % (', '.join(unsupported),))
+
+
+def get_aio():
+    """
+    The autocompleter.aio module, whose coroutines need Python 3.7 and redis-py 4.2 or later. It
+    is only imported when used, so the rest of the package keeps working on older versions.
+    """
+    if sys.version_info < (3, 7):
+        raise ImproperlyConfigured('asuggest and aexact_suggest need Python 3.7 or later')
+    import_client_class('redis.asyncio', 'Redis', '4.2')
+    from autocompleter import aio
+    return aio
+
+
+def _init_store_worker():
+    """
+    Get a store_all worker process ready to use Django. This is a no-op when the worker
+    was forked from an already set up process.
+    """
+    import django
+    from django.apps import apps
+    if not apps.ready:
+        django.setup()
+
+
+def _store_partition(args):
+    """
+    Store one partition of a provider's objects. Runs inside a store_all worker process,
+    which opens its own database and Redis connections. Returns the provider name, the number
+    of objects stored and the formatted traceback of the error that stopped the partition, if any.
+    """
+    provider_class, partition, delete_old, batch_size, generation = args
+    num_stored = 0
+    try:
+        iterator = provider_class.get_partition_iterator(partition)
+        for chunk in Autocompleter.chunk_iterator(iterator, batch_size):
+            num_stored += provider_class.store_many(chunk, delete_old=delete_old, generation=generation)
+    except Exception:
+        return provider_class.provider_name, num_stored, traceback.format_exc()
+    return provider_class.provider_name, num_stored, None
+
 
 class AutocompleterBase(object):
     @classmethod
@@ -156,84 +444,183 @@ class AutocompleterProviderBase(AutocompleterBase):
         return cls.provider_name
 
     @classmethod
-    def get_old_norm_terms(cls, obj_id):
-        key = TERM_MAP_BASE_NAME % (cls.get_provider_name(),)
-        old_terms = REDIS.hget(key, obj_id)
+    def get_generation(cls):
+        """
+        The generation of this provider's keys that is currently live.
+        DO NOT override this.
+        """
+        generation = cls.get_client().get(GENERATION_BASE_NAME % (get_provider_key_name(cls.get_provider_name()),))
+        if generation is None:
+            return 0
+        return int(generation)
+
+    @classmethod
+    def get_client(cls):
+        """
+        Client of the Redis server holding this provider's keys, see the REDIS_CONNECTION setting.
+        DO NOT override this.
+        """
+        return get_provider_client(cls)
+
+    @classmethod
+    def get_keyspace_name(cls, generation=None):
+        """
+        Name used in place of the provider name in the keys of the given generation,
+        defaulting to the live generation.
+        DO NOT override this.
+        """
+        if generation is None:
+            generation = cls.get_generation()
+        return get_keyspace_name(cls.get_provider_name(), generation)
+
+    @classmethod
+    def get_old_norm_terms(cls, obj_id, generation=None):
+        key = TERM_MAP_BASE_NAME % (cls.get_keyspace_name(generation),)
+        old_terms = cls.get_client().hget(key, obj_id)
         if old_terms is not None:
             old_terms = cls._deserialize_data(old_terms)
         return old_terms
 
     @classmethod
-    def get_old_facets(cls, obj_id):
-        facet_map_name = FACET_MAP_BASE_NAME % (cls.get_provider_name(),)
-        old_facets = REDIS.hget(facet_map_name, obj_id)
+    def get_old_facets(cls, obj_id, generation=None):
+        facet_map_name = FACET_MAP_BASE_NAME % (cls.get_keyspace_name(generation),)
+        old_facets = cls.get_client().hget(facet_map_name, obj_id)
         if old_facets is not None:
             old_facets = cls._deserialize_data(old_facets)
         return old_facets
 
     @classmethod
-    def clear_facets(cls, obj_id, old_facets):
+    def get_old_state_many(cls, obj_ids, generation=None):
+        """
+        For a list of object IDs, fetch the old norm terms, old facets and old fingerprint of
+        every object in a single round trip. Returns three dicts keyed by object ID.
+        """
+        keyspace = cls.get_keyspace_name(generation)
+        pipe = cls.get_client().pipeline()
+        pipe.hmget(TERM_MAP_BASE_NAME % (keyspace,), obj_ids)
+        pipe.hmget(FACET_MAP_BASE_NAME % (keyspace,), obj_ids)
+        pipe.hmget(FINGERPRINT_MAP_BASE_NAME % (keyspace,), obj_ids)
+        raw_norm_terms, raw_facets, raw_fingerprints = pipe.execute()
+
+        old_norm_terms = {}
+        old_facets = {}
+        old_fingerprints = {}
+        for obj_id, norm_terms, facets, fingerprint in zip(obj_ids, raw_norm_terms, raw_facets, raw_fingerprints):
+            if norm_terms is not None:
+                old_norm_terms[obj_id] = cls._deserialize_data(norm_terms)
+            if facets is not None:
+                old_facets[obj_id] = cls._deserialize_data(facets)
+            if fingerprint is not None:
+                old_fingerprints[obj_id] = fingerprint.decode('utf-8')
+        return old_norm_terms, old_facets, old_fingerprints
+
+    @staticmethod
+    def _get_fingerprint(norm_terms, exact_terms, score, facet_dicts, data):
+        """
+        A compact fingerprint of everything store writes for an object. The first half covers
+        what gets indexed (norm terms, exact terms, score and facets) and the second half the data
+        payload, so a change to the payload alone can leave the index untouched.
+        """
+        def sha1_digest(value):
+            return sha1(json.dumps(value, sort_keys=True).encode('utf-8')).hexdigest()[:20]
+
+        return sha1_digest([norm_terms, exact_terms, score, facet_dicts]) + sha1_digest(data)
+
+    @classmethod
+    def clear_facets(cls, obj_id, old_facets, generation=None):
         """
         For a given object ID, delete old facet data from Redis.
         """
-        provider_name = cls.get_provider_name()
-        pipe = REDIS.pipeline()
+        pipe = cls.get_client().pipeline()
+        cls._clear_facets(pipe, obj_id, old_facets, cls.get_keyspace_name(generation))
+        pipe.execute()
+
+    @classmethod
+    def _clear_facets(cls, pipe, obj_id, old_facets, keyspace):
+        """
+        Queue the deletion of an object's old facet data on the given pipeline.
+        """
         # Remove old facets from the corresponding facet sorted set containing scores
         for facet in old_facets:
             try:
                 facet_name = facet['key']
                 facet_value = facet['value']
-                facet_set_name = FACET_SET_BASE_NAME % (provider_name, facet_name, facet_value,)
+                facet_set_name = FACET_SET_BASE_NAME % (keyspace, facet_name, facet_value,)
                 pipe.zrem(facet_set_name, obj_id)
             except KeyError:
                 continue
         # Now delete the mapping from obj_id -> facets
-        facet_map_name = FACET_MAP_BASE_NAME % (provider_name,)
+        facet_map_name = FACET_MAP_BASE_NAME % (keyspace,)
         pipe.hdel(facet_map_name, obj_id)
 
-        # End pipeline
+    @classmethod
+    def clear_keys(cls, obj_id, old_norm_terms, generation=None):
+        """
+        For a given object ID, delete old norm terms from Redis.
+        """
+        pipe = cls.get_client().pipeline()
+        cls._clear_keys(pipe, obj_id, old_norm_terms, cls.get_keyspace_name(generation))
         pipe.execute()
 
     @classmethod
-    def clear_keys(cls, obj_id, old_norm_terms):
+    def _clear_keys(cls, pipe, obj_id, old_norm_terms, keyspace):
         """
-        For a given object ID, delete old norm terms from Redis.
+        Queue the deletion of an object's old norm terms on the given pipeline.
         """
-        provider_name = cls.get_provider_name()
-        # Start pipeline
-        pipe = REDIS.pipeline()
         # Processes prefixes of object, removing object ID from sorted sets
-        for norm_term in old_norm_terms:
-            norm_words = norm_term.split(' ')
-            for norm_word in norm_words:
-                word_prefix = ''
-                for char in norm_word:
-                    word_prefix += char
-                    key = PREFIX_BASE_NAME % (provider_name, word_prefix,)
-                    pipe.zrem(key, obj_id)
-
-                    key = PREFIX_SET_BASE_NAME % (provider_name,)
-                    pipe.srem(key, word_prefix)
+        prefix_set_name = PREFIX_SET_BASE_NAME % (keyspace,)
+        for word_prefix in utils.get_norm_term_prefixes(old_norm_terms):
+            key = PREFIX_BASE_NAME % (keyspace, word_prefix,)
+            cls._queue_remove_member(pipe, key, prefix_set_name, word_prefix, obj_id)
 
         # Process normalized terms of object, removing object ID from a sorted set
         # representing exact matches
-        for norm_term in old_norm_terms:
-            key = EXACT_BASE_NAME % (provider_name, norm_term,)
-            pipe.zrem(key, obj_id)
-
-            key = EXACT_SET_BASE_NAME % (provider_name,)
-            pipe.srem(key, norm_term)
+        exact_set_name = EXACT_SET_BASE_NAME % (keyspace,)
+        for norm_term in set(old_norm_terms):
+            key = EXACT_BASE_NAME % (keyspace, norm_term,)
+            cls._queue_remove_member(pipe, key, exact_set_name, norm_term, obj_id)
 
         # Remove model ID to data mapping
-        key = AUTO_BASE_NAME % (provider_name,)
+        key = AUTO_BASE_NAME % (keyspace,)
         pipe.hdel(key, obj_id)
 
         # Remove obj_id to terms mapping
-        key = TERM_MAP_BASE_NAME % (provider_name,)
+        key = TERM_MAP_BASE_NAME % (keyspace,)
         pipe.hdel(key, obj_id)
 
-        # End pipeline
-        pipe.execute()
+        # Remove obj_id to fingerprint mapping
+        key = FINGERPRINT_MAP_BASE_NAME % (keyspace,)
+        pipe.hdel(key, obj_id)
+
+        # Remove obj_id to score mapping, kept when prefix sets are capped
+        key = SCORE_MAP_BASE_NAME % (keyspace,)
+        pipe.hdel(key, obj_id)
+
+    @classmethod
+    def _invalidate_cache(cls, client, norm_terms, exact_terms, publish=True):
+        """
+        If the provider's INVALIDATE_CACHE_ON_STORE setting is on, drop the cached results an
+        object with the given norm terms and exact match terms may be part of. Cached suggest
+        results are tagged with the longest word of their query, which any object matching the
+        query has a prefix equal to, and cached exact_suggest results with their norm terms.
+        Unless told not to, also publish the change to in-process caches. The client may be
+        a pipeline.
+        """
+        provider_name = cls.get_provider_name()
+        if publish:
+            publish_cache_invalidation(client, {
+                'provider': provider_name,
+                'norm_terms': sorted(set(norm_terms)),
+                'exact_terms': sorted(set(exact_terms)),
+            })
+        if not registry.get_provider_setting(cls, 'INVALIDATE_CACHE_ON_STORE'):
+            return
+        provider_key_name = get_provider_key_name(provider_name)
+        keys = [CACHE_TAG_BASE_NAME % (provider_key_name, word_prefix,)
+                for word_prefix in utils.get_norm_term_prefixes(norm_terms)]
+        keys += [EXACT_CACHE_TAG_BASE_NAME % (provider_key_name, norm_term,) for norm_term in set(exact_terms)]
+        if len(keys) > 0:
+            INVALIDATE_SCRIPT(keys=[CACHE_INVALIDATIONS_BASE_NAME % (provider_key_name,)] + keys, client=client)
 
     @classmethod
     def get_facets(cls):
@@ -257,120 +644,411 @@ class AutocompleterProviderBase(AutocompleterBase):
         """
         return True
 
-    def store(self, delete_old=True):
+    @classmethod
+    def get_partitions(cls, num_partitions):
+        """
+        Split the objects returned by get_iterator into at most num_partitions partitions that can
+        be stored in parallel. Each partition must be picklable and understood by
+        get_partition_iterator. By default partitions are slices of the iterator.
+        """
+        items = cls.get_iterator()
+        try:
+            num_items = len(items)
+        except TypeError:
+            num_items = sum(1 for item in items)
+        if num_items == 0:
+            return []
+        partition_size = int(math.ceil(num_items / float(num_partitions)))
+        return [slice(start, start + partition_size) for start in range(0, num_items, partition_size)]
+
+    @classmethod
+    def get_partition_iterator(cls, partition):
+        """
+        Get an iterator over the objects of a single partition returned by get_partitions.
+        """
+        return itertools.islice(cls.get_iterator(), partition.start, partition.stop)
+
+    def store(self, delete_old=True, generation=None):
         """
-        Add an object to the autocompleter
+        Add an object to the autocompleter, in the given generation of keys which
+        defaults to the live generation.
         DO NOT override this.
         """
-        # Init data
         if not self.include_item():
             return
-        provider_name = self.get_provider_name()
         obj_id = self.get_item_id()
+        # Precomputed results are only kept for the live generation
+        autocompleters = self.__class__._get_precomputing_autocompleters() if generation is None else []
+        if self.__class__._use_lua_writes():
+            old_norm_terms = None
+            if len(autocompleters) > 0:
+                old_norm_terms = self.__class__.get_old_norm_terms(obj_id)
+            self._store_script(REDIS, obj_id, generation, delete_old=delete_old)
+            self.__class__._update_precomputed(autocompleters,
+                (old_norm_terms or []) + self.__class__._get_norm_terms(self.get_terms()))
+            return
+        if generation is None:
+            generation = self.__class__.get_generation()
+        old_norm_terms, old_facets, old_fingerprints = \
+            self.__class__.get_old_state_many([obj_id], generation)
+
+        pipe, cache_pipe = self.__class__._get_write_pipelines()
+        norm_terms, facet_dicts, fingerprint = self._store(pipe, obj_id, old_norm_terms.get(obj_id),
+            old_facets.get(obj_id), old_fingerprints.get(obj_id), get_keyspace_name(self.provider_name, generation),
+            delete_old=delete_old, cache_pipe=cache_pipe)
+        self.__class__._execute_write_pipelines(pipe, cache_pipe)
+        if fingerprint != old_fingerprints.get(obj_id):
+            self.__class__._update_precomputed(autocompleters, (old_norm_terms.get(obj_id) or []) + norm_terms)
+
+    @classmethod
+    def store_many(cls, objs, delete_old=True, generation=None):
+        """
+        Add a batch of objects to the autocompleter. The old state of every object in the
+        batch is fetched up front and all writes are sent in a single pipeline, so a batch
+        costs at most two round trips no matter how many objects it holds.
+        Returns the number of objects stored.
+        DO NOT override this.
+        """
+        providers = [cls(obj) for obj in objs]
+        providers = [provider for provider in providers if provider.include_item()]
+        if len(providers) == 0:
+            return 0
+        obj_ids = [provider.get_item_id() for provider in providers]
+        # Precomputed results are only kept for the live generation
+        autocompleters = cls._get_precomputing_autocompleters() if generation is None else []
+        # Rather than one invalidation message per object, in-process caches get a single one
+        # dropping all of the provider's results
+        if cls._use_lua_writes():
+            old_norm_terms = {}
+            if len(autocompleters) > 0:
+                old_norm_terms = cls.get_old_state_many(obj_ids)[0]
+            pipe = REDIS.pipeline()
+            for provider, obj_id in zip(providers, obj_ids):
+                provider._store_script(pipe, obj_id, generation, delete_old=delete_old, publish_invalidation=False)
+            publish_cache_invalidation(pipe, {'provider': cls.get_provider_name()})
+            pipe.execute()
+            cls._update_precomputed(autocompleters, list(itertools.chain.from_iterable(
+                (old_norm_terms.get(obj_id) or []) + cls._get_norm_terms(provider.get_terms())
+                for provider, obj_id in zip(providers, obj_ids))))
+            return len(providers)
+        if generation is None:
+            generation = cls.get_generation()
+        keyspace = cls.get_keyspace_name(generation)
+        old_norm_terms, old_facets, old_fingerprints = cls.get_old_state_many(obj_ids, generation)
+
+        pipe, cache_pipe = cls._get_write_pipelines()
+        changed = False
+        # Norm terms, old and new, of the objects that changed
+        changed_norm_terms = []
+        for provider, obj_id in zip(providers, obj_ids):
+            norm_terms, facet_dicts, fingerprint = provider._store(pipe, obj_id, old_norm_terms.get(obj_id),
+                old_facets.get(obj_id), old_fingerprints.get(obj_id), keyspace, delete_old=delete_old,
+                publish_invalidation=False, cache_pipe=cache_pipe)
+            if fingerprint != old_fingerprints.get(obj_id):
+                changed = True
+                changed_norm_terms += (old_norm_terms.get(obj_id) or []) + norm_terms
+            # If the same object shows up again later in the batch, what we just queued is
+            # its old state, not what we fetched from Redis.
+            old_norm_terms[obj_id] = norm_terms
+            old_facets[obj_id] = facet_dicts if len(facet_dicts) > 0 else None
+            old_fingerprints[obj_id] = fingerprint
+        if changed:
+            publish_cache_invalidation(cache_pipe, {'provider': cls.get_provider_name()})
+        cls._execute_write_pipelines(pipe, cache_pipe)
+        cls._update_precomputed(autocompleters, changed_norm_terms)
+        return len(providers)
+
+    @classmethod
+    def _get_precomputing_autocompleters(cls):
+        """
+        The autocompleters this provider is registered with that precompute the results of
+        short prefixes, see Autocompleter.precompute.
+        """
+        return [Autocompleter(ac_name) for ac_name in registry.get_autocompleters_by_provider(cls)
+                if registry.get_autocompleter_setting(ac_name, 'PRECOMPUTE_PREFIX_LENGTH')]
+
+    @staticmethod
+    def _update_precomputed(autocompleters, norm_terms):
+        """
+        Recompute the precomputed results of the given autocompleters that objects with the
+        given norm terms may be part of.
+        """
+        if len(autocompleters) == 0 or len(norm_terms) == 0:
+            return
+        prefixes = utils.get_norm_term_prefixes(norm_terms)
+        for autocompleter in autocompleters:
+            autocompleter.precompute(prefixes)
+
+    @classmethod
+    def _use_lua_writes(cls):
+        """
+        Whether objects are written with the store and remove scripts. The scripts also drop the
+        cached results objects may be part of, which live on the default server, so they are only
+        used for providers whose keys live there too.
+        """
+        return settings.LUA_WRITES and cls.get_client() is REDIS
+
+    @classmethod
+    def _get_write_pipelines(cls):
+        """
+        A pipeline of this provider's server to queue the writes storing objects on, and one of
+        the default server to queue dropping the cached results they may be part of. Both are
+        the same pipeline when this provider's keys live on the default server.
+        """
+        pipe = cls.get_client().pipeline()
+        if cls.get_client() is REDIS:
+            return pipe, pipe
+        return pipe, REDIS.pipeline()
+
+    @staticmethod
+    def _execute_write_pipelines(pipe, cache_pipe):
+        """
+        Execute the pipelines returned by _get_write_pipelines, dropping cached results once
+        the objects are written.
+        """
+        pipe.execute()
+        if cache_pipe is not pipe:
+            cache_pipe.execute()
+
+    def _get_store_state(self):
+        """
+        Everything store writes for this object: its norm terms, the set of those short enough
+        to be exact matches, its score, data payload, facet dicts and fingerprint.
+        """
+        # Init data
         terms = self.get_terms()
         norm_terms = self.__class__._get_norm_terms(terms)
         score = self._get_score()
         data = self.get_data()
         facets = self.get_facets()
 
-        # Get all the facet values from the data dict
+        # Get all the facet values from the data dict, formatted the way facet set names are built
+        # here, so the store script builds the same names from them without formatting them itself
         facet_dicts = []
         for facet in facets:
             try:
-                facet_dicts.append({'key': facet, 'value': data[facet]})
+                facet_dicts.append({'key': '%s' % (facet,), 'value': '%s' % (data[facet],)})
             except KeyError:
                 continue
 
-        old_norm_terms = self.__class__.get_old_norm_terms(obj_id)
-        old_facets = self.__class__.get_old_facets(obj_id)
+        # Terms short enough to be exact matches
+        max_exact_match_words = registry.get_provider_setting(self, 'MAX_EXACT_MATCH_WORDS')
+        exact_terms = set()
+        if max_exact_match_words > 0:
+            exact_terms = set([norm_term for norm_term in norm_terms
+                               if len(norm_term.split(' ')) <= max_exact_match_words])
 
-        norm_terms_updated = norm_terms != old_norm_terms
-        facets_updated = facets != old_facets
+        fingerprint = self._get_fingerprint(norm_terms, sorted(exact_terms), score, facet_dicts, data)
+        return norm_terms, exact_terms, score, data, facet_dicts, fingerprint
 
-        # Check if the terms or facets have been updated. If both weren't updated,
-        # then we can just update the data payload and short circuit.
-        if not norm_terms_updated and not facets_updated:
+    def _store_script(self, client, obj_id, generation=None, delete_old=True, publish_invalidation=True):
+        """
+        Store this object with the store script, which looks up the object's old state, diffs
+        it against the new one and writes the difference atomically inside Redis. The client may
+        be a pipeline. A generation of None is resolved to the live one by the script itself.
+        """
+        cls = self.__class__
+        norm_terms, exact_terms, score, data, facet_dicts, fingerprint = self._get_store_state()
+        # The script publishes the invalidation message for the object's old and new terms. Only
+        # the new ones are known here, so this process's own cache gets the rest from the channel.
+        publish_invalidation = publish_invalidation and bool(settings.LOCAL_CACHE_SIZE)
+        if publish_invalidation:
+            local_cache.invalidate({
+                'provider': cls.get_provider_name(), 'norm_terms': norm_terms, 'exact_terms': exact_terms,
+            })
+        STORE_SCRIPT(keys=[GENERATION_BASE_NAME % (get_provider_key_name(cls.get_provider_name()),)], args=[
+            cls.get_provider_name(), '' if generation is None else generation, obj_id, 1 if delete_old else 0,
+            fingerprint, repr(score), cls._serialize_data(norm_terms), cls._serialize_data(sorted(exact_terms)),
+            cls._serialize_data(facet_dicts), cls._serialize_data(data),
+            1 if registry.get_provider_setting(cls, 'INVALIDATE_CACHE_ON_STORE') else 0,
+            1 if publish_invalidation else 0,
+            registry.get_provider_setting(cls, 'PREFIX_SET_MAX_SIZE'),
+        ], client=client)
+
+    def _store(self, pipe, obj_id, old_norm_terms, old_facets, old_fingerprint, keyspace, delete_old=True,
+               publish_invalidation=True, cache_pipe=None):
+        """
+        Queue all the writes needed to store this object in the given keyspace on the given
+        pipeline, given the object's old norm terms, facets and fingerprint. Nothing is written
+        when the fingerprint is unchanged, and otherwise only the difference between the old and
+        new prefixes, exact terms and facets is written. Dropping the cached results the object
+        may be part of is queued on cache_pipe, which defaults to the same pipeline. Returns the
+        new norm terms, facet dicts and fingerprint.
+        """
+        if cache_pipe is None:
+            cache_pipe = pipe
+        norm_terms, new_exact_terms, score, data, facet_dicts, fingerprint = self._get_store_state()
+
+        # If nothing changed since the object was last stored, there is nothing to write. If only
+        # the data payload changed, we can just update it and short circuit.
+        if fingerprint == old_fingerprint:
+            return norm_terms, facet_dicts, fingerprint
+        fingerprint_map_name = FINGERPRINT_MAP_BASE_NAME % (keyspace,)
+        if old_fingerprint is not None and fingerprint[:20] == old_fingerprint[:20]:
             # Store obj ID to data mapping
-            key = AUTO_BASE_NAME % (provider_name,)
-            REDIS.hset(key, obj_id, self.__class__._serialize_data(data))
-            return
-
-        # Clear out the obj_id's old data if told to
-        if delete_old is True:
-            # TODO: memoize get_old_terms? Otherwise have to pass old_terms down the line to avoid
-            # doing 2 extra redis queries.
-            if norm_terms_updated and old_norm_terms is not None:
-                self.__class__.clear_keys(obj_id, old_norm_terms)
-            if facets_updated and old_facets is not None:
-                self.__class__.clear_facets(obj_id, old_facets)
+            key = AUTO_BASE_NAME % (keyspace,)
+            pipe.hset(key, obj_id, self.__class__._serialize_data(data))
+            pipe.hset(fingerprint_map_name, obj_id, fingerprint)
+            self.__class__._invalidate_cache(cache_pipe, norm_terms, new_exact_terms, publish=publish_invalidation)
+            return norm_terms, facet_dicts, fingerprint
 
-        # Start pipeline
-        pipe = REDIS.pipeline()
-
-        # Processes prefixes of object, placing object ID in sorted sets
-        for norm_term in norm_terms:
-            norm_words = norm_term.split(' ')
-            for norm_word in norm_words:
-                word_prefix = ''
-                for char in norm_word:
-                    word_prefix += char
-                    # Store prefix to obj ID mapping, with score
-                    key = PREFIX_BASE_NAME % (provider_name, word_prefix,)
-                    pipe.zadd(key, {obj_id: score})
-                    # Store autocompleter to prefix mapping so we know all prefixes
-                    # of an autocompleter
-                    key = PREFIX_SET_BASE_NAME % (provider_name,)
-                    pipe.sadd(key, word_prefix)
-
-        # Process normalized term of object, placing object ID in a sorted set
-        # representing exact matches
-        max_exact_match_words = registry.get_provider_setting(self, 'MAX_EXACT_MATCH_WORDS')
-        if max_exact_match_words > 0:
-            for norm_term in norm_terms:
-                if len(norm_term.split(' ')) > max_exact_match_words:
-                    continue
-                # Store exact term to obj ID mapping, with score
-                key = EXACT_BASE_NAME % (provider_name, norm_term,)
+        norm_terms_updated = norm_terms != old_norm_terms
+        # Cached results the object may have been part of before or may be part of now
+        cache_norm_terms = (old_norm_terms or []) + norm_terms
+        cache_exact_terms = set(old_norm_terms or []) | new_exact_terms
+
+        # When not told to clear out the obj_id's old data, act as if there was none
+        if delete_old is not True:
+            old_norm_terms = None
+            old_facets = None
+
+        # Processes prefixes of object. The object ID is removed from the sorted sets of prefixes
+        # it no longer has and placed in the sorted sets of its new prefixes. For prefixes
+        # it keeps, only its score is updated. When prefix sets are capped, the object is placed
+        # in the sorted sets of all of its prefixes, as it may have been trimmed off of them.
+        prefix_set_max_size = registry.get_provider_setting(self, 'PREFIX_SET_MAX_SIZE')
+        old_prefixes = utils.get_norm_term_prefixes(old_norm_terms or [])
+        new_prefixes = utils.get_norm_term_prefixes(norm_terms)
+        prefix_set_name = PREFIX_SET_BASE_NAME % (keyspace,)
+        for word_prefix in old_prefixes - new_prefixes:
+            key = PREFIX_BASE_NAME % (keyspace, word_prefix,)
+            self.__class__._queue_remove_member(pipe, key, prefix_set_name, word_prefix, obj_id)
+        for word_prefix in new_prefixes - old_prefixes:
+            # Store prefix to obj ID mapping, with score
+            key = PREFIX_BASE_NAME % (keyspace, word_prefix,)
+            if prefix_set_max_size:
+                self.__class__._queue_add_capped(pipe, key, keyspace, word_prefix, obj_id, score,
+                                                 prefix_set_max_size)
+            else:
                 pipe.zadd(key, {obj_id: score})
-
-                # Store autocompleter to exact term mapping so we know all exact terms
-                # of an autocompleter
-                key = EXACT_SET_BASE_NAME % (provider_name,)
-                pipe.sadd(key, norm_term)
-
-        for facet in facet_dicts:
-            key = FACET_SET_BASE_NAME % (provider_name, facet['key'], facet['value'],)
+            # Store autocompleter to prefix mapping so we know all prefixes
+            # of an autocompleter
+            pipe.sadd(prefix_set_name, word_prefix)
+        for word_prefix in new_prefixes & old_prefixes:
+            key = PREFIX_BASE_NAME % (keyspace, word_prefix,)
+            if prefix_set_max_size:
+                self.__class__._queue_add_capped(pipe, key, keyspace, word_prefix, obj_id, score,
+                                                 prefix_set_max_size)
+            else:
+                pipe.zadd(key, {obj_id: score}, xx=True)
+
+        # Process normalized terms of object, placing object ID in sorted sets representing
+        # exact matches. Old terms the object no longer exactly matches are removed.
+        old_exact_terms = set(old_norm_terms or [])
+        exact_set_name = EXACT_SET_BASE_NAME % (keyspace,)
+        for norm_term in old_exact_terms - new_exact_terms:
+            key = EXACT_BASE_NAME % (keyspace, norm_term,)
+            self.__class__._queue_remove_member(pipe, key, exact_set_name, norm_term, obj_id)
+        for norm_term in new_exact_terms:
+            # Store exact term to obj ID mapping, with score
+            key = EXACT_BASE_NAME % (keyspace, norm_term,)
+            pipe.zadd(key, {obj_id: score})
+            # Store autocompleter to exact term mapping so we know all exact terms
+            # of an autocompleter
+            if norm_term not in old_exact_terms:
+                pipe.sadd(exact_set_name, norm_term)
+
+        # Same for facets: drop the object from facet sets it left, and add it to or update
+        # its score in the ones it is in now
+        old_facet_keys = set()
+        for facet in old_facets or []:
+            try:
+                old_facet_keys.add(FACET_SET_BASE_NAME % (keyspace, facet['key'], facet['value'],))
+            except KeyError:
+                continue
+        new_facet_keys = set([FACET_SET_BASE_NAME % (keyspace, facet['key'], facet['value'],)
+                              for facet in facet_dicts])
+        for key in old_facet_keys - new_facet_keys:
+            pipe.zrem(key, obj_id)
+        for key in new_facet_keys:
             pipe.zadd(key, {obj_id: score})
 
         # Map provider's obj_id -> data payload
-        key = AUTO_BASE_NAME % (provider_name,)
+        key = AUTO_BASE_NAME % (keyspace,)
         pipe.hset(key, obj_id, self.__class__._serialize_data(data))
 
         # Map provider's obj_id -> norm terms list
-        key = TERM_MAP_BASE_NAME % (provider_name,)
-        pipe.hset(key, obj_id, self.__class__._serialize_data(norm_terms))
+        if norm_terms_updated:
+            key = TERM_MAP_BASE_NAME % (keyspace,)
+            pipe.hset(key, obj_id, self.__class__._serialize_data(norm_terms))
 
         # Map provider's obj_id -> facet data
+        key = FACET_MAP_BASE_NAME % (keyspace,)
         if len(facet_dicts) > 0:
-            key = FACET_MAP_BASE_NAME % (provider_name,)
             pipe.hset(key, obj_id, self.__class__._serialize_data(facet_dicts))
+        elif old_facets is not None:
+            pipe.hdel(key, obj_id)
 
-        # End pipeline
-        pipe.execute()
+        # Map provider's obj_id -> fingerprint
+        pipe.hset(fingerprint_map_name, obj_id, fingerprint)
+
+        # Map provider's obj_id -> score, for objects trimmed off capped prefix sets
+        if prefix_set_max_size:
+            pipe.hset(SCORE_MAP_BASE_NAME % (keyspace,), obj_id, repr(score))
+
+        self.__class__._invalidate_cache(cache_pipe, cache_norm_terms, cache_exact_terms, publish=publish_invalidation)
+
+        return norm_terms, facet_dicts, fingerprint
+
+    @staticmethod
+    def _queue_remove_member(pipe, key, set_name, name, obj_id):
+        """
+        Queue removing an object from a prefix or exact match sorted set, and the set's name from
+        the set tracking all of them once no other object is left in it. In cluster mode, where
+        scripts can not be sent in pipelines, the name stays tracked, which is harmless as
+        unlinking a sorted set that no longer exists does nothing.
+        """
+        if settings.CLUSTER_MODE:
+            pipe.zrem(key, obj_id)
+        else:
+            Autocompleter._queue_script(pipe, REMOVE_MEMBER_SCRIPT, [key, set_name], [name, obj_id])
+
+    @staticmethod
+    def _queue_add_capped(pipe, key, keyspace, word_prefix, obj_id, score, max_size):
+        """
+        Queue adding an object to the sorted set of a prefix that holds at most max_size IDs. IDs
+        ranking after the first max_size are trimmed off, and the prefix is then tracked in the set
+        of trimmed prefixes, which queries check to tell whether the sorted set is complete.
+        """
+        Autocompleter._queue_script(pipe, ADD_CAPPED_SCRIPT, [key, PREFIX_TRIMMED_SET_BASE_NAME % (keyspace,)],
+                                    [word_prefix, obj_id, repr(score), max_size])
 
-    def remove(self):
+    def remove(self, generation=None):
         """
-        Remove an object from the autocompleter
+        Remove an object from the autocompleter, in the given generation of keys which
+        defaults to the live generation.
         DO NOT override this.
         """
         # Init data
         obj_id = self.get_item_id()
-        terms = self.__class__.get_old_norm_terms(obj_id)
+        # Precomputed results are only kept for the live generation
+        autocompleters = self.__class__._get_precomputing_autocompleters() if generation is None else []
+        if self.__class__._use_lua_writes():
+            provider_name = self.__class__.get_provider_name()
+            raw_terms = REMOVE_SCRIPT(keys=[GENERATION_BASE_NAME % (get_provider_key_name(provider_name),)], args=[
+                provider_name, '' if generation is None else generation, obj_id,
+                1 if registry.get_provider_setting(self.__class__, 'INVALIDATE_CACHE_ON_STORE') else 0,
+                1 if settings.LOCAL_CACHE_SIZE else 0,
+            ])
+            # The script published the invalidation for other processes, this one's cache
+            # is not left to the listener
+            if raw_terms is not None:
+                terms = self.__class__._deserialize_data(raw_terms)
+                if settings.LOCAL_CACHE_SIZE:
+                    local_cache.invalidate({'provider': provider_name, 'norm_terms': terms, 'exact_terms': terms})
+                self.__class__._update_precomputed(autocompleters, terms)
+            return
+        if generation is None:
+            generation = self.__class__.get_generation()
+        terms = self.__class__.get_old_norm_terms(obj_id, generation)
         if terms is not None:
-            self.__class__.clear_keys(obj_id, terms)
-        facets = self.__class__.get_old_facets(obj_id)
+            self.__class__.clear_keys(obj_id, terms, generation)
+            self.__class__._invalidate_cache(REDIS, terms, terms)
+        facets = self.__class__.get_old_facets(obj_id, generation)
         if facets is not None:
-            self.__class__.clear_facets(obj_id, facets)
+            self.__class__.clear_facets(obj_id, facets, generation)
+        if terms is not None:
+            self.__class__._update_precomputed(autocompleters, terms)
 
 
 class AutocompleterModelProvider(AutocompleterProviderBase):
@@ -395,12 +1073,53 @@ class AutocompleterModelProvider(AutocompleterProviderBase):
         return str(self.obj)
 
     @classmethod
-    def get_iterator(cls):
+    def get_queryset(cls):
         """
         Get queryset representing all objects represented by this provider.
+        Override this rather than get_iterator to limit the objects stored, so
+        parallel store_all can still partition the queryset by primary key.
+        """
+        return cls.model._default_manager.all()
+
+    @classmethod
+    def get_iterator(cls):
+        """
+        Get an iterator over all objects represented by this provider.
         Will normally not have to override this.
         """
-        return cls.model._default_manager.iterator()
+        return cls.get_queryset().iterator()
+
+    @classmethod
+    def get_partitions(cls, num_partitions):
+        """
+        Split the provider's queryset into primary key ranges of roughly equal size.
+        If get_iterator has been overridden, fall back to slicing its result.
+        """
+        if cls.get_iterator.__func__ is not AutocompleterModelProvider.get_iterator.__func__:
+            return super(AutocompleterModelProvider, cls).get_partitions(num_partitions)
+
+        pks = cls.get_queryset().order_by('pk').values_list('pk', flat=True)
+        num_items = pks.count()
+        if num_items == 0:
+            return []
+        num_partitions = min(num_partitions, num_items)
+        # Each boundary is the first primary key of a partition. Ranges include their lower bound
+        # and exclude their upper bound, with None meaning unbounded.
+        boundaries = [pks[num_items * i // num_partitions] for i in range(1, num_partitions)]
+        return list(zip([None] + boundaries, boundaries + [None]))
+
+    @classmethod
+    def get_partition_iterator(cls, partition):
+        if isinstance(partition, slice):
+            return super(AutocompleterModelProvider, cls).get_partition_iterator(partition)
+
+        lower_pk, upper_pk = partition
+        queryset = cls.get_queryset()
+        if lower_pk is not None:
+            queryset = queryset.filter(pk__gte=lower_pk)
+        if upper_pk is not None:
+            queryset = queryset.filter(pk__lt=upper_pk)
+        return queryset.iterator()
 
 
 class AutocompleterDictProvider(AutocompleterProviderBase):
@@ -434,20 +1153,146 @@ class Autocompleter(AutocompleterBase):
     """
     Autocompleter class
     """
+    # Cache generation of each autocompleter last read by this process
+    _cache_generations = {}
+
     def __init__(self, name):
         self.name = name
 
-    def store_all(self, delete_old=True):
+    def store_all(self, delete_old=True, batch_size=None, workers=None, generation=None):
         """
         Store all objects of all providers register with this autocompleter.
+        Objects are stored in batches of `batch_size`, each batch costing two round trips.
+        With more than one worker, each provider's objects are split into partitions which are
+        stored by a pool of `workers` processes. Objects go to the given generation of keys,
+        defaulting to each provider's live generation.
+
+        Returns a report dict with the number of objects stored per provider name under 'stored'
+        and a list of (provider name, traceback) pairs for partitions that failed under 'errors'.
+        Errors are only collected when storing in parallel, otherwise they are raised.
         """
+        report = {'stored': OrderedDict(), 'errors': []}
         provider_classes = self._get_all_providers_by_autocompleter()
         if provider_classes is None:
+            return report
+
+        if batch_size is None:
+            batch_size = settings.STORE_BATCH_SIZE
+        if workers is None:
+            workers = settings.STORE_WORKERS
+
+        generations = OrderedDict()
+        for provider_class in provider_classes:
+            report['stored'][provider_class.provider_name] = 0
+            if generation is None:
+                generations[provider_class] = provider_class.get_generation()
+            else:
+                generations[provider_class] = generation
+
+        if workers > 1:
+            self._store_all_parallel(generations, delete_old, batch_size, workers, report)
+        else:
+            for provider_class, provider_generation in generations.items():
+                for chunk in self.chunk_iterator(provider_class.get_iterator(), batch_size):
+                    report['stored'][provider_class.provider_name] += \
+                        provider_class.store_many(chunk, delete_old=delete_old, generation=provider_generation)
+
+        # Objects were stored in the live generation without keeping precomputed results up to
+        # date, so those are computed again once
+        if generation is None:
+            self._precompute_related()
+        return report
+
+    def _store_all_parallel(self, generations, delete_old, batch_size, workers, report):
+        """
+        Store all partitions of all providers in a pool of worker processes, adding
+        the number of objects stored and any errors to the report as partitions finish.
+        """
+        tasks = []
+        for provider_class, generation in generations.items():
+            for partition in provider_class.get_partitions(workers):
+                tasks.append((provider_class, partition, delete_old, batch_size, generation,))
+        if len(tasks) == 0:
             return
 
+        # Database connections must not be shared with forked workers, so close ours and let
+        # each worker open its own. Redis connections are reopened by each worker automatically.
+        from django.db import connections
+        for connection in connections.all():
+            if not connection.in_atomic_block:
+                connection.close()
+
+        pool = multiprocessing.Pool(processes=workers, initializer=_init_store_worker)
+        try:
+            results = pool.imap_unordered(_store_partition, tasks)
+            for num_done, (provider_name, num_stored, error) in enumerate(results, 1):
+                report['stored'][provider_name] += num_stored
+                if error is not None:
+                    report['errors'].append((provider_name, error,))
+                    logger.error("Storing partition for provider %s failed:\n%s", provider_name, error)
+                logger.info("Stored %d of %d partitions for autocompleter %s (%d objects from provider %s)",
+                    num_done, len(tasks), self.name, num_stored, provider_name)
+        finally:
+            pool.close()
+            pool.join()
+
+    def rebuild(self, batch_size=None, workers=None, gc_delay=None, wait_for_gc=False):
+        """
+        Rebuild all data for this autocompleter without taking it offline. Objects are stored
+        into a fresh generation of keys while suggest keeps reading the live one. Once every
+        object is stored, the generation pointers of all providers are flipped in one transaction
+        and the old generation is removed by a background thread after `gc_delay` seconds, which
+        gives requests that already read the old pointers time to finish.
+
+        Objects saved or deleted while the rebuild runs only reach the old generation,
+        so they may have to be stored again afterwards.
+
+        Returns the store_all report. If any partition failed to store, the new generation
+        is thrown away and the live generation is left untouched.
+        """
+        provider_classes = self._get_all_providers_by_autocompleter()
+        if provider_classes is None:
+            return self.store_all()
+
+        old_generations = OrderedDict()
+        for provider_class in provider_classes:
+            old_generations[provider_class] = provider_class.get_generation()
+        new_generation = max(old_generations.values()) + 1
+
+        # Clear out anything left behind by an earlier rebuild that never finished
         for provider_class in provider_classes:
-            for obj in provider_class.get_iterator():
-                provider_class(obj).store(delete_old=delete_old)
+            self._remove_generation(provider_class, new_generation)
+
+        report = self.store_all(batch_size=batch_size, workers=workers, generation=new_generation)
+        if len(report['errors']) > 0:
+            for provider_class in provider_classes:
+                self._remove_generation(provider_class, new_generation)
+            return report
+
+        # Generation pointers are switched in one transaction per server. Pointers of different
+        # providers live in different slots in cluster mode, where they can not be switched in
+        # a single transaction.
+        pipes = OrderedDict()
+        for provider_class in provider_classes:
+            client = provider_class.get_client()
+            if client not in pipes:
+                pipes[client] = client.pipeline(transaction=not settings.CLUSTER_MODE)
+            pipes[client].set(GENERATION_BASE_NAME % (get_provider_key_name(provider_class.provider_name),),
+                              new_generation)
+        for pipe in pipes.values():
+            pipe.execute()
+
+        # Cached and precomputed results were computed from the old generation
+        self.clear_cache()
+        self._precompute_related()
+
+        if gc_delay is None:
+            gc_delay = settings.REBUILD_GC_DELAY
+        gc_thread = threading.Timer(gc_delay, self._remove_generations, [old_generations])
+        gc_thread.start()
+        if wait_for_gc:
+            gc_thread.join()
+        return report
 
     def remove_all(self):
         """
@@ -460,56 +1305,8 @@ class Autocompleter(AutocompleterBase):
 
         for provider_class in provider_classes:
             provider_name = provider_class.provider_name
-
-            # Get list of all prefixes for autocompleter
-            prefix_set_name = PREFIX_SET_BASE_NAME % (provider_name,)
-            prefixes = REDIS.smembers(prefix_set_name)
-            keys = [PREFIX_BASE_NAME % (provider_name, prefix.decode(),) for prefix in prefixes]
-            chunked_prefix_keys = self.chunk_list(keys, 100)
-
-            # Get list of all exact match terms for autocompleter
-            exact_set_name = EXACT_SET_BASE_NAME % (provider_name,)
-            norm_terms = REDIS.smembers(exact_set_name)
-            keys = [EXACT_BASE_NAME % (provider_name, norm_term.decode(),) for norm_term in norm_terms]
-            chunked_norm_term_keys = self.chunk_list(keys, 100)
-
-            # Get list of facets
-            facet_base = FACET_BASE_NAME % (provider_name,)
-            keys = [facet.decode() for facet in REDIS.keys(facet_base + '.*')]
-            facet_keys = self.chunk_list(keys, 100)
-
-            # Start pipeline
-            pipe = REDIS.pipeline()
-
-            # For each prefix, delete sorted set (in groups of 100)
-            for chunk in chunked_prefix_keys:
-                pipe.delete(*chunk)
-            # Delete the set of prefixes
-            pipe.delete(prefix_set_name)
-
-            # For each exact match term, delete sorted set (in groups of 100
-            for chunk in chunked_norm_term_keys:
-                pipe.delete(*chunk)
-            # Delete the set of exact matches
-            pipe.delete(exact_set_name)
-
-            # For each facet, delete sorted set (in groups of 100)
-            for chunk in facet_keys:
-                pipe.delete(*chunk)
-            # Delete the facet mapping
-            facet_map_name = FACET_MAP_BASE_NAME % (provider_name,)
-            pipe.delete(facet_map_name)
-
-            # Remove provider's obj_id -> data payload mapping
-            key = AUTO_BASE_NAME % (provider_name,)
-            pipe.delete(key)
-
-            # Remove provider's obj_id -> norm terms mapping
-            key = TERM_MAP_BASE_NAME % (provider_name,)
-            pipe.delete(key)
-
-            # End pipeline
-            pipe.execute()
+            self._remove_generation(provider_class, provider_class.get_generation())
+            provider_class.get_client().delete(GENERATION_BASE_NAME % (get_provider_key_name(provider_name),))
 
             # There is a possibility that some straggling keys have not been
             # cleaned up if their ID changed but for some reason we did not
@@ -518,33 +1315,348 @@ class Autocompleter(AutocompleterBase):
             # However in our controlled testing environment, we should be perfect so
             # this clean up should not be necessary, and if it is it means something real is wrong.
             if not settings.TEST_DATA:
-                key = AUTO_BASE_NAME % (provider_name,)
+                key = AUTO_BASE_NAME % (get_provider_key_name(provider_name),)
                 key += '*'
-                leftovers = REDIS.keys(key)
+                self._unlink_keys(self._scan_keys(key, provider_class.get_client()), provider_class.get_client())
+
+        # Just to be extra super clean, let's delete all cached results
+        # for this autocompleter
+        self._remove_cache()
+        self._unlink_keys(self._scan_keys(PRECOMPUTED_BASE_NAME % (self.name, '*',)))
+        REDIS.unlink(PRECOMPUTED_SEQUENCE_NAME % (self.name,), PRECOMPUTED_VERSIONS_NAME % (self.name,))
+        self._precompute_related(include_self=False)
+
+    def precompute(self, prefixes=None):
+        """
+        Precompute what suggest returns for prefixes of a single word, without facets, of up to
+        PRECOMPUTE_PREFIX_LENGTH letters, so suggest reads them in its first round trip. Only the
+        results of the given prefixes are computed, or those of every prefix of the
+        autocompleter's providers, in which case results of prefixes no longer stored are removed.
+        Results are kept for PRECOMPUTE_TIMEOUT seconds.
+
+        Concurrent calls may finish in any order, so results are only written if no call that
+        started later wrote those of the same prefix already. In cluster mode, where the keys
+        involved live in different slots, the last call to finish wins.
+        """
+        max_length = registry.get_autocompleter_setting(self.name, 'PRECOMPUTE_PREFIX_LENGTH')
+        providers = self._get_all_providers_by_autocompleter()
+        if not max_length or providers is None:
+            return
+        timeout = registry.get_autocompleter_setting(self.name, 'PRECOMPUTE_TIMEOUT')
+        # Counted before anything is read, so calls counted later read data at least as new
+        sequence = REDIS.incr(PRECOMPUTED_SEQUENCE_NAME % (self.name,))
+
+        # Objects were just written to the primary, so it is read rather than a replica
+        clients = self._get_read_clients(providers, REDIS)
+        keyspaces = self._get_keyspaces(clients)
+        remove_stale = prefixes is None
+        if prefixes is None:
+            prefixes = set()
+            for provider in providers:
+                prefix_set_name = PREFIX_SET_BASE_NAME % (keyspaces[provider.provider_name],)
+                prefixes.update(prefix.decode() for prefix in clients[provider.provider_name].sscan_iter(
+                    prefix_set_name, count=settings.MAINTENANCE_BATCH_SIZE))
+        prefixes = sorted(prefix for prefix in prefixes if len(prefix) <= max_length)
+
+        for chunk in self.chunk_list(prefixes, settings.MAINTENANCE_BATCH_SIZE):
+            results = self._suggest_many(clients, providers, keyspaces, chunk, [], [None] * len(chunk),
+                                         [None] * len(chunk))
+            keys = [PRECOMPUTED_BASE_NAME % (self.name, prefix,) for prefix in chunk]
+            serialized_results = [self.__class__._serialize_data(prefix_results) for prefix_results in results]
+            pipe = REDIS.pipeline()
+            if settings.CLUSTER_MODE:
+                for key, prefix_results in zip(keys, serialized_results):
+                    pipe.set(key, prefix_results, ex=timeout or None)
+            else:
+                args = [sequence, timeout]
+                for prefix, prefix_results in zip(chunk, serialized_results):
+                    args += [prefix, prefix_results]
+                self._queue_script(pipe, SET_PRECOMPUTED_SCRIPT, [PRECOMPUTED_VERSIONS_NAME % (self.name,)] + keys,
+                                   args)
+            pipe.execute()
 
-                # Start pipeline
-                pipe = REDIS.pipeline()
+        if remove_stale:
+            prefixes = set(prefixes)
+            key_prefix_start = len(PRECOMPUTED_BASE_NAME % (self.name, '',))
+            self._unlink_keys(key for key in self._scan_keys(PRECOMPUTED_BASE_NAME % (self.name, '*',))
+                              if key.decode()[key_prefix_start:] not in prefixes)
 
-                for i in leftovers:
-                    pipe.delete(i)
+    def _precompute_related(self, include_self=True):
+        """
+        Precompute the results of every autocompleter sharing a provider with this one, whose
+        results may include objects of those providers.
+        """
+        ac_names = []
+        for provider_class in self._get_all_providers_by_autocompleter() or []:
+            for ac_name in registry.get_autocompleters_by_provider(provider_class):
+                if ac_name not in ac_names and (include_self or ac_name != self.name):
+                    ac_names.append(ac_name)
+        for ac_name in ac_names:
+            Autocompleter(ac_name).precompute()
+
+    def _remove_generations(self, generations):
+        """
+        Remove the data of each provider's generation given in a dict mapping provider to generation.
+        """
+        for provider_class, generation in generations.items():
+            self._remove_generation(provider_class, generation)
 
-                # End pipeline
-                pipe.execute()
+    def _remove_generation(self, provider_class, generation):
+        """
+        Remove all data stored for a provider in the given generation of keys.
+        """
+        keyspace = provider_class.get_keyspace_name(generation)
+        batch_size = settings.MAINTENANCE_BATCH_SIZE
+        client = provider_class.get_client()
+
+        # Stream through the set of all prefixes, unlinking the sorted set of each
+        prefix_set_name = PREFIX_SET_BASE_NAME % (keyspace,)
+        self._unlink_keys((PREFIX_BASE_NAME % (keyspace, prefix.decode(),)
+                           for prefix in client.sscan_iter(prefix_set_name, count=batch_size)), client)
+
+        # Same for the set of all exact match terms
+        exact_set_name = EXACT_SET_BASE_NAME % (keyspace,)
+        self._unlink_keys((EXACT_BASE_NAME % (keyspace, norm_term.decode(),)
+                           for norm_term in client.sscan_iter(exact_set_name, count=batch_size)), client)
+
+        # Facet sorted sets are not tracked in a set, so scan for them. The same scan picks up any
+        # prefix or exact match sorted sets that were dropped from their set while still in use.
+        pattern = (AUTO_BASE_NAME % (keyspace,)) + '.[pef].*'
+        self._unlink_keys(self._scan_keys(pattern, client), client)
+
+        # Unlink the sets of prefixes, trimmed prefixes and exact matches, and the provider's
+        # obj_id -> data payload, norm terms, facets, fingerprint and score mappings
+        client.unlink(
+            prefix_set_name,
+            PREFIX_TRIMMED_SET_BASE_NAME % (keyspace,),
+            exact_set_name,
+            AUTO_BASE_NAME % (keyspace,),
+            TERM_MAP_BASE_NAME % (keyspace,),
+            FACET_MAP_BASE_NAME % (keyspace,),
+            FINGERPRINT_MAP_BASE_NAME % (keyspace,),
+            SCORE_MAP_BASE_NAME % (keyspace,),
+        )
 
-        # Just to be extra super clean, let's delete all cached results
-        # for this autocompleter
-        self.clear_cache()
+    @staticmethod
+    def _scan_keys(pattern, client=None):
+        """
+        Iterate over all keys matching a pattern with SCAN, which unlike KEYS never blocks Redis
+        for more than a batch of keys at a time. Keys are scanned with the given client, which
+        defaults to the primary.
+        """
+        if client is None:
+            client = REDIS
+        for key in client.scan_iter(match=pattern, count=settings.MAINTENANCE_BATCH_SIZE):
+            yield key
+
+    @classmethod
+    def _unlink_keys(cls, keys, client=None):
+        """
+        Unlink keys from any iterable of keys in batches of MAINTENANCE_BATCH_SIZE, pausing
+        MAINTENANCE_BATCH_DELAY seconds after each batch. UNLINK frees the memory of the keys in
+        the background. Returns the number of keys unlinked. Keys are unlinked with the given
+        client, which defaults to the primary.
+        """
+        if client is None:
+            client = REDIS
+        num_unlinked = 0
+        for chunk in cls.chunk_iterator(keys, settings.MAINTENANCE_BATCH_SIZE):
+            num_unlinked += client.unlink(*chunk)
+            if settings.MAINTENANCE_BATCH_DELAY:
+                time.sleep(settings.MAINTENANCE_BATCH_DELAY)
+        return num_unlinked
+
+    def get_cache_generation(self):
+        """
+        The generation of this autocompleter's cached results, which is part of every cache key.
+        """
+        generation = REDIS.get(CACHE_GENERATION_BASE_NAME % (self.name,))
+        if generation is None:
+            return 0
+        return int(generation)
 
     def clear_cache(self):
         """
-        Clear cache
+        Clear cache. Bumping the cache generation means results cached so far are never
+        read again and expire after CACHE_TIMEOUT seconds, without touching any of their keys.
         """
-        cache_key = CACHE_BASE_NAME % (self.name, '*', '*')
-        exact_cache_key = EXACT_CACHE_BASE_NAME % (self.name, '*',)
+        pipe = REDIS.pipeline()
+        pipe.incr(CACHE_GENERATION_BASE_NAME % (self.name,))
+        publish_cache_invalidation(pipe, {'autocompleter': self.name})
+        pipe.execute()
 
-        keys = REDIS.keys(cache_key) + REDIS.keys(exact_cache_key)
-        if len(keys) > 0:
-            REDIS.delete(*keys)
+    def _remove_cache(self):
+        """
+        Delete every cached result of this autocompleter along with its cache generation.
+        """
+        cache_key = CACHE_BASE_NAME % (self.name, '*', '*', '*')
+        exact_cache_key = EXACT_CACHE_BASE_NAME % (self.name, '*', '*',)
+
+        self._unlink_keys(self._scan_keys(cache_key))
+        self._unlink_keys(self._scan_keys(exact_cache_key))
+        REDIS.unlink(CACHE_GENERATION_BASE_NAME % (self.name,))
+        publish_cache_invalidation(REDIS, {'autocompleter': self.name})
+
+        for provider_class in self._get_all_providers_by_autocompleter() or []:
+            provider_name = provider_class.get_provider_name()
+            provider_key_name = get_provider_key_name(provider_name)
+            self._unlink_keys(self._scan_keys(CACHE_TAG_BASE_NAME % (provider_key_name, '*',)))
+            self._unlink_keys(self._scan_keys(EXACT_CACHE_TAG_BASE_NAME % (provider_key_name, '*',)))
+            REDIS.unlink(CACHE_INVALIDATIONS_BASE_NAME % (provider_key_name,))
+
+    @staticmethod
+    def _get_longest_words(norm_terms):
+        """
+        The longest word of each of a query's norm terms, which suggest results are tagged with.
+        """
+        return [max(norm_term.split(), key=len) for norm_term in norm_terms if norm_term.split()]
+
+    @staticmethod
+    def _get_tag_keys(providers, tag_base_name, tags):
+        """
+        The given tags' sets of cache keys of each provider whose INVALIDATE_CACHE_ON_STORE
+        setting is on.
+        """
+        return [tag_base_name % (get_provider_key_name(provider.get_provider_name()), tag,)
+                for provider in providers if registry.get_provider_setting(provider, 'INVALIDATE_CACHE_ON_STORE')
+                for tag in tags]
+
+    @classmethod
+    def _tag_cache_key(cls, pipe, cache_key, providers, tag_base_name, tags):
+        """
+        Queue adding a cache key to the given tags' sets of each provider whose
+        INVALIDATE_CACHE_ON_STORE setting is on. Tag sets expire along with the results.
+        """
+        for key in cls._get_tag_keys(providers, tag_base_name, tags):
+            pipe.sadd(key, cache_key)
+            pipe.expire(key, settings.CACHE_TIMEOUT)
+
+    def _get_invalidation_count_keys(self):
+        """
+        Keys of the counts of invalidations of this autocompleter's providers whose
+        INVALIDATE_CACHE_ON_STORE setting is on, see _queue_cache_results.
+        """
+        return [CACHE_INVALIDATIONS_BASE_NAME % (get_provider_key_name(provider.get_provider_name()),)
+                for provider in self._get_all_providers_by_autocompleter() or []
+                if registry.get_provider_setting(provider, 'INVALIDATE_CACHE_ON_STORE')]
+
+    def _get_precomputed_key(self, term, facets):
+        """
+        The key of the precomputed results of a suggest query, or None when its results are not
+        precomputed. Only a term that is a single word prefix of up to PRECOMPUTE_PREFIX_LENGTH
+        letters once normalized, and no shorter than as given, has them, see precompute.
+        """
+        max_length = registry.get_autocompleter_setting(self.name, 'PRECOMPUTE_PREFIX_LENGTH')
+        if not max_length or len(facets) > 0:
+            return None
+        norm_terms = utils.get_norm_term_variations(term)
+        # MIN_LETTERS applies to the term as given
+        if len(norm_terms) != 1 or ' ' in norm_terms[0] or len(norm_terms[0]) != len(term) or \
+                len(term) > max_length:
+            return None
+        return PRECOMPUTED_BASE_NAME % (self.name, norm_terms[0],)
+
+    def _get_suggest_query_key(self, term, facets):
+        """
+        The (method name, autocompleter name, ...) tuple identifying a suggest query, or None when
+        neither caching nor single flight needs one.
+        """
+        if not (settings.LOCAL_CACHE_SIZE or settings.CACHE_TIMEOUT or settings.SINGLE_FLIGHT):
+            return None
+        normalized_term = utils.get_normalized_term(term, settings.JOIN_CHARS)
+        return ('suggest', self.name, normalized_term, self.hash_facets(facets))
+
+    @staticmethod
+    def _get_local_cached_results(query_key):
+        """
+        Return the in-process cache key of a query, paired with the cache's sequence of
+        invalidations so far (see LocalResultCache.set), along with the results cached under it,
+        both None when the in-process cache is off.
+        """
+        if not settings.LOCAL_CACHE_SIZE:
+            return None, None
+        local_cache.listen(REDIS, CACHE_INVALIDATION_CHANNEL)
+        return (query_key, local_cache.get_sequence()), local_cache.get(query_key)
+
+    def _load_cached_results(self, cached_results, local_cache_key, providers, kind, words):
+        """
+        Deserialize results read from the Redis result cache, keeping them in the in-process cache
+        under the given key, tagged with the given kind and words (see LocalResultCache.get_tags).
+        """
+        cached_results = self.__class__._deserialize_data(cached_results)
+        self._set_local_cache(local_cache_key, cached_results, providers, kind, words)
+        return cached_results
+
+    @staticmethod
+    def _set_local_cache(local_cache_key, results, providers, kind, words):
+        """
+        Keep results in the in-process cache under the given key, unless it is None, tagged with
+        the given kind and words (see LocalResultCache.get_tags). They are not kept if any of their
+        providers' entries were dropped since the key was returned by _get_local_cached_results.
+        """
+        if local_cache_key is not None:
+            query_key, sequence = local_cache_key
+            local_cache.set(query_key, results,
+                local_cache.get_tags([provider.provider_name for provider in providers], kind, words), sequence)
+
+    def _queue_cache_results(self, pipe, cache_key, results, providers, tag_base_name, tags,
+                             invalidation_counts=None):
+        """
+        Queue caching results under cache_key for CACHE_TIMEOUT seconds, tagged with the given tags.
+        Given the counts of invalidations read before the results were computed, by key (see
+        _get_keyspaces_and_cached_results), the results are only cached if none of them changed,
+        as an object stored meanwhile may have dropped its tags before the results were cached.
+        """
+        serialized_results = self.__class__._serialize_data(results)
+        if invalidation_counts:
+            keys = list(invalidation_counts.keys()) + [cache_key] + \
+                self._get_tag_keys(providers, tag_base_name, tags)
+            args = [len(invalidation_counts)] + [count or '' for count in invalidation_counts.values()] + \
+                [settings.CACHE_TIMEOUT, serialized_results]
+            self._queue_script(pipe, CACHE_RESULTS_SCRIPT, keys, args)
+            return
+        pipe.setex(cache_key, settings.CACHE_TIMEOUT, serialized_results)
+        self._tag_cache_key(pipe, cache_key, providers, tag_base_name, tags)
+
+    def _single_flight(self, key, cache_key, compute):
+        """
+        Compute results with compute() once for concurrent callers asking for the same key. With
+        SINGLE_FLIGHT on, the first caller in a process computes them and the others wait and share
+        them. With SINGLE_FLIGHT_LOCK on, a Redis lock on cache_key also makes callers in other
+        processes wait for the results to be cached rather than compute them too.
+        """
+        if settings.SINGLE_FLIGHT_LOCK and cache_key is not None:
+            compute = functools.partial(self._compute_with_lock, cache_key, compute)
+        if settings.SINGLE_FLIGHT:
+            return single_flight.do(key, compute, settings.SINGLE_FLIGHT_TIMEOUT)
+        return compute()
+
+    def _compute_with_lock(self, cache_key, compute):
+        """
+        Compute results with compute() if no other process holds the lock on cache_key, otherwise
+        wait for that process to cache them. Results are computed anyway when the lock is released
+        or expires without the results being cached.
+        """
+        lock_key = CACHE_LOCK_NAME % (cache_key,)
+        token = str(uuid.uuid4())
+        if REDIS.set(lock_key, token, nx=True, px=int(settings.SINGLE_FLIGHT_TIMEOUT * 1000)):
+            try:
+                return compute()
+            finally:
+                RELEASE_LOCK_SCRIPT(keys=[lock_key], args=[token])
+
+        deadline = time.time() + settings.SINGLE_FLIGHT_TIMEOUT
+        while time.time() < deadline:
+            time.sleep(CACHE_LOCK_POLL_INTERVAL)
+            pipe = REDIS.pipeline()
+            pipe.get(cache_key)
+            pipe.exists(lock_key)
+            cached_results, locked = pipe.execute()
+            if cached_results is not None:
+                return self.__class__._deserialize_data(cached_results)
+            if not locked:
+                break
+        return compute()
 
     def suggest(self, term, facets=[]):
         """
@@ -554,32 +1666,153 @@ class Autocompleter(AutocompleterBase):
         if providers is None:
             return []
 
-        # If we have a cached version of the search results available, return it!
-        hashed_facets = self.hash_facets(facets)
-        cache_key = CACHE_BASE_NAME % \
-            (self.name, utils.get_normalized_term(term, settings.JOIN_CHARS), hashed_facets)
-        if settings.CACHE_TIMEOUT and REDIS.exists(cache_key):
-            return self.__class__._deserialize_data(REDIS.get(cache_key))
+        # If we have a cached version of the search results available, return it! The in-process
+        # cache is checked first, then the Redis one.
+        query_key = self._get_suggest_query_key(term, facets)
+        local_cache_key, cached_results = self._get_local_cached_results(query_key)
+        if cached_results is not None:
+            return cached_results
+
+        # All reads of a call from the default server go to the same replica. Results of short
+        # prefixes may have been precomputed, and are read along with the cached ones.
+        client = get_read_client()
+        clients = self._get_read_clients(providers, client)
+        keyspaces, (cache_key,), (cached_results,), invalidation_counts = self._get_keyspaces_and_cached_results(
+            client, clients, CACHE_BASE_NAME, [query_key], [self._get_precomputed_key(term, facets)])
+        if cached_results is not None:
+            return self._load_cached_results(cached_results, local_cache_key, providers, 'prefix',
+                                             self._get_longest_words(utils.get_norm_term_variations(term)))
+
+        return self._single_flight(query_key, cache_key,
+            lambda: self._suggest(clients, providers, keyspaces, term, facets, cache_key, local_cache_key,
+                                  invalidation_counts))
+
+    def _suggest(self, clients, providers, keyspaces, term, facets, cache_key, local_cache_key,
+                 invalidation_counts=None):
+        """
+        Suggest matching objects of the given providers, given their keyspaces and a term, and
+        cache them under the given keys. Read only queries are sent with the given clients, by
+        provider name. Each server's queries are sent concurrently.
+        """
+        return self._suggest_many(clients, providers, keyspaces, [term], facets, [cache_key], [local_cache_key],
+                                  invalidation_counts)[0]
 
+    def suggest_many(self, terms, facets=[]):
+        """
+        Suggest matching objects for each of a list of terms, returning the list of what suggest
+        would return for each. The queries of all terms whose results are not cached are sent
+        together, in a single round trip per server. Concurrent calls are not coalesced.
+        """
+        providers = self._get_all_providers_by_autocompleter()
+        if providers is None:
+            return [[] for term in terms]
+
+        query_keys = [self._get_suggest_query_key(term, facets) for term in terms]
+        local_cache_keys = []
+        results = []
+        for query_key in query_keys:
+            local_cache_key, cached_results = self._get_local_cached_results(query_key)
+            local_cache_keys.append(local_cache_key)
+            results.append(cached_results)
+        uncached = [i for i, cached_results in enumerate(results) if cached_results is None]
+        if len(uncached) == 0:
+            return results
+
+        # Results of short prefixes may have been precomputed, and are read along with the cached ones
+        client = get_read_client()
+        clients = self._get_read_clients(providers, client)
+        keyspaces, cache_keys, cached_results, invalidation_counts = self._get_keyspaces_and_cached_results(
+            client, clients, CACHE_BASE_NAME, [query_keys[i] for i in uncached],
+            [self._get_precomputed_key(terms[i], facets) for i in uncached])
+        cache_keys = dict(zip(uncached, cache_keys))
+        for i, raw_results in zip(uncached, cached_results):
+            if raw_results is not None:
+                results[i] = self._load_cached_results(raw_results, local_cache_keys[i], providers, 'prefix',
+                                                       self._get_longest_words(utils.get_norm_term_variations(terms[i])))
+
+        uncached = [i for i in uncached if results[i] is None]
+        if len(uncached) > 0:
+            computed_results = self._suggest_many(clients, providers, keyspaces, [terms[i] for i in uncached], facets,
+                [cache_keys[i] for i in uncached], [local_cache_keys[i] for i in uncached], invalidation_counts)
+            for i, term_results in zip(uncached, computed_results):
+                results[i] = term_results
+        return results
+
+    def _suggest_many(self, clients, providers, keyspaces, terms, facets, cache_keys, local_cache_keys,
+                      invalidation_counts=None):
+        """
+        Suggest matching objects of the given providers for each of a list of terms, given the
+        providers' keyspaces, and cache the results of each term under the given keys, unless
+        the given counts of invalidations changed meanwhile. The queries of all terms are sent
+        together, those of each server concurrently.
+        """
         # Get the normalized term variations we need to search for each term. A single term
         # could turn into multiple terms we need to search.
-        norm_terms = utils.get_norm_term_variations(term)
-        if len(norm_terms) == 0:
-            return []
-
-        provider_results = OrderedDict()
+        all_norm_terms = [utils.get_norm_term_variations(term) for term in terms]
+        results = [[] for term in terms]
+        searched = [i for i, norm_terms in enumerate(all_norm_terms) if len(norm_terms) > 0]
+        if len(searched) == 0:
+            return results
+
+        # Queue the queries of each term in turn, keeping track of where they end in each pipeline
+        query_clients = self._get_query_clients(clients, providers)
+        pipes = self._get_pipelines(None, query_clients)
+        pipe_ends = []
+        for i in searched:
+            self._queue_suggest(pipes, query_clients, providers, keyspaces, terms[i], all_norm_terms[i], facets)
+            pipe_ends.append(OrderedDict((query_client, len(pipe)) for query_client, pipe in pipes.items()))
+        client_results = self._execute_pipelines(pipes)
+
+        all_provider_results = []
+        all_provider_payloads = []
+        pipe_starts = OrderedDict((query_client, 0) for query_client in pipes)
+        for i, ends in zip(searched, pipe_ends):
+            term_client_results = OrderedDict(
+                (query_client, pipe_results[pipe_starts[query_client]:ends[query_client]])
+                for query_client, pipe_results in client_results.items())
+            provider_results, provider_payloads = self._parse_suggest(
+                term_client_results, query_clients, providers, terms[i])
+            all_provider_results.append(provider_results)
+            all_provider_payloads.append(provider_payloads)
+            pipe_starts = ends
+
+        if settings.CLUSTER_MODE:
+            # Payloads could not be fetched along with the result IDs
+            pipes = self._get_pipelines(None, clients)
+            for provider_results in all_provider_results:
+                self._queue_payloads(pipes, clients, provider_results, keyspaces)
+            client_results = self._execute_pipelines(pipes)
+            all_provider_payloads = [self._parse_payloads(client_results, clients, provider_results)
+                                     for provider_results in all_provider_results]
+
+        # If told to, cache the final results for CACHE_TIMEOUT secnds. Results are cached under the
+        # cache generation read above, so results computed while the cache was cleared are never read.
+        pipe = REDIS.pipeline()
+        for i, provider_results, provider_payloads in zip(searched, all_provider_results, all_provider_payloads):
+            results[i] = self._get_results_from_payloads(provider_results, provider_payloads)
+            longest_words = self._get_longest_words(all_norm_terms[i])
+            if cache_keys[i] is not None:
+                self._queue_cache_results(pipe, cache_keys[i], results[i], providers, CACHE_TAG_BASE_NAME,
+                                          longest_words, invalidation_counts)
+            self._set_local_cache(local_cache_keys[i], results[i], providers, 'prefix', longest_words)
+        if len(pipe) > 0:
+            pipe.execute()
+        return results
 
+    def _queue_suggest(self, pipes, query_clients, providers, keyspaces, term, norm_terms, facets):
+        """
+        Queue the queries of suggest for the given providers, given their keyspaces and the
+        normalized variations of the term, on a dict mapping clients to pipelines. Each provider's
+        queries are queued on the pipeline of its client in the given dict mapping provider names
+        to clients.
+        """
         # Generate a unique identifier to be used for storing intermediate results. This is to
         # prevent redis key collisions between competing suggest / exact_suggest calls.
-        base_result_key = RESULT_SET_BASE_NAME % str(uuid.uuid4())
-        base_exact_match_key = RESULT_SET_BASE_NAME % str(uuid.uuid4())
-        # Same idea as the base_result_key, but for when we are using facets in the suggest call.
-        facet_final_result_key = RESULT_SET_BASE_NAME % str(uuid.uuid4())
-        facet_final_exact_match_key = RESULT_SET_BASE_NAME % str(uuid.uuid4())
-        # As we search, we may store a number of intermediate data items. We keep track of
-        # what we store and delete so there is nothing left over
-        # We initialize with the base keys all of which could end up being used.
-        keys_to_delete = {base_result_key, base_exact_match_key, facet_final_result_key, facet_final_exact_match_key}
+        base_result_name = RESULT_SET_BASE_NAME % str(uuid.uuid4())
+        base_exact_match_name = RESULT_SET_BASE_NAME % str(uuid.uuid4())
+        # Same idea as the base_result_name, but for when we are using facets in the suggest call.
+        facet_final_result_name = RESULT_SET_BASE_NAME % str(uuid.uuid4())
+        facet_final_exact_match_name = RESULT_SET_BASE_NAME % str(uuid.uuid4())
 
         facet_keys_set = set()
         if len(facets) > 0:
@@ -591,9 +1824,21 @@ class Autocompleter(AutocompleterBase):
         # Get the max results autocompleter setting
         MAX_RESULTS = registry.get_autocompleter_setting(self.name, 'MAX_RESULTS')
 
-        pipe = REDIS.pipeline()
+        # Words of the variations whose prefix sets are intersected, and the words all of them share,
+        # which are intersected once with the union of the rest
+        variations = self._get_variation_words(term, norm_terms)
+        common_words = []
+        if len(variations) > 1:
+            common_words = sorted(set.intersection(*[set(words) for words in variations]))
+
+        # As we search, we may store a number of intermediate data items. We keep track of
+        # what we store on each server and delete so there is nothing left over
+        keys_to_delete = OrderedDict((query_client, set()) for query_client in pipes)
         for provider in providers:
             provider_name = provider.provider_name
+            keyspace = keyspaces[provider_name]
+            pipe = pipes[query_clients[provider_name]]
+            pipe_keys_to_delete = keys_to_delete[query_clients[provider_name]]
 
             # If the total length of the term is less than MIN_LETTERS allowed, then don't search
             # the provider for this term
@@ -601,16 +1846,31 @@ class Autocompleter(AutocompleterBase):
             if len(term) < MIN_LETTERS:
                 continue
 
+            if self._use_query_script(provider):
+                self._queue_read_only_query(pipe, provider, keyspace, norm_terms, variations, facets,
+                                            facet_keys_set, MAX_RESULTS, MOVE_EXACT_MATCHES_TO_TOP)
+                continue
+
+            # Intermediate results of each provider are stored under keys suffixed with its keyspace,
+            # which in cluster mode puts them in the same slot as the sets they are computed from.
+            # We add the base keys all of which could end up being used.
+            base_result_key = self._get_result_key(base_result_name, keyspace)
+            base_exact_match_key = self._get_result_key(base_exact_match_name, keyspace)
+            facet_final_result_key = self._get_result_key(facet_final_result_name, keyspace)
+            facet_final_exact_match_key = self._get_result_key(facet_final_exact_match_name, keyspace)
+            pipe_keys_to_delete.update([base_result_key, base_exact_match_key, facet_final_result_key,
+                                        facet_final_exact_match_key])
+
             term_result_keys = []
-            for norm_term in norm_terms:
-                norm_words = norm_term.split()
-                keys = [PREFIX_BASE_NAME % (provider_name, norm_word,) for norm_word in norm_words]
+            for words in variations:
+                norm_words = [word for word in words if word not in common_words]
+                keys = [PREFIX_BASE_NAME % (keyspace, norm_word,) for norm_word in norm_words]
                 if len(keys) == 1:
                     term_result_keys.append(keys[0])
                 else:
-                    term_result_key = base_result_key + '.' + norm_term
+                    term_result_key = base_result_key + '.' + ' '.join(norm_words)
                     term_result_keys.append(term_result_key)
-                    keys_to_delete.add(term_result_key)
+                    pipe_keys_to_delete.add(term_result_key)
                     pipe.zinterstore(term_result_key, keys, aggregate='MIN')
 
             if len(term_result_keys) == 1:
@@ -619,6 +1879,14 @@ class Autocompleter(AutocompleterBase):
                 final_result_key = base_result_key
                 pipe.zunionstore(final_result_key, term_result_keys, aggregate='MIN')
 
+            if len(common_words) > 0:
+                common_result_key = self._get_result_key(RESULT_SET_BASE_NAME % str(uuid.uuid4()), keyspace)
+                pipe_keys_to_delete.add(common_result_key)
+                pipe.zinterstore(common_result_key, [final_result_key] + [
+                    PREFIX_BASE_NAME % (keyspace, common_word,) for common_word in common_words
+                ], aggregate='MIN')
+                final_result_key = common_result_key
+
             use_facets = False
             if len(facet_keys_set) > 0:
                 provider_keys_set = set(provider.get_facets())
@@ -636,15 +1904,16 @@ class Autocompleter(AutocompleterBase):
                         facet_set_keys = []
                         for facet_dict in facet_list:
                             facet_set_key = \
-                                FACET_SET_BASE_NAME % (provider_name, facet_dict['key'], facet_dict['value'],)
+                                FACET_SET_BASE_NAME % (keyspace, facet_dict['key'], facet_dict['value'],)
                             facet_set_keys.append(facet_set_key)
 
                         if len(facet_set_keys) == 1:
                             facet_result_keys.append(facet_set_keys[0])
                         else:
-                            facet_result_key = RESULT_SET_BASE_NAME % str(uuid.uuid4())
+                            facet_result_key = self._get_result_key(RESULT_SET_BASE_NAME % str(uuid.uuid4()),
+                                                                    keyspace)
                             facet_result_keys.append(facet_result_key)
-                            keys_to_delete.add(facet_result_key)
+                            pipe_keys_to_delete.add(facet_result_key)
                             if facet_type == 'and':
                                 pipe.zinterstore(facet_result_key, facet_set_keys, aggregate='MIN')
                             else:
@@ -657,16 +1926,17 @@ class Autocompleter(AutocompleterBase):
                 # facet_result_keys and store the intersection in the faceted final result set.
                 pipe.zinterstore(facet_final_result_key, facet_result_keys + [final_result_key], aggregate='MIN')
 
+            data_key = AUTO_BASE_NAME % (keyspace,)
             if use_facets:
-                pipe.zrange(facet_final_result_key, 0, MAX_RESULTS - 1)
+                self._queue_range(pipe, facet_final_result_key, data_key, MAX_RESULTS)
             else:
-                pipe.zrange(final_result_key, 0, MAX_RESULTS - 1)
+                self._queue_range(pipe, final_result_key, data_key, MAX_RESULTS)
 
             # Get exact matches
             if MOVE_EXACT_MATCHES_TO_TOP:
                 keys = []
                 for norm_term in norm_terms:
-                    keys.append(EXACT_BASE_NAME % (provider_name, norm_term,))
+                    keys.append(EXACT_BASE_NAME % (keyspace, norm_term,))
                 # Do not attempt zunionstore on empty list because redis errors out.
                 if len(keys) == 0:
                     continue
@@ -684,13 +1954,55 @@ class Autocompleter(AutocompleterBase):
                 if use_facets:
                     pipe.zinterstore(facet_final_exact_match_key, facet_result_keys + [final_exact_match_key],
                                      aggregate='MIN')
-                    pipe.zrange(facet_final_exact_match_key, 0, MAX_RESULTS - 1)
+                    self._queue_range(pipe, facet_final_exact_match_key, data_key, MAX_RESULTS)
                 else:
-                    pipe.zrange(final_exact_match_key, 0, MAX_RESULTS - 1)
+                    self._queue_range(pipe, final_exact_match_key, data_key, MAX_RESULTS)
 
-        pipe.delete(*keys_to_delete)
+        for query_client, pipe in pipes.items():
+            self._queue_delete(pipe, keys_to_delete[query_client])
 
-        results = [i for i in pipe.execute() if type(i) == list]
+    def _get_variation_words(self, term, norm_terms):
+        """
+        The words of each normalized variation of a term whose prefix sets suggest intersects.
+        Variations with the same words are only queried once, and neither are those whose matches
+        all match another variation, as each word of the other starts one of theirs. When there are
+        still more than MAX_TERM_VARIATIONS, only the first of them are queried.
+        """
+        variations = []
+        for norm_term in norm_terms:
+            words = sorted(set(norm_term.split()))
+            if words not in variations:
+                variations.append(words)
+
+        def matches_all_of(words, other_words):
+            return all(any(other_word.startswith(word) for other_word in other_words) for word in words)
+
+        # Of variations that match all of each other's matches, the first one is kept
+        variations = [words for i, words in enumerate(variations) if not any(
+            matches_all_of(other_words, words) and (j < i or not matches_all_of(words, other_words))
+            for j, other_words in enumerate(variations) if j != i)]
+
+        max_variations = registry.get_autocompleter_setting(self.name, 'MAX_TERM_VARIATIONS')
+        if max_variations and len(variations) > max_variations:
+            logger.debug("Querying %d of the %d variations of term %r for autocompleter %s", max_variations,
+                         len(variations), term, self.name)
+            variations = variations[:max_variations]
+        return variations
+
+    def _parse_suggest(self, client_results, query_clients, providers, term):
+        """
+        Given a dict mapping clients to the results of the pipelines _queue_suggest queued on,
+        allocate result slots to providers and return a dict mapping providers to result IDs
+        along with a dict mapping providers to the raw payloads of those IDs.
+        """
+        MOVE_EXACT_MATCHES_TO_TOP = registry.get_autocompleter_setting(self.name, 'MOVE_EXACT_MATCHES_TO_TOP')
+        MAX_RESULTS = registry.get_autocompleter_setting(self.name, 'MAX_RESULTS')
+
+        provider_results = OrderedDict()
+        # Raw data payloads of the result IDs of each provider
+        provider_payloads = OrderedDict()
+        results = OrderedDict((query_client, [i for i in pipe_results if type(i) == list])
+                              for query_client, pipe_results in client_results.items())
 
         # Total number of results currently allocated to providers
         total_allocated_results = 0
@@ -741,11 +2053,13 @@ class Autocompleter(AutocompleterBase):
                 total_surplus += provider_max_results[provider_name]
                 continue
 
-            ids = results.pop(0)
+            ids, payloads = self._pop_range(results[query_clients[provider_name]])
+            provider_payloads[provider_name] = dict(zip(ids, payloads))
             # We merge exact matches with base matches by moving them to
             # the head of the results
             if MOVE_EXACT_MATCHES_TO_TOP:
-                exact_ids = results.pop(0)
+                exact_ids, payloads = self._pop_range(results[query_clients[provider_name]])
+                provider_payloads[provider_name].update(zip(exact_ids, payloads))
 
                 # Need to reverse exact IDs so high scores are behind low scores, since we
                 # are inserted in front of list.
@@ -799,13 +2113,105 @@ class Autocompleter(AutocompleterBase):
                 provider_results[provider_name] = provider_result_ids[provider][:num_results]
             except KeyError:
                 continue
+        return provider_results, provider_payloads
 
-        results = self._get_results_from_ids(provider_results)
+    def _queue_read_only_query(self, pipe, provider, keyspace, norm_terms, variations, facets, facet_keys_set,
+                               max_results, move_exact_matches_to_top):
+        """
+        Queue the same queries suggest makes for a provider with ZINTERSTORE and ZUNIONSTORE, using
+        the read only query script instead: first the query for the provider's result IDs, matching
+        the words of any of the given variations, then, when moving exact matches to the top, the
+        one for its exact match IDs, matching any of the norm terms. Queries of providers
+        with capped prefix sets also pass the script what it needs to find the IDs trimmed off them.
+        """
+        facet_groups = []
+        if len(facet_keys_set) > 0 and facet_keys_set.issubset(set(provider.get_facets())):
+            for facet in facets:
+                try:
+                    if facet['type'] not in ['and', 'or']:
+                        continue
+                    facet_groups.append({'type': facet['type'], 'keys': [
+                        FACET_SET_BASE_NAME % (keyspace, facet_dict['key'], facet_dict['value'],)
+                        for facet_dict in facet['facets']
+                    ]})
+                except KeyError:
+                    continue
 
-        # If told to, cache the final results for CACHE_TIMEOUT secnds
-        if settings.CACHE_TIMEOUT:
-            REDIS.setex(cache_key, settings.CACHE_TIMEOUT, self.__class__._serialize_data(results))
-        return results
+        data_key = AUTO_BASE_NAME % (keyspace,)
+        terms = [[PREFIX_BASE_NAME % (keyspace, norm_word,) for norm_word in words] for words in variations]
+        capped = None
+        if registry.get_provider_setting(provider, 'PREFIX_SET_MAX_SIZE'):
+            capped = {
+                'trimmed': PREFIX_TRIMMED_SET_BASE_NAME % (keyspace,),
+                'score_map': SCORE_MAP_BASE_NAME % (keyspace,),
+            }
+        stop_words = None
+        if self._has_stop_words(provider):
+            stop_words = {
+                'words': [utils.get_normalized_term(word)
+                          for word in registry.get_provider_setting(provider, 'STOP_WORDS')],
+                'min_share': registry.get_provider_setting(provider, 'STOP_WORD_MIN_SHARE'),
+            }
+        self._queue_query_script(pipe, terms, facet_groups, max_results, data_key, capped=capped,
+                                 stop_words=stop_words, words=variations,
+                                 term_map=TERM_MAP_BASE_NAME % (keyspace,))
+        if move_exact_matches_to_top:
+            terms = [[EXACT_BASE_NAME % (keyspace, norm_term,)] for norm_term in norm_terms]
+            self._queue_query_script(pipe, terms, facet_groups, max_results, data_key)
+
+    @staticmethod
+    def _use_query_script(provider):
+        """
+        Whether suggest queries a provider with the read only query script rather than with
+        ZINTERSTORE and ZUNIONSTORE. Besides when READ_ONLY_QUERIES is on, it does for providers
+        with capped prefix sets, which only the script can tell are missing IDs, and for providers
+        with stop words, which the script leaves out of intersections and checks matches for instead.
+        """
+        return bool(settings.READ_ONLY_QUERIES or registry.get_provider_setting(provider, 'PREFIX_SET_MAX_SIZE')
+                    or Autocompleter._has_stop_words(provider))
+
+    @staticmethod
+    def _has_stop_words(provider):
+        """
+        Whether a provider has STOP_WORDS, or words become stop words by STOP_WORD_MIN_SHARE.
+        """
+        return bool(registry.get_provider_setting(provider, 'STOP_WORDS')
+                    or registry.get_provider_setting(provider, 'STOP_WORD_MIN_SHARE'))
+
+    @staticmethod
+    def _queue_query_script(pipe, terms, facet_groups, limit, data_key, capped=None, stop_words=None, words=None,
+                            term_map=None):
+        """
+        Queue a call of the read only query script, which returns the first `limit` IDs in all sets
+        of any list of sets in `terms` that are in the sets of all facet groups, along with their
+        payloads. When `terms` are capped prefix sets, `capped` holds the keys the script finds the
+        IDs trimmed off them with. When the provider has stop words, `stop_words` holds them and the
+        share of objects that makes a word a stop word. Either way, the script also needs the prefix
+        of each set, `words`, and the term map to check the terms of objects against them.
+        """
+        keys = set(itertools.chain.from_iterable(terms))
+        for facet_group in facet_groups:
+            keys.update(facet_group['keys'])
+        keys.add(data_key)
+        query = {'terms': terms, 'facets': facet_groups, 'limit': limit, 'data': data_key,
+                 'max_walk': limit * settings.READ_ONLY_QUERY_MAX_WALK}
+        if capped is not None:
+            keys.update(capped.values())
+            query['capped'] = capped
+        if stop_words is not None:
+            query['stop_words'] = stop_words
+        if capped is not None or stop_words is not None:
+            keys.add(term_map)
+            query['words'] = words
+            query['term_map'] = term_map
+        Autocompleter._queue_script(pipe, QUERY_SCRIPT, sorted(keys), [json.dumps(query)])
+
+    def asuggest(self, term, facets=[]):
+        """
+        Coroutine suggesting matching objects, given a term, the same way as suggest but awaiting
+        Redis with redis.asyncio, see autocompleter.aio. Needs Python 3.7.
+        """
+        return get_aio().suggest(self, term, facets)
 
     def exact_suggest(self, term):
         """
@@ -815,52 +2221,113 @@ class Autocompleter(AutocompleterBase):
         if providers is None:
             return []
 
-        # If we have a cached version of the search results available, return it!
-        cache_key = EXACT_CACHE_BASE_NAME % (self.name, term,)
-        if settings.CACHE_TIMEOUT and REDIS.exists(cache_key):
-            return self.__class__._deserialize_data(REDIS.get(cache_key))
-        provider_results = OrderedDict()
-
+        # If we have a cached version of the search results available, return it! The in-process
+        # cache is checked first, then the Redis one.
+        query_key = ('exact_suggest', self.name, term)
+        local_cache_key, cached_results = self._get_local_cached_results(query_key)
+        if cached_results is not None:
+            return cached_results
+
+        client = get_read_client()
+        clients = self._get_read_clients(providers, client)
+        keyspaces, (cache_key,), (cached_results,), invalidation_counts = self._get_keyspaces_and_cached_results(
+            client, clients, EXACT_CACHE_BASE_NAME, [query_key])
+        if cached_results is not None:
+            return self._load_cached_results(cached_results, local_cache_key, providers, 'exact',
+                                             utils.get_norm_term_variations(term))
+
+        return self._single_flight(query_key, cache_key,
+            lambda: self._exact_suggest(clients, providers, keyspaces, term, cache_key, local_cache_key,
+                                        invalidation_counts))
+
+    def _exact_suggest(self, clients, providers, keyspaces, term, cache_key, local_cache_key,
+                       invalidation_counts=None):
+        """
+        Suggest matching objects of the given providers exactly matching the given term, given
+        their keyspaces, and cache them under the given keys, unless the given counts of
+        invalidations changed meanwhile. Read only queries are sent with the given clients, by
+        provider name. Each server's queries are sent concurrently.
+        """
         # Get the normalized we need to search for each term... A single term
         # could turn into multiple terms we need to search.
         norm_terms = utils.get_norm_term_variations(term)
         if len(norm_terms) == 0:
             return []
 
+        query_clients = self._get_query_clients(clients, providers)
+        pipes = self._get_pipelines(None, query_clients)
+        self._queue_exact_suggest(pipes, query_clients, providers, keyspaces, norm_terms)
+        provider_results, provider_payloads = self._parse_exact_suggest(
+            self._execute_pipelines(pipes), query_clients, providers)
+        results = self._get_results(provider_results, provider_payloads, keyspaces, clients)
+
+        # If told to, cache the final results for CACHE_TIMEOUT seconds
+        if cache_key is not None:
+            pipe = REDIS.pipeline()
+            self._queue_cache_results(pipe, cache_key, results, providers, EXACT_CACHE_TAG_BASE_NAME, norm_terms,
+                                      invalidation_counts)
+            pipe.execute()
+        self._set_local_cache(local_cache_key, results, providers, 'exact', norm_terms)
+        return results
+
+    def _queue_exact_suggest(self, pipes, query_clients, providers, keyspaces, norm_terms):
+        """
+        Queue the queries of exact_suggest for the given providers, given their keyspaces and the
+        normalized variations of the term, the same way _queue_suggest does.
+        """
         # Generate a unique identifier to be used for storing intermediate results. This is to
         # prevent redis key collisions between competing suggest / exact_suggest calls.
         uuid_str = str(uuid.uuid4())
-        intermediate_result_key = RESULT_SET_BASE_NAME % (uuid_str,)
+        intermediate_result_name = RESULT_SET_BASE_NAME % (uuid_str,)
 
         MAX_RESULTS = registry.get_autocompleter_setting(self.name, 'MAX_RESULTS')
 
-        # Get the matched result IDs
-        pipe = REDIS.pipeline()
+        # Get the matched result IDs along with their payloads
         for provider in providers:
-            provider_name = provider.provider_name
+            keyspace = keyspaces[provider.provider_name]
+            pipe = pipes[query_clients[provider.provider_name]]
             keys = []
             for norm_term in norm_terms:
-                keys.append(EXACT_BASE_NAME % (provider_name, norm_term,))
+                keys.append(EXACT_BASE_NAME % (keyspace, norm_term,))
             # Do not attempt zunionstore on empty list because redis errors out.
             if len(keys) == 0:
                 continue
+            if settings.READ_ONLY_QUERIES:
+                self._queue_query_script(pipe, [[key] for key in keys], [], MAX_RESULTS,
+                                         AUTO_BASE_NAME % (keyspace,))
+                continue
+            intermediate_result_key = self._get_result_key(intermediate_result_name, keyspace)
             pipe.zunionstore(intermediate_result_key, keys, aggregate='MIN')
-            pipe.zrange(intermediate_result_key, 0, MAX_RESULTS - 1)
+            self._queue_range(pipe, intermediate_result_key, AUTO_BASE_NAME % (keyspace,), MAX_RESULTS)
             pipe.delete(intermediate_result_key)
-        results = [i for i in pipe.execute() if type(i) == list]
+
+    def _parse_exact_suggest(self, client_results, query_clients, providers):
+        """
+        Given a dict mapping clients to the results of the pipelines _queue_exact_suggest queued
+        on, return a dict mapping providers to result IDs along with a dict mapping providers to
+        the raw payloads of those IDs.
+        """
+        MAX_RESULTS = registry.get_autocompleter_setting(self.name, 'MAX_RESULTS')
+
+        provider_results = OrderedDict()
+        provider_payloads = OrderedDict()
+        results = OrderedDict((query_client, [i for i in pipe_results if type(i) == list])
+                              for query_client, pipe_results in client_results.items())
 
         # Create a dict mapping provider to result IDs
         for provider in providers:
             provider_name = provider.provider_name
-            exact_ids = results.pop(0)
+            exact_ids, payloads = self._pop_range(results[query_clients[provider_name]])
             provider_results[provider_name] = exact_ids[:MAX_RESULTS]
+            provider_payloads[provider_name] = dict(zip(exact_ids, payloads))
+        return provider_results, provider_payloads
 
-        results = self._get_results_from_ids(provider_results)
-
-        # If told to, cache the final results for CACHE_TIMEOUT seconds
-        if settings.CACHE_TIMEOUT:
-            REDIS.setex(cache_key, settings.CACHE_TIMEOUT, self.__class__._serialize_data(results))
-        return results
+    def aexact_suggest(self, term):
+        """
+        Coroutine suggesting matching objects exactly matching term given, the same way as
+        exact_suggest but awaiting Redis with redis.asyncio, see autocompleter.aio. Needs Python 3.7.
+        """
+        return get_aio().exact_suggest(self, term)
 
     def get_provider_result_from_id(self, provider_name, object_id):
         """
@@ -876,24 +2343,119 @@ class Autocompleter(AutocompleterBase):
             result = {}
         return result
 
-    def _get_results_from_ids(self, provider_results):
+    def _get_results_from_ids(self, provider_results, keyspaces=None, clients=None):
         """
         Given a dict mapping providers to results IDs, return
         a dict mapping providers to results
         """
+        if clients is None:
+            providers = [provider for provider in self._get_all_providers_by_autocompleter() or []
+                         if provider.provider_name in provider_results]
+            clients = self._get_read_clients(providers, get_read_client())
+        if keyspaces is None:
+            keyspaces = self._get_keyspaces(clients)
+
         # Get the results for each provider
-        pipe = REDIS.pipeline()
+        pipes = self._get_pipelines(None, clients)
+        self._queue_payloads(pipes, clients, provider_results, keyspaces)
+        provider_payloads = self._parse_payloads(self._execute_pipelines(pipes), clients, provider_results)
+        return self._get_results_from_payloads(provider_results, provider_payloads)
+
+    @staticmethod
+    def _queue_payloads(pipes, clients, provider_results, keyspaces):
+        """
+        Queue fetching the raw payloads of a dict mapping providers to result IDs on a dict
+        mapping clients to pipelines.
+        """
+        for provider_name, ids in provider_results.items():
+            if len(ids) > 0:
+                key = AUTO_BASE_NAME % (keyspaces[provider_name],)
+                pipes[clients[provider_name]].hmget(key, ids)
+
+    @staticmethod
+    def _parse_payloads(client_results, clients, provider_results):
+        """
+        Given a dict mapping clients to the results of the pipelines _queue_payloads queued on,
+        return a dict mapping providers to the raw payloads of their result IDs.
+        """
+        provider_payloads = {}
         for provider_name, ids in provider_results.items():
             if len(ids) > 0:
-                key = AUTO_BASE_NAME % (provider_name,)
-                pipe.hmget(key, ids)
-        results = pipe.execute()
+                provider_payloads[provider_name] = dict(zip(ids, client_results[clients[provider_name]].pop(0)))
+        return provider_payloads
+
+    @staticmethod
+    def _get_result_key(result_name, keyspace):
+        """
+        Key of a temporary result set computed from the sets of the given keyspace.
+        """
+        return result_name + '.' + keyspace
+
+    @staticmethod
+    def _queue_range(pipe, key, data_key, limit):
+        """
+        Queue fetching the top IDs of a sorted set. The payloads of the IDs are fetched along
+        with them, so results take no extra round trip, except in cluster mode where scripts
+        cannot be sent in pipelines.
+        """
+        if settings.CLUSTER_MODE:
+            pipe.zrange(key, 0, limit - 1)
+        else:
+            Autocompleter._queue_script(pipe, RANGE_SCRIPT, [key, data_key], [limit])
+
+    @staticmethod
+    def _queue_script(pipe, script, keys, args):
+        """
+        Queue running a script on a pipeline. Scripts queued on a pipeline are loaded before it
+        runs if Redis does not have them, which Script itself only sees to for synchronous
+        pipelines, so it is done here for asyncio ones as well.
+        """
+        pipe.scripts.add(script)
+        script(keys=keys, args=args, client=pipe)
+
+    @staticmethod
+    def _pop_range(results):
+        """
+        Pop the IDs and payloads fetched by _queue_range off the pipeline results. There are no
+        payloads in cluster mode.
+        """
+        if settings.CLUSTER_MODE:
+            return results.pop(0), []
+        return results.pop(0)
+
+    @staticmethod
+    def _queue_delete(pipe, keys):
+        """
+        Queue deleting keys, one by one in cluster mode where they may live in different slots.
+        """
+        if len(keys) == 0:
+            return
+        if settings.CLUSTER_MODE:
+            for key in keys:
+                pipe.delete(key)
+        else:
+            pipe.delete(*keys)
+
+    def _get_results(self, provider_results, provider_payloads, keyspaces, clients):
+        """
+        Given a dict mapping providers to result IDs and a dict mapping providers to the raw
+        payloads fetched by _queue_range, return a dict mapping providers to results
+        """
+        if settings.CLUSTER_MODE:
+            return self._get_results_from_ids(provider_results, keyspaces, clients)
+        return self._get_results_from_payloads(provider_results, provider_payloads)
 
+    def _get_results_from_payloads(self, provider_results, provider_payloads):
+        """
+        Given a dict mapping providers to result IDs and a dict mapping providers to
+        the raw payloads of those IDs, return a dict mapping providers to results
+        """
         # Put them in the  provider results dict
         for provider_name, ids in provider_results.items():
             if len(ids) > 0:
+                payloads = provider_payloads[provider_name]
                 provider_results[provider_name] = \
-                    [self.__class__._deserialize_data(i) for i in results.pop(0) if i is not None]
+                    [self.__class__._deserialize_data(payloads[i]) for i in ids if payloads.get(i) is not None]
 
         if settings.FLATTEN_SINGLE_TYPE_RESULTS and len(provider_results) == 1:
             provider_results = list(provider_results.values())[0]
@@ -902,6 +2464,175 @@ class Autocompleter(AutocompleterBase):
     def _get_all_providers_by_autocompleter(self):
         return registry.get_all_by_autocompleter(self.name)
 
+    def _get_keyspaces_and_cached_results(self, client, clients, cache_base_name, query_keys, precomputed_keys=None):
+        """
+        Given a dict mapping provider names to the clients their reads are sent with, return a
+        dict mapping each provider name to the keyspace name of its live generation, along with
+        the cache keys of a list of queries and the raw results cached under them, all in a single
+        round trip per server. Cache keys and results are None when the result cache is off. Query
+        keys are the (method name, autocompleter name, ...) tuples identifying the queries, whose
+        remaining items complete the cache keys. Cached results are read with the given client.
+
+        Cache keys include the cache generation, so the results are read under the generation
+        this process last saw while the current one is read in the same pipeline. Only when
+        clear_cache bumped it since are the results read again.
+
+        Also returns the counts of invalidations of the providers whose INVALIDATE_CACHE_ON_STORE
+        setting is on, by key, for results computed from then on to be cached with (see
+        _queue_cache_results), or None when the result cache is off.
+
+        Given the keys of the precomputed results of the queries (see _get_precomputed_key), None
+        for queries without any, those are read in the same pipeline and returned in place of the
+        cached results, whether or not the result cache is on.
+        """
+        pipes = self._get_pipelines(client, clients)
+        cache_generation = self._queue_keyspaces_and_cached_results(pipes, client, clients, cache_base_name,
+                                                                    query_keys, precomputed_keys)
+        keyspaces, cache_keys, cached_results, invalidation_counts, stale = \
+            self._parse_keyspaces_and_cached_results(self._execute_pipelines(pipes), client, clients,
+                                                     cache_base_name, query_keys, cache_generation, precomputed_keys)
+        if stale:
+            uncached = [i for i, results in enumerate(cached_results) if results is None]
+            pipe = client.pipeline()
+            for i in uncached:
+                pipe.get(cache_keys[i])
+            for i, results in zip(uncached, pipe.execute()):
+                cached_results[i] = results
+        return keyspaces, cache_keys, cached_results, invalidation_counts
+
+    def _queue_keyspaces_and_cached_results(self, pipes, client, clients, cache_base_name, query_keys,
+                                            precomputed_keys=None):
+        """
+        Queue the reads of _get_keyspaces_and_cached_results on a dict mapping clients to pipelines.
+        Returns the cache generation the results are read under, or None when the result cache
+        is off.
+        """
+        for provider_name, provider_client in clients.items():
+            self._queue_get_generations(pipes[provider_client], [provider_name])
+        for precomputed_key in precomputed_keys or []:
+            if precomputed_key is not None:
+                pipes[client].get(precomputed_key)
+        if not settings.CACHE_TIMEOUT:
+            return None
+        cache_generation = self._cache_generations.get(self.name, 0)
+        pipes[client].get(CACHE_GENERATION_BASE_NAME % (self.name,))
+        for key in self._get_invalidation_count_keys():
+            pipes[client].get(key)
+        for query_key in query_keys:
+            pipes[client].get(cache_base_name % ((self.name, cache_generation,) + query_key[2:]))
+        return cache_generation
+
+    def _parse_keyspaces_and_cached_results(self, client_results, client, clients, cache_base_name, query_keys,
+                                            cache_generation, precomputed_keys=None):
+        """
+        Given a dict mapping clients to the results of the pipelines
+        _queue_keyspaces_and_cached_results queued on, and the cache generation it returned,
+        return the keyspaces, cache keys, cached results and counts of invalidations, and whether
+        the cache generation changed, in which case the results that are still None must be read
+        again from the returned cache keys.
+        """
+        keyspaces = self._get_keyspace_names(list(clients.keys()),
+            [client_results[provider_client].pop(0) for provider_client in clients.values()])
+        precomputed_results = [client_results[client].pop(0) if precomputed_key is not None else None
+                               for precomputed_key in precomputed_keys or [None] * len(query_keys)]
+        if cache_generation is None:
+            return keyspaces, [None] * len(query_keys), precomputed_results, None, False
+
+        current_cache_generation = int(client_results[client].pop(0) or 0)
+        invalidation_counts = OrderedDict(
+            (key, client_results[client].pop(0)) for key in self._get_invalidation_count_keys())
+        cached_results = client_results[client]
+        stale = current_cache_generation != cache_generation
+        if stale:
+            self._cache_generations[self.name] = current_cache_generation
+            cached_results = [None] * len(query_keys)
+        cached_results = [results if results is not None else cache_results
+                          for results, cache_results in zip(precomputed_results, cached_results)]
+        cache_keys = [cache_base_name % ((self.name, current_cache_generation,) + query_key[2:])
+                      for query_key in query_keys]
+        return keyspaces, cache_keys, cached_results, invalidation_counts, stale
+
+    @staticmethod
+    def _queue_get_generations(pipe, provider_names):
+        """
+        Queue reading the generation pointers of the given providers. They are read one by one
+        rather than with MGET, as in cluster mode they live in different slots.
+        """
+        for provider_name in provider_names:
+            pipe.get(GENERATION_BASE_NAME % (get_provider_key_name(provider_name),))
+
+    @staticmethod
+    def _get_keyspace_names(provider_names, generations):
+        """
+        Given a list of provider names and the values of their generation pointers, return a
+        dict mapping each provider name to the keyspace name of its live generation.
+        """
+        keyspaces = {}
+        for provider_name, generation in zip(provider_names, generations):
+            generation = int(generation) if generation is not None else 0
+            keyspaces[provider_name] = get_keyspace_name(provider_name, generation)
+        return keyspaces
+
+    @staticmethod
+    def _get_keyspaces(clients):
+        """
+        Given a dict mapping provider names to the clients their reads are sent with, return a
+        dict mapping each provider name to the keyspace name of its live generation. All
+        generation pointers are read in a single round trip per server.
+        """
+        pipes = Autocompleter._get_pipelines(None, clients)
+        for provider_name, client in clients.items():
+            Autocompleter._queue_get_generations(pipes[client], [provider_name])
+        client_results = Autocompleter._execute_pipelines(pipes)
+        return Autocompleter._get_keyspace_names(list(clients.keys()),
+            [client_results[client].pop(0) for client in clients.values()])
+
+    @staticmethod
+    def _get_query_clients(clients, providers):
+        """
+        Given a dict mapping provider names to the clients their reads are sent with, return the
+        one their queries are sent with. Queries storing intermediate results go to the primary
+        of each provider's server.
+        """
+        if settings.READ_ONLY_QUERIES:
+            return clients
+        return OrderedDict((provider.provider_name, provider.get_client()) for provider in providers)
+
+    @staticmethod
+    def _get_read_clients(providers, client):
+        """
+        Given a list of providers, return a dict mapping each provider name to the client its
+        reads are sent with: the given client for providers whose keys live on the default
+        server, and the client of their own server for the others.
+        """
+        clients = OrderedDict()
+        for provider in providers:
+            provider_client = provider.get_client()
+            clients[provider.provider_name] = client if provider_client is REDIS else provider_client
+        return clients
+
+    @staticmethod
+    def _get_pipelines(client, clients):
+        """
+        Return a dict mapping the given client, unless it is None, and each distinct client of a
+        dict mapping provider names to clients, to a pipeline of that client.
+        """
+        pipes = OrderedDict()
+        if client is not None:
+            pipes[client] = client.pipeline()
+        for provider_client in clients.values():
+            if provider_client not in pipes:
+                pipes[provider_client] = provider_client.pipeline()
+        return pipes
+
+    @staticmethod
+    def _execute_pipelines(pipes):
+        """
+        Execute a dict mapping clients to pipelines, the pipelines of different servers running
+        concurrently, and return a dict mapping each client to the results of its pipeline.
+        """
+        return OrderedDict(zip(pipes.keys(), execute_pipelines(list(pipes.values()))))
+
     @staticmethod
     def chunk_list(lst, chunk_size):
         """
@@ -915,6 +2646,24 @@ class Autocompleter(AutocompleterBase):
         for i in range(0, len(lst), chunk_size):
             yield lst[i:i + chunk_size]
 
+    @staticmethod
+    def chunk_iterator(iterable, chunk_size):
+        """
+        Given any iterable, return a generator of lists where each list is of size chunk_size or less.
+        Unlike chunk_list, this never holds more than one chunk in memory.
+
+        :param iterable: iterable to break up into chunks
+        :type iterable: iterable
+        :param chunk_size: size of each chunk
+        :type chunk_size: int
+        """
+        iterator = iter(iterable)
+        while True:
+            chunk = list(itertools.islice(iterator, chunk_size))
+            if len(chunk) == 0:
+                return
+            yield chunk
+
     @staticmethod
     def hash_facets(facets):
         """
@@ -0,0 +1,296 @@
+from collections import OrderedDict
+import json
+import logging
+import os
+import threading
+import time
+
+from autocompleter import settings, utils
+
+logger = logging.getLogger(__name__)
+
+
+class LocalResultCache(object):
+    """
+    A bounded, thread safe LRU cache of decoded suggest results with a TTL, kept in the memory
+    of each worker process in front of the Redis result cache. Keys are tuples whose second item
+    is the autocompleter name, so all of an autocompleter's entries can be dropped at once.
+    Results handed out are shared between callers, so they must not be mutated.
+
+    Entries can be tagged with the objects they may include (see get_tags), so invalidation
+    messages published when objects are stored or removed only drop the entries they affect.
+    Results computed while entries they could be part of were dropped are not cached, see set.
+    """
+    def __init__(self, max_size=None, timeout=None):
+        # When not given, the size and timeout follow the LOCAL_CACHE_SIZE and
+        # LOCAL_CACHE_TIMEOUT settings
+        self._max_size = max_size
+        self._timeout = timeout
+        self._entries = OrderedDict()
+        self._keys_by_tag = {}
+        # Number of invalidations so far, and the number each autocompleter's and provider's
+        # entries were last dropped at, by ('autocompleter', name) and ('provider', name)
+        self._sequence = 0
+        self._invalidated_at = {}
+        self._cleared_at = 0
+        self._lock = threading.Lock()
+        self._listener = None
+        self._listener_pid = None
+        # Set while the listener is subscribed and entries are safe to keep
+        self.subscribed = threading.Event()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @property
+    def max_size(self):
+        if self._max_size is None:
+            return settings.LOCAL_CACHE_SIZE
+        return self._max_size
+
+    @property
+    def timeout(self):
+        if self._timeout is None:
+            return settings.LOCAL_CACHE_TIMEOUT
+        return self._timeout
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key):
+        """
+        Get the results cached under key, or None if there are none or they expired.
+        """
+        with self._lock:
+            try:
+                expires_at, value, tags = self._entries.pop(key)
+            except KeyError:
+                self.misses += 1
+                return None
+            if expires_at <= time.time():
+                self._untag(key, tags)
+                self.misses += 1
+                return None
+            # Re-insert to mark the entry as most recently used
+            self._entries[key] = (expires_at, value, tags)
+            self.hits += 1
+            return value
+
+    def get_sequence(self):
+        """
+        The number of invalidations so far, to hand to set along with results computed from then on.
+        """
+        return self._sequence
+
+    def set(self, key, value, tags=(), sequence=None):
+        """
+        Cache results under key, evicting the least recently used entries beyond max_size. Given
+        the sequence get_sequence returned before the results were computed, they are not cached
+        if the autocompleter's entries, or those of any provider they are tagged with, were dropped
+        since, as the results may predate the change.
+        """
+        max_size = self.max_size
+        if max_size <= 0:
+            return
+        tags = frozenset(tags)
+        with self._lock:
+            if sequence is not None and self._invalidated_since(key, tags, sequence):
+                return
+            self._remove(key)
+            self._entries[key] = (time.time() + self.timeout, value, tags)
+            for tag in tags:
+                self._keys_by_tag.setdefault(tag, set()).add(key)
+            while len(self._entries) > max_size:
+                self._remove(next(iter(self._entries)))
+                self.evictions += 1
+
+    def delete(self, key):
+        with self._lock:
+            self._remove(key)
+
+    def _invalidated_since(self, key, tags, sequence):
+        if self._cleared_at > sequence:
+            return True
+        names = [('autocompleter', key[1])] + [tag for tag in tags if tag[0] == 'provider']
+        return any(self._invalidated_at.get(name, 0) > sequence for name in names)
+
+    def _count_invalidation(self, name):
+        with self._lock:
+            self._sequence += 1
+            if name is None:
+                self._cleared_at = self._sequence
+            else:
+                self._invalidated_at[name] = self._sequence
+
+    def delete_tagged(self, tags):
+        """
+        Drop all entries tagged with any of the given tags.
+        """
+        with self._lock:
+            for tag in tags:
+                for key in list(self._keys_by_tag.get(tag, ())):
+                    self._remove(key)
+
+    def delete_autocompleter(self, ac_name):
+        """
+        Drop all entries of an autocompleter.
+        """
+        with self._lock:
+            for key in [key for key in self._entries if key[1] == ac_name]:
+                self._remove(key)
+
+    def clear(self):
+        self._count_invalidation(None)
+        with self._lock:
+            self._entries.clear()
+            self._keys_by_tag.clear()
+
+    def _remove(self, key):
+        try:
+            expires_at, value, tags = self._entries.pop(key)
+        except KeyError:
+            return
+        self._untag(key, tags)
+
+    def _untag(self, key, tags):
+        for tag in tags:
+            keys = self._keys_by_tag.get(tag)
+            if keys is not None:
+                keys.discard(key)
+                if len(keys) == 0:
+                    del self._keys_by_tag[tag]
+
+    def get_stats(self):
+        """
+        Current size and lifetime hit, miss and eviction counts of the cache.
+        """
+        return {
+            'size': len(self._entries),
+            'max_size': self.max_size,
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+        }
+
+    @staticmethod
+    def get_tags(provider_names, kind, words):
+        """
+        Tags for an entry holding results of the given providers. kind is 'prefix' for suggest
+        results, tagged with the longest word of each of their query's norm terms, or 'exact' for
+        exact_suggest results, tagged with their norm terms.
+        """
+        tags = set()
+        for provider_name in provider_names:
+            tags.add(('provider', provider_name))
+            for word in words:
+                tags.add((kind, provider_name, word))
+        return tags
+
+    def invalidate(self, message):
+        """
+        Drop the entries affected by an invalidation message, which is one of:
+        {'autocompleter': name} to drop all of an autocompleter's entries,
+        {'provider': name} to drop all entries including a provider's results, or
+        {'provider': name, 'norm_terms': [...], 'exact_terms': [...]} to drop the entries an object
+        of a provider with those norm terms and exact match terms may be part of.
+        """
+        if 'autocompleter' in message:
+            self._count_invalidation(('autocompleter', message['autocompleter']))
+            self.delete_autocompleter(message['autocompleter'])
+            return
+        provider_name = message['provider']
+        self._count_invalidation(('provider', provider_name))
+        if 'norm_terms' not in message:
+            self.delete_tagged([('provider', provider_name)])
+            return
+        tags = [('prefix', provider_name, word_prefix)
+                for word_prefix in utils.get_norm_term_prefixes(message['norm_terms'])]
+        tags += [('exact', provider_name, norm_term) for norm_term in message['exact_terms']]
+        self.delete_tagged(tags)
+
+    def listen(self, client, channel):
+        """
+        Make sure a background thread of this process is subscribed to the invalidation channel,
+        dropping entries as other processes store and remove objects or clear caches.
+        """
+        pid = os.getpid()
+        if self._listener_pid == pid and self._listener.is_alive():
+            return
+        with self._lock:
+            if self._listener_pid == pid and self._listener.is_alive():
+                return
+            self._listener = threading.Thread(target=self._listen, args=(client, channel),
+                name='autocompleter-cache-invalidation')
+            self._listener.daemon = True
+            self._listener_pid = pid
+            self.subscribed.clear()
+            self._listener.start()
+
+    def _listen(self, client, channel):
+        while True:
+            try:
+                pubsub = client.pubsub(ignore_subscribe_messages=True)
+                pubsub.subscribe(channel)
+                # Messages published while we were not subscribed are lost, so start over
+                self.clear()
+                self.subscribed.set()
+                for message in pubsub.listen():
+                    data = message['data']
+                    if isinstance(data, bytes):
+                        data = data.decode('utf-8')
+                    self.invalidate(json.loads(data))
+            except Exception:
+                self.subscribed.clear()
+                logger.exception('Autocompleter cache invalidation listener failed, resubscribing')
+                time.sleep(1)
+
+
+class _Call(object):
+    def __init__(self):
+        self.done = threading.Event()
+        self.ok = False
+        self.value = None
+
+
+class SingleFlight(object):
+    """
+    Coalesces concurrent calls computing the same thing in a process. The first caller of a key
+    (the leader) computes the value, and callers asking for the same key meanwhile wait for it
+    and share it, so it must not be mutated.
+    """
+    def __init__(self):
+        self._calls = {}
+        self._lock = threading.Lock()
+        self.coalesced = 0
+
+    def do(self, key, fn, timeout=None):
+        """
+        Return fn(), or the value the leader of key computes. Callers that wait longer than
+        timeout seconds, or whose leader failed, call fn themselves.
+        """
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+            else:
+                self.coalesced += 1
+        if not leader:
+            if call.done.wait(timeout) and call.ok:
+                return call.value
+            return fn()
+        try:
+            call.value = fn()
+            call.ok = True
+            return call.value
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+
+
+# The cache shared by all autocompleters in this process
+local_cache = LocalResultCache()
+
+# Coalesces the identical suggest and exact_suggest calls of this process
+single_flight = SingleFlight()
@@ -0,0 +1,89 @@
+import importlib
+import os
+
+import redis
+
+from django.core.exceptions import ImproperlyConfigured
+
+try:
+    from redis.commands.core import AsyncScript, Script
+except ImportError:
+    from redis.client import Script
+    AsyncScript = None
+
+
+def import_client_class(module_name, class_name, min_version):
+    """
+    Import a client class redis-py only has from a given version on, raising ImproperlyConfigured
+    naming that version when the installed redis-py is older.
+    """
+    try:
+        module = importlib.import_module(module_name)
+    except ImportError:
+        raise ImproperlyConfigured('%s.%s needs redis-py %s or later, found %s' % (
+            module_name, class_name, min_version, redis.__version__))
+    return getattr(module, class_name)
+
+
+def create_client(connection, cluster=False, asynchronous=False):
+    """
+    Create a Redis client from a dict of connection parameters. The dict holds keyword arguments
+    of redis.Redis (host, port, db, password, unix_socket_path, socket_timeout, socket_keepalive,
+    max_connections, health_check_interval, ...), or a 'url' such as 'redis://localhost:6379/0' or
+    'unix:///tmp/redis.sock?db=0' along with any further keyword arguments.
+
+    If cluster is True, a RedisCluster client is created instead, from the parameters of any node.
+    If asynchronous is True, the client is a redis.asyncio one.
+    """
+    if asynchronous and cluster:
+        client_class = import_client_class('redis.asyncio.cluster', 'RedisCluster', '4.3')
+    elif asynchronous:
+        client_class = import_client_class('redis.asyncio', 'Redis', '4.2')
+    elif cluster:
+        client_class = import_client_class('redis.cluster', 'RedisCluster', '4.1')
+    else:
+        client_class = redis.Redis
+    connection = dict(connection)
+    url = connection.pop('url', None)
+    if url is not None:
+        return client_class.from_url(url, **connection)
+    return client_class(**connection)
+
+
+class LazyClient(object):
+    """
+    Stands in for a Redis client, creating the actual client from the given connection parameters
+    the first time it is used in each process. Clients, and their connection pools, are then never
+    created at import time nor shared between a process and the processes forked from it.
+
+    Asynchronous clients are redis.asyncio clients, whose connections belong to the event loop
+    they were opened in, so they are also created again for each event loop.
+    """
+    def __init__(self, connection, cluster=False, asynchronous=False):
+        self.connection = connection
+        self.cluster = cluster
+        self.asynchronous = asynchronous
+        self._client = None
+        self._key = None
+
+    def get_client(self):
+        key = os.getpid()
+        if self.asynchronous:
+            import asyncio
+            key = (key, asyncio.get_event_loop())
+        if self._client is None or self._key != key:
+            self._client = create_client(self.connection, self.cluster, self.asynchronous)
+            self._key = key
+        return self._client
+
+    def register_script(self, script):
+        # Scripts are registered with their source as bytes, whose SHA can be computed without
+        # asking the client for its encoder, so registering does not create the client
+        if not isinstance(script, bytes):
+            script = script.encode('utf-8')
+        if self.asynchronous:
+            return AsyncScript(self, script)
+        return Script(self, script)
+
+    def __getattr__(self, name):
+        return getattr(self.get_client(), name)
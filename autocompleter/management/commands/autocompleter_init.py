@@ -1,7 +1,7 @@
 from optparse import make_option
 import logging
 
-from django.core.management.base import BaseCommand
+from django.core.management.base import BaseCommand, CommandError
 
 from autocompleter import Autocompleter
 
@@ -23,6 +23,12 @@ class Command(BaseCommand):
             default=False,
             dest="store",
             help="Store all autocompleter data. Default to false.")
+        parser.add_argument("--rebuild",
+            action="store_true",
+            default=False,
+            dest="rebuild",
+            help="Store all autocompleter data into a new generation of keys, switch to it and "
+                 "remove the old generation, without taking the autocompleter offline. Default to false.")
         parser.add_argument("--clear_cache",
             action="store_true",
             default=False,
@@ -34,6 +40,18 @@ class Command(BaseCommand):
             dest="delete_old",
             help="Do not clear old terms from autocompleter when storing. "
                  "Recommended only to be used with store all after remove_all otherwise orphan keys will remain.")
+        parser.add_argument("--batch_size",
+            action="store",
+            default=None,
+            dest="batch_size",
+            help="Number of objects to store per Redis pipeline. Defaults to AUTOCOMPLETER_STORE_BATCH_SIZE.",
+            type=int)
+        parser.add_argument("--workers",
+            action="store",
+            default=None,
+            dest="workers",
+            help="Number of worker processes to store objects with. Defaults to AUTOCOMPLETER_STORE_WORKERS.",
+            type=int)
     help = "Store and/or remove autocompleter data"
 
     def handle(self, *args, **options):
@@ -53,7 +71,20 @@ class Command(BaseCommand):
         if options['store']:
             delete_old = options['delete_old']
             self.log.info("Storing all objects for autocompleter: %s" % (options['name']))
-            autocomp.store_all(delete_old=delete_old)
+            report = autocomp.store_all(delete_old=delete_old, batch_size=options['batch_size'],
+                workers=options['workers'])
+            for provider_name, num_stored in report['stored'].items():
+                self.log.info("Stored %d objects for provider: %s" % (num_stored, provider_name))
+            if len(report['errors']) > 0:
+                raise CommandError("Storing failed for %d partitions of autocompleter: %s" %
+                    (len(report['errors']), options['name']))
+        if options['rebuild']:
+            self.log.info("Rebuilding all objects for autocompleter: %s" % (options['name']))
+            report = autocomp.rebuild(batch_size=options['batch_size'], workers=options['workers'],
+                wait_for_gc=True)
+            if len(report['errors']) > 0:
+                raise CommandError("Rebuilding failed for %d partitions of autocompleter: %s" %
+                    (len(report['errors']), options['name']))
         if options['clear_cache']:
             self.log.info("Clearing cache for autocompleter: %s" % (options['name']))
             autocomp.clear_cache()
@@ -62,6 +62,21 @@ class AutocompleterRegistry(object):
             return None
         return self._providers_by_ac[ac_name]
 
+    def get_all_providers(self):
+        """
+        Get every provider registered with an autocompleter.
+        """
+        providers = []
+        for ac_providers in self._providers_by_ac.values():
+            providers += [provider for provider in ac_providers if provider not in providers]
+        return providers
+
+    def get_autocompleters_by_provider(self, provider):
+        """
+        Get the names of all autocompleters a provider is registered with.
+        """
+        return [ac_name for ac_name, providers in self._providers_by_ac.items() if provider in providers]
+
     def get_all_by_model(self, model=None):
         if model is None:
             return None
@@ -114,7 +129,7 @@ class AutocompleterRegistry(object):
             provider_settings = getattr(provider, 'settings')
         except AttributeError:
             setattr(provider, 'settings', {})
-            provider.settings[setting_name] = setting_value
+        provider.settings[setting_name] = setting_value
 
     def del_provider_setting(self, provider, setting_name):
         """
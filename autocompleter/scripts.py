@@ -0,0 +1,791 @@
+"""
+Lua scripts run inside Redis. autocompleter.base prepends the key name templates each
+script uses (AUTO_BASE_NAME, PREFIX_BASE_NAME, ...) as Lua locals before registering it,
+so key names are only ever defined in one place.
+"""
+
+# Functions shared by all scripts
+HELPERS = """
+local function get_keyspace(generation_key, provider_name, generation)
+    if generation == '' then
+        generation = redis.call('GET', generation_key) or '0'
+    end
+    local provider_key_name = string.format(PROVIDER_KEY_NAME, provider_name)
+    if generation == '0' then
+        return provider_key_name
+    end
+    return string.format(GENERATION_NAME, provider_key_name, generation)
+end
+
+-- Same as utils.get_norm_term_prefixes, walking words one UTF-8 character at a time
+local function get_prefixes(norm_terms)
+    local prefixes = {}
+    for _, norm_term in ipairs(norm_terms) do
+        for norm_word in string.gmatch(norm_term, '[^ ]+') do
+            local word_prefix = ''
+            for char in string.gmatch(norm_word, '[%z\\1-\\127\\194-\\244][\\128-\\191]*') do
+                word_prefix = word_prefix .. char
+                prefixes[word_prefix] = true
+            end
+        end
+    end
+    return prefixes
+end
+
+local function concat(first, second)
+    local items = {}
+    for _, item in ipairs(first) do
+        table.insert(items, item)
+    end
+    for _, item in ipairs(second) do
+        table.insert(items, item)
+    end
+    return items
+end
+
+local function to_set(items)
+    local set = {}
+    for _, item in ipairs(items) do
+        set[item] = true
+    end
+    return set
+end
+
+-- Names of the facet sets of the given facet dicts, whose keys and values are formatted by
+-- AutocompleterProviderBase._get_store_state
+local function get_facet_keys(keyspace, facet_dicts)
+    local keys = {}
+    for _, facet in ipairs(facet_dicts) do
+        if facet['key'] ~= nil and facet['value'] ~= nil then
+            keys[string.format(FACET_SET_BASE_NAME, keyspace, facet['key'], facet['value'])] = true
+        end
+    end
+    return keys
+end
+
+-- Remove obj_id from a sorted set, and the set's name from the set tracking all of them
+-- once nothing is left in it
+local function remove_member(key, set_name, name, obj_id)
+    redis.call('ZREM', key, obj_id)
+    if redis.call('EXISTS', key) == 0 then
+        redis.call('SREM', set_name, name)
+    end
+end
+
+-- Scores as Redis renders them, which tonumber does not parse when infinite
+local function to_score(value)
+    if value == 'inf' or value == '+inf' then
+        return math.huge
+    elseif value == '-inf' then
+        return -math.huge
+    end
+    return tonumber(value)
+end
+
+-- Add obj_id to the sorted set of a prefix holding at most max_size IDs, see
+-- AutocompleterProviderBase._store. Once IDs were trimmed off the set it only holds the first IDs
+-- of the prefix up to its last one, so IDs ranking after that one are left out.
+local function add_capped_member(key, trimmed_set_name, word_prefix, obj_id, score, max_size)
+    if redis.call('SISMEMBER', trimmed_set_name, word_prefix) == 1 then
+        redis.call('ZREM', key, obj_id)
+        local last = redis.call('ZRANGE', key, -1, -1, 'WITHSCORES')
+        if #last == 0 then
+            return
+        end
+        local last_score = to_score(last[2])
+        if score > last_score or (score == last_score and obj_id > last[1]) then
+            return
+        end
+    end
+    redis.call('ZADD', key, score, obj_id)
+    if redis.call('ZREMRANGEBYRANK', key, max_size, -1) > 0 then
+        redis.call('SADD', trimmed_set_name, word_prefix)
+    end
+end
+
+-- Unlink the keys in each of the given sets, then the sets themselves
+local function unlink_members(set_names)
+    for _, set_name in ipairs(set_names) do
+        local members = redis.call('SMEMBERS', set_name)
+        for i = 1, #members, 1000 do
+            redis.call('UNLINK', unpack(members, i, math.min(i + 999, #members)))
+        end
+        redis.call('UNLINK', set_name)
+    end
+end
+
+-- Same as AutocompleterProviderBase._invalidate_cache
+local function invalidate_cache(provider_name, norm_terms, exact_terms)
+    local tag_set_names = {}
+    local provider_key_name = string.format(PROVIDER_KEY_NAME, provider_name)
+    for word_prefix in pairs(get_prefixes(norm_terms)) do
+        table.insert(tag_set_names, string.format(CACHE_TAG_BASE_NAME, provider_key_name, word_prefix))
+    end
+    for norm_term in pairs(to_set(exact_terms)) do
+        table.insert(tag_set_names, string.format(EXACT_CACHE_TAG_BASE_NAME, provider_key_name, norm_term))
+    end
+    redis.call('INCR', string.format(CACHE_INVALIDATIONS_BASE_NAME, provider_key_name))
+    unlink_members(tag_set_names)
+end
+
+-- Tell in-process caches to drop the results an object may be part of, see
+-- LocalResultCache.invalidate
+local function publish_invalidation(provider_name, norm_terms, exact_terms)
+    redis.call('PUBLISH', CACHE_INVALIDATION_CHANNEL, cjson.encode({
+        provider = provider_name, norm_terms = norm_terms, exact_terms = exact_terms}))
+end
+"""
+
+# Store an object, the same way AutocompleterProviderBase._store does.
+# KEYS[1]: the provider's generation pointer
+# ARGV: provider name, generation ('' for the live one), obj ID, delete old ('1' or '0'),
+#       fingerprint, score, then the serialized norm terms, exact terms, facet dicts (with keys and
+#       values formatted, see get_facet_keys) and data, whether to invalidate cached results and
+#       whether to publish an invalidation message for in-process caches ('1' or '0'), and the
+#       maximum size of prefix sets (0 for none)
+STORE = """
+local provider_name, generation, obj_id = ARGV[1], ARGV[2], ARGV[3]
+local delete_old = ARGV[4] == '1'
+local fingerprint, score = ARGV[5], ARGV[6]
+local raw_norm_terms, raw_facet_dicts, data = ARGV[7], ARGV[9], ARGV[10]
+local invalidate = ARGV[11] == '1'
+local publish = ARGV[12] == '1'
+local prefix_set_max_size = tonumber(ARGV[13])
+local norm_terms = cjson.decode(raw_norm_terms)
+local exact_terms = cjson.decode(ARGV[8])
+local facet_dicts = cjson.decode(raw_facet_dicts)
+
+local keyspace = get_keyspace(KEYS[1], provider_name, generation)
+local data_map_name = string.format(AUTO_BASE_NAME, keyspace)
+local term_map_name = string.format(TERM_MAP_BASE_NAME, keyspace)
+local facet_map_name = string.format(FACET_MAP_BASE_NAME, keyspace)
+local fingerprint_map_name = string.format(FINGERPRINT_MAP_BASE_NAME, keyspace)
+
+-- Nothing changed, or only the data payload did
+local old_fingerprint = redis.call('HGET', fingerprint_map_name, obj_id)
+if old_fingerprint == fingerprint then
+    return 0
+end
+if old_fingerprint and string.sub(old_fingerprint, 1, 20) == string.sub(fingerprint, 1, 20) then
+    redis.call('HSET', data_map_name, obj_id, data)
+    redis.call('HSET', fingerprint_map_name, obj_id, fingerprint)
+    if invalidate then
+        invalidate_cache(provider_name, norm_terms, exact_terms)
+    end
+    if publish then
+        publish_invalidation(provider_name, norm_terms, exact_terms)
+    end
+    return 1
+end
+
+local raw_old_norm_terms = redis.call('HGET', term_map_name, obj_id)
+local raw_old_facets = redis.call('HGET', facet_map_name, obj_id)
+local old_norm_terms = {}
+local old_facets = {}
+if delete_old then
+    if raw_old_norm_terms then
+        old_norm_terms = cjson.decode(raw_old_norm_terms)
+    end
+    if raw_old_facets then
+        old_facets = cjson.decode(raw_old_facets)
+    end
+end
+
+-- Prefixes
+local old_prefixes = get_prefixes(old_norm_terms)
+local new_prefixes = get_prefixes(norm_terms)
+local prefix_set_name = string.format(PREFIX_SET_BASE_NAME, keyspace)
+for word_prefix in pairs(old_prefixes) do
+    if not new_prefixes[word_prefix] then
+        remove_member(string.format(PREFIX_BASE_NAME, keyspace, word_prefix), prefix_set_name, word_prefix, obj_id)
+    end
+end
+local trimmed_set_name = string.format(PREFIX_TRIMMED_SET_BASE_NAME, keyspace)
+for word_prefix in pairs(new_prefixes) do
+    local key = string.format(PREFIX_BASE_NAME, keyspace, word_prefix)
+    if prefix_set_max_size > 0 then
+        add_capped_member(key, trimmed_set_name, word_prefix, obj_id, to_score(score), prefix_set_max_size)
+    elseif old_prefixes[word_prefix] then
+        redis.call('ZADD', key, 'XX', score, obj_id)
+    else
+        redis.call('ZADD', key, score, obj_id)
+    end
+    if not old_prefixes[word_prefix] then
+        redis.call('SADD', prefix_set_name, word_prefix)
+    end
+end
+
+-- Exact terms
+local old_exact_terms = to_set(old_norm_terms)
+local new_exact_terms = to_set(exact_terms)
+local exact_set_name = string.format(EXACT_SET_BASE_NAME, keyspace)
+for norm_term in pairs(old_exact_terms) do
+    if not new_exact_terms[norm_term] then
+        remove_member(string.format(EXACT_BASE_NAME, keyspace, norm_term), exact_set_name, norm_term, obj_id)
+    end
+end
+for norm_term in pairs(new_exact_terms) do
+    redis.call('ZADD', string.format(EXACT_BASE_NAME, keyspace, norm_term), score, obj_id)
+    if not old_exact_terms[norm_term] then
+        redis.call('SADD', exact_set_name, norm_term)
+    end
+end
+
+-- Facets
+local old_facet_keys = get_facet_keys(keyspace, old_facets)
+local new_facet_keys = get_facet_keys(keyspace, facet_dicts)
+for key in pairs(old_facet_keys) do
+    if not new_facet_keys[key] then
+        redis.call('ZREM', key, obj_id)
+    end
+end
+for key in pairs(new_facet_keys) do
+    redis.call('ZADD', key, score, obj_id)
+end
+
+-- Mappings of obj ID to data payload, norm terms, facets and fingerprint
+redis.call('HSET', data_map_name, obj_id, data)
+if raw_old_norm_terms ~= raw_norm_terms then
+    redis.call('HSET', term_map_name, obj_id, raw_norm_terms)
+end
+if #facet_dicts > 0 then
+    redis.call('HSET', facet_map_name, obj_id, raw_facet_dicts)
+elseif delete_old and raw_old_facets then
+    redis.call('HDEL', facet_map_name, obj_id)
+end
+redis.call('HSET', fingerprint_map_name, obj_id, fingerprint)
+if prefix_set_max_size > 0 then
+    redis.call('HSET', string.format(SCORE_MAP_BASE_NAME, keyspace), obj_id, score)
+end
+
+-- Cached results the object may have been part of before or may be part of now
+local stored_norm_terms = {}
+if raw_old_norm_terms then
+    stored_norm_terms = cjson.decode(raw_old_norm_terms)
+end
+if invalidate then
+    invalidate_cache(provider_name, concat(stored_norm_terms, norm_terms), concat(stored_norm_terms, exact_terms))
+end
+if publish then
+    publish_invalidation(provider_name, concat(stored_norm_terms, norm_terms), concat(stored_norm_terms, exact_terms))
+end
+return 1
+"""
+
+# Remove an object, the same way AutocompleterProviderBase.remove does.
+# KEYS[1]: the provider's generation pointer
+# ARGV: provider name, generation ('' for the live one), obj ID, whether to invalidate cached
+#       results and whether to publish an invalidation message for in-process caches ('1' or '0')
+# Returns the object's serialized norm terms, if it was stored
+REMOVE = """
+local provider_name, generation, obj_id = ARGV[1], ARGV[2], ARGV[3]
+local invalidate = ARGV[4] == '1'
+local publish = ARGV[5] == '1'
+local keyspace = get_keyspace(KEYS[1], provider_name, generation)
+
+local term_map_name = string.format(TERM_MAP_BASE_NAME, keyspace)
+local raw_old_norm_terms = redis.call('HGET', term_map_name, obj_id)
+if raw_old_norm_terms then
+    local old_norm_terms = cjson.decode(raw_old_norm_terms)
+    local prefix_set_name = string.format(PREFIX_SET_BASE_NAME, keyspace)
+    for word_prefix in pairs(get_prefixes(old_norm_terms)) do
+        remove_member(string.format(PREFIX_BASE_NAME, keyspace, word_prefix), prefix_set_name, word_prefix, obj_id)
+    end
+    local exact_set_name = string.format(EXACT_SET_BASE_NAME, keyspace)
+    for norm_term in pairs(to_set(old_norm_terms)) do
+        remove_member(string.format(EXACT_BASE_NAME, keyspace, norm_term), exact_set_name, norm_term, obj_id)
+    end
+    redis.call('HDEL', string.format(AUTO_BASE_NAME, keyspace), obj_id)
+    redis.call('HDEL', term_map_name, obj_id)
+    redis.call('HDEL', string.format(FINGERPRINT_MAP_BASE_NAME, keyspace), obj_id)
+    redis.call('HDEL', string.format(SCORE_MAP_BASE_NAME, keyspace), obj_id)
+    if invalidate then
+        invalidate_cache(provider_name, old_norm_terms, old_norm_terms)
+    end
+    if publish then
+        publish_invalidation(provider_name, old_norm_terms, old_norm_terms)
+    end
+end
+
+local facet_map_name = string.format(FACET_MAP_BASE_NAME, keyspace)
+local raw_old_facets = redis.call('HGET', facet_map_name, obj_id)
+if raw_old_facets then
+    for key in pairs(get_facet_keys(keyspace, cjson.decode(raw_old_facets))) do
+        redis.call('ZREM', key, obj_id)
+    end
+    redis.call('HDEL', facet_map_name, obj_id)
+end
+return raw_old_norm_terms
+"""
+
+# Remove an object from a sorted set, and the set's name from the set tracking all of them once
+# nothing is left in it, the same way the store and remove scripts do.
+# KEYS[1]: the sorted set
+# KEYS[2]: the set tracking it
+# ARGV: the sorted set's name in the tracking set, and the obj ID
+REMOVE_MEMBER = """
+remove_member(KEYS[1], KEYS[2], ARGV[1], ARGV[2])
+return 1
+"""
+
+# Add an object to the sorted set of a prefix holding at most a given number of IDs, the same way
+# the store script does when PREFIX_SET_MAX_SIZE is set.
+# KEYS[1]: the prefix's sorted set
+# KEYS[2]: the set of the provider's prefixes whose sorted sets were trimmed
+# ARGV: the prefix, obj ID, score and maximum number of IDs
+ADD_CAPPED = """
+add_capped_member(KEYS[1], KEYS[2], ARGV[1], ARGV[2], to_score(ARGV[3]), tonumber(ARGV[4]))
+return 1
+"""
+
+# Get the first IDs of a sorted set along with their data payloads, so query results are
+# hydrated in the same round trip they are selected in.
+# KEYS[1]: the sorted set
+# KEYS[2]: the provider's data hash
+# ARGV: the number of IDs to get
+# Returns the IDs and their payloads, a payload being nil when the ID has none
+RANGE = """
+local ids = redis.call('ZRANGE', KEYS[1], 0, tonumber(ARGV[1]) - 1)
+if #ids == 0 then
+    return {ids, {}}
+end
+return {ids, redis.call('HMGET', KEYS[2], unpack(ids))}
+"""
+
+# Same as the ZINTERSTORE / ZUNIONSTORE queries of Autocompleter.suggest, but writing nothing so
+# it can run on a read replica. The matching IDs are combined in memory, sorted and trimmed to the
+# limit. Facet sets only filter IDs, as they hold the same scores as the prefix and exact sets.
+# Intersections are planned by the size of the sets, see get_matches.
+# KEYS: every key the query reads
+# ARGV: the query, a JSON object with
+#   terms: a list of lists of sorted set names, IDs in all sets of any list match
+#   facets: a list of {type = 'and' or 'or', keys = [...]} the matching IDs must also be in
+#   limit: the number of IDs to return
+#   data: the provider's data hash
+#   max_walk: the number of IDs of the smallest set a walk checks before intersecting the sets
+#       instead, 0 for no limit
+#   words: the prefix of each set in terms, along with the provider's term map under term_map,
+#       when the query needs to check the terms of objects, that is when it has
+#   capped: when the provider's prefix sets are capped by PREFIX_SET_MAX_SIZE, its set of trimmed
+#       prefixes and score map
+#   stop_words: when the provider has STOP_WORDS or a STOP_WORD_MIN_SHARE, those words and that share
+# Returns the first matching IDs and their payloads, like RANGE
+QUERY = """
+local query = cjson.decode(ARGV[1])
+local limit = query['limit']
+local capped = query['capped']
+
+-- Number of IDs in each set, read once per call
+local cards = {}
+local function card(key)
+    if cards[key] == nil then
+        cards[key] = redis.call('ZCARD', key)
+    end
+    return cards[key]
+end
+
+local function add_scores(scores, reply)
+    for i = 1, #reply, 2 do
+        local id, score = reply[i], to_score(reply[i + 1])
+        if scores[id] == nil or score < scores[id] then
+            scores[id] = score
+        end
+    end
+end
+
+-- Whether the IDs in all of the given prefix sets may miss some that match. A trimmed set only
+-- holds the first IDs of its prefix, which answers a query of its own prefix as long as it holds
+-- enough of them, but not one it is combined with other sets in.
+local function is_incomplete(keys, words)
+    local trimmed = false
+    for _, word in ipairs(words) do
+        if redis.call('SISMEMBER', capped['trimmed'], word) == 1 then
+            trimmed = true
+        end
+    end
+    if not trimmed then
+        return false
+    end
+    return #keys > 1 or #query['facets'] > 0 or card(keys[1]) < limit
+end
+
+-- Whether some word of the serialized norm terms starts with each of the given prefixes
+local function has_prefixes(raw_norm_terms, words)
+    local norm_words = {}
+    for _, norm_term in ipairs(cjson.decode(raw_norm_terms)) do
+        for norm_word in string.gmatch(norm_term, '[^ ]+') do
+            table.insert(norm_words, norm_word)
+        end
+    end
+    for _, word in ipairs(words) do
+        local found = false
+        for _, norm_word in ipairs(norm_words) do
+            if string.sub(norm_word, 1, #word) == word then
+                found = true
+                break
+            end
+        end
+        if not found then
+            return false
+        end
+    end
+    return true
+end
+
+-- The IDs in all of the given prefix sets, with their scores, like ZINTER WITHSCORES, when some
+-- of the sets are trimmed. Candidate IDs are taken from the smallest set the matches must all be
+-- in that was not trimmed, either one of the prefix sets or the sets of a facet group, or else
+-- from a scan of all of the provider's objects, and the norm terms of each are checked for the
+-- prefixes.
+local function get_capped_matches(keys, words)
+    local sources, size
+    for j, key in ipairs(keys) do
+        if redis.call('SISMEMBER', capped['trimmed'], words[j]) == 0 then
+            local key_size = card(key)
+            if sources == nil or key_size < size then
+                sources, size = {key}, key_size
+            end
+        end
+    end
+    for _, facet in ipairs(query['facets']) do
+        local facet_sources, facet_size = {}, 0
+        for _, key in ipairs(facet['keys']) do
+            local key_size = card(key)
+            if facet['type'] ~= 'and' then
+                table.insert(facet_sources, key)
+                facet_size = facet_size + key_size
+            elseif #facet_sources == 0 or key_size < facet_size then
+                facet_sources, facet_size = {key}, key_size
+            end
+        end
+        if #facet_sources > 0 and (sources == nil or facet_size < size) then
+            sources, size = facet_sources, facet_size
+        end
+    end
+
+    local matches = {}
+    if sources == nil then
+        local matching_ids = {}
+        local cursor = '0'
+        repeat
+            local reply = redis.call('HSCAN', query['term_map'], cursor, 'COUNT', 1000)
+            cursor = reply[1]
+            for i = 1, #reply[2], 2 do
+                if has_prefixes(reply[2][i + 1], words) then
+                    table.insert(matching_ids, reply[2][i])
+                end
+            end
+        until cursor == '0'
+        for i = 1, #matching_ids, 1000 do
+            local chunk = {unpack(matching_ids, i, math.min(i + 999, #matching_ids))}
+            local chunk_scores = redis.call('HMGET', capped['score_map'], unpack(chunk))
+            for j, id in ipairs(chunk) do
+                if chunk_scores[j] then
+                    table.insert(matches, id)
+                    table.insert(matches, chunk_scores[j])
+                end
+            end
+        end
+        return matches
+    end
+
+    local candidate_scores = {}
+    local candidates = {}
+    for _, key in ipairs(sources) do
+        local reply = redis.call('ZRANGE', key, 0, -1, 'WITHSCORES')
+        for i = 1, #reply, 2 do
+            if candidate_scores[reply[i]] == nil then
+                table.insert(candidates, reply[i])
+            end
+            candidate_scores[reply[i]] = reply[i + 1]
+        end
+    end
+    for i = 1, #candidates, 1000 do
+        local chunk = {unpack(candidates, i, math.min(i + 999, #candidates))}
+        local chunk_terms = redis.call('HMGET', query['term_map'], unpack(chunk))
+        for j, id in ipairs(chunk) do
+            if chunk_terms[j] and has_prefixes(chunk_terms[j], words) then
+                table.insert(matches, id)
+                table.insert(matches, candidate_scores[id])
+            end
+        end
+    end
+    return matches
+end
+
+-- The IDs in all of the given sets, with their scores, that are also in the sets of all facet
+-- groups. IDs have the same score in every set, so walking the smallest set the IDs must be in
+-- from its first ID on, and checking the others for each, finds the first matching IDs without
+-- intersecting the sets in full. That pays off when the matches are expected to be found well
+-- before the end of the smallest set, going by the share of the provider's objects in each set.
+-- Otherwise the sets are intersected with ZINTER, and facets filter its result afterwards. IDs
+-- must also have a word starting with each of the given prefixes left out of the sets, which is
+-- checked as they are walked. Without such prefixes, a walk that checked max_walk IDs without
+-- finding enough matches gives up on the estimate, and the sets are intersected with ZINTER.
+local function get_matches(keys, checks)
+    local required = {}
+    for _, key in ipairs(keys) do
+        table.insert(required, key)
+    end
+    local groups = {}
+    for _, facet in ipairs(query['facets']) do
+        if facet['type'] == 'and' then
+            for _, key in ipairs(facet['keys']) do
+                table.insert(required, key)
+            end
+        else
+            table.insert(groups, facet['keys'])
+        end
+    end
+    local smallest = 1
+    for j, key in ipairs(required) do
+        if card(key) < card(required[smallest]) then
+            smallest = j
+        end
+    end
+    local driver = table.remove(required, smallest)
+    local driver_size = card(driver)
+    local total = redis.call('HLEN', query['data'])
+    if driver_size == 0 or total == 0 then
+        return {}
+    end
+
+    -- Share of the IDs of the smallest set expected to match, taking sets to be independent
+    local selectivity = 1
+    for _, key in ipairs(required) do
+        selectivity = selectivity * math.min(1, card(key) / total)
+    end
+    for _, group in ipairs(groups) do
+        local group_size = 0
+        for _, key in ipairs(group) do
+            group_size = group_size + card(key)
+        end
+        selectivity = selectivity * math.min(1, group_size / total)
+    end
+    if selectivity == 0 then
+        return {}
+    end
+    local function intersect()
+        local args = concat({#keys}, keys)
+        table.insert(args, 'AGGREGATE')
+        table.insert(args, 'MIN')
+        table.insert(args, 'WITHSCORES')
+        return redis.call('ZINTER', unpack(args))
+    end
+    local expected_walk = math.ceil(limit / selectivity)
+    if expected_walk * 2 > driver_size and #checks == 0 then
+        return intersect()
+    end
+    local walk_size = driver_size
+    if #checks == 0 and query['max_walk'] > 0 then
+        walk_size = math.min(walk_size, query['max_walk'])
+    end
+
+    local matches = {}
+    local found = 0
+    local chunk_size = math.max(limit, math.min(expected_walk, 1000))
+    local start = 0
+    while found < limit and start < walk_size do
+        local reply = redis.call('ZRANGE', driver, start, math.min(start + chunk_size, walk_size) - 1, 'WITHSCORES')
+        start = start + chunk_size
+        local chunk = {}
+        local matching = {}
+        for i = 1, #reply, 2 do
+            table.insert(chunk, reply[i])
+            table.insert(matching, true)
+        end
+        for _, key in ipairs(required) do
+            local chunk_scores = redis.call('ZMSCORE', key, unpack(chunk))
+            for j = 1, #chunk do
+                matching[j] = matching[j] and chunk_scores[j] ~= false
+            end
+        end
+        for _, group in ipairs(groups) do
+            local in_group = {}
+            for _, key in ipairs(group) do
+                local chunk_scores = redis.call('ZMSCORE', key, unpack(chunk))
+                for j = 1, #chunk do
+                    in_group[j] = in_group[j] or chunk_scores[j] ~= false
+                end
+            end
+            for j = 1, #chunk do
+                matching[j] = matching[j] and in_group[j]
+            end
+        end
+        if #checks > 0 then
+            local chunk_terms = redis.call('HMGET', query['term_map'], unpack(chunk))
+            for j = 1, #chunk do
+                matching[j] = matching[j] and chunk_terms[j] and has_prefixes(chunk_terms[j], checks)
+            end
+        end
+        for j, id in ipairs(chunk) do
+            if matching[j] and found < limit then
+                table.insert(matches, id)
+                table.insert(matches, reply[2 * j])
+                found = found + 1
+            end
+        end
+    end
+    if found < limit and walk_size < driver_size then
+        return intersect()
+    end
+    return matches
+end
+
+-- The sets of a multi-word term to intersect, and the prefixes of those left out of the
+-- intersection, the stop words. Those are the provider's stop words and the words whose sets hold
+-- at least a given share of its objects, which barely narrow the matches down. The word with the
+-- smallest set is always intersected.
+local function split_stop_words(keys, words)
+    if query['stop_words'] == nil or #keys < 2 then
+        return keys, {}
+    end
+    local stop_words = to_set(query['stop_words']['words'])
+    local min_share = query['stop_words']['min_share']
+    local total = redis.call('HLEN', query['data'])
+    local smallest = 1
+    for j, key in ipairs(keys) do
+        if card(key) < card(keys[smallest]) then
+            smallest = j
+        end
+    end
+    local kept, checks = {}, {}
+    for j, key in ipairs(keys) do
+        if j ~= smallest and (stop_words[words[j]] or (min_share > 0 and card(key) >= min_share * total)) then
+            table.insert(checks, words[j])
+        else
+            table.insert(kept, key)
+        end
+    end
+    return kept, checks
+end
+
+-- Without facets to filter by, the first IDs of a union are among the first IDs of each set
+local scores = {}
+for i, keys in ipairs(query['terms']) do
+    if capped and is_incomplete(keys, query['words'][i]) then
+        add_scores(scores, get_capped_matches(keys, query['words'][i]))
+    else
+        local kept, checks = split_stop_words(keys, query['words'] and query['words'][i])
+        if #kept == 1 and #checks == 0 and #query['facets'] == 0 then
+            add_scores(scores, redis.call('ZRANGE', kept[1], 0, limit - 1, 'WITHSCORES'))
+        else
+            add_scores(scores, get_matches(kept, checks))
+        end
+    end
+end
+
+local ids = {}
+for id in pairs(scores) do
+    table.insert(ids, id)
+end
+for _, facet in ipairs(query['facets']) do
+    local matches = {}
+    for _, key in ipairs(facet['keys']) do
+        for i = 1, #ids, 1000 do
+            local chunk = {unpack(ids, i, math.min(i + 999, #ids))}
+            local facet_scores = redis.call('ZMSCORE', key, unpack(chunk))
+            for j, id in ipairs(chunk) do
+                if facet_scores[j] then
+                    matches[id] = (matches[id] or 0) + 1
+                end
+            end
+        end
+    end
+    local needed = 1
+    if facet['type'] == 'and' then
+        needed = #facet['keys']
+    end
+    local filtered_ids = {}
+    for _, id in ipairs(ids) do
+        if (matches[id] or 0) >= needed then
+            table.insert(filtered_ids, id)
+        end
+    end
+    ids = filtered_ids
+end
+
+-- Sorted the way ZRANGE sorts, by score and then lexicographically
+table.sort(ids, function(a, b)
+    if scores[a] ~= scores[b] then
+        return scores[a] < scores[b]
+    end
+    return a < b
+end)
+local result = {}
+for i = 1, math.min(limit, #ids) do
+    result[i] = ids[i]
+end
+if #result == 0 then
+    return {result, {}}
+end
+return {result, redis.call('HMGET', query['data'], unpack(result))}
+"""
+
+# Drop cached results, the same way AutocompleterProviderBase._invalidate_cache does.
+# KEYS[1]: the provider's count of invalidations
+# KEYS[2...]: the tag sets of cache keys to drop
+INVALIDATE = """
+redis.call('INCR', KEYS[1])
+local tag_set_names = {}
+for i = 2, #KEYS do
+    table.insert(tag_set_names, KEYS[i])
+end
+unlink_members(tag_set_names)
+return 1
+"""
+
+# Cache results, unless the results of any of their providers were dropped while they were
+# computed, see Autocompleter._queue_cache_results.
+# KEYS: the providers' counts of invalidations, the cache key, then the tag sets to add it to
+# ARGV: the number of counts, the counts read before the results were computed ('' for none),
+#       the timeout and the serialized results
+CACHE_RESULTS = """
+local num_counts = tonumber(ARGV[1])
+for i = 1, num_counts do
+    if (redis.call('GET', KEYS[i]) or '') ~= ARGV[i + 1] then
+        return 0
+    end
+end
+local cache_key = KEYS[num_counts + 1]
+local timeout = ARGV[num_counts + 2]
+redis.call('SETEX', cache_key, timeout, ARGV[num_counts + 3])
+for i = num_counts + 2, #KEYS do
+    redis.call('SADD', KEYS[i], cache_key)
+    redis.call('EXPIRE', KEYS[i], timeout)
+end
+return 1
+"""
+
+# Write precomputed results, unless results of the same prefix computed later were written
+# already, see Autocompleter.precompute.
+# KEYS[1]: the map of each prefix to the count its precomputed results were computed at
+# KEYS[2...]: the keys of the precomputed results of each prefix
+# ARGV: the count the results were computed at, the number of seconds to keep them (0 for good),
+#       then the prefix and serialized results of each key
+SET_PRECOMPUTED = """
+local sequence = tonumber(ARGV[1])
+local timeout = tonumber(ARGV[2])
+for i = 2, #KEYS do
+    local prefix, results = ARGV[2 * i - 1], ARGV[2 * i]
+    if tonumber(redis.call('HGET', KEYS[1], prefix) or '0') < sequence then
+        redis.call('HSET', KEYS[1], prefix, sequence)
+        if timeout > 0 then
+            redis.call('SET', KEYS[i], results, 'EX', timeout)
+        else
+            redis.call('SET', KEYS[i], results)
+        end
+    end
+end
+return 1
+"""
+
+# Release a lock, unless it expired and was taken by someone else meanwhile.
+# KEYS[1]: the lock
+# ARGV: the token the lock was taken with
+RELEASE_LOCK = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    return redis.call('DEL', KEYS[1])
+end
+return 0
+"""
@@ -8,6 +8,12 @@ CACHE_TIMEOUT = getattr(settings, 'AUTOCOMPLETER_CACHE_TIMEOUT', 0)
 # Regex that filters out characters we ignore for the purposes of autocompleting
 CHARACTER_FILTER = getattr(settings, 'AUTOCOMPLETER_CHARACTER_FILTER', r'[^a-z0-9_ ]')
 
+# Whether Redis is a Redis Cluster. Clients are then cluster clients, and all keys of a provider
+# share a hash tag so they live in one slot. LUA_WRITES, READ_ONLY_QUERIES,
+# INVALIDATE_CACHE_ON_STORE, PREFIX_SET_MAX_SIZE and stop words are not supported in cluster mode,
+# and turning any of them on along with it raises ImproperlyConfigured at startup.
+CLUSTER_MODE = getattr(settings, 'AUTOCOMPLETER_CLUSTER_MODE', False)
+
 # Name of variable autocompleter will look for to populate facet data on a suggest call
 FACET_PARAMETER_NAME = getattr(settings, 'AUTOCOMPLETER_FACET_PARAMETER_NAME', 'facets')
 
@@ -20,9 +26,71 @@ FLATTEN_SINGLE_TYPE_RESULTS = getattr(settings, 'AUTOCOMPLETER_FLATTEN_SINGLE_TY
 # Meaning by default, 'U/S-A' will also be stored as 'U SA', 'US A', 'U S A', and 'USA'
 JOIN_CHARS = getattr(settings, 'AUTOCOMPLETER_JOIN_CHARS', ['-', '/'])
 
-# Redis connection parameters
+# Number of results each worker process keeps in memory in front of the Redis result cache,
+# and number of seconds it keeps them for. 0 means no in-process caching
+LOCAL_CACHE_SIZE = getattr(settings, 'AUTOCOMPLETER_LOCAL_CACHE_SIZE', 0)
+LOCAL_CACHE_TIMEOUT = getattr(settings, 'AUTOCOMPLETER_LOCAL_CACHE_TIMEOUT', 5)
+
+# Whether store and remove look up an object's old state, diff it and write the difference
+# atomically in a single server-side Lua script, rather than over several round trips
+LUA_WRITES = getattr(settings, 'AUTOCOMPLETER_LUA_WRITES', False)
+
+# Number of keys remove_all, rebuild and clear_cache scan for and unlink per batch, and number of
+# seconds they pause after each batch. Raise the delay to go easier on a busy Redis.
+MAINTENANCE_BATCH_SIZE = getattr(settings, 'AUTOCOMPLETER_MAINTENANCE_BATCH_SIZE', 500)
+MAINTENANCE_BATCH_DELAY = getattr(settings, 'AUTOCOMPLETER_MAINTENANCE_BATCH_DELAY', 0)
+
+# Maximum number of terms the suggest_many view answers in one request. Requests with more get a
+# 400 response, so one request can not make Redis run an unbounded number of queries.
+MAX_SUGGEST_MANY_TERMS = getattr(settings, 'AUTOCOMPLETER_MAX_SUGGEST_MANY_TERMS', 50)
+
+# Whether suggest and exact_suggest combine matching sets inside a read only Lua script, rather than
+# storing intermediate results in temporary keys. Queries then write nothing to Redis (besides the
+# result cache and single flight lock, when on), and can be served by read replicas. The script also
+# finds the first matches of multi-word and faceted queries by walking the smallest set they combine,
+# when the sizes of the sets show matches are likely to turn up early in it. A walk that checked
+# READ_ONLY_QUERY_MAX_WALK times MAX_RESULTS IDs of that set without finding them all stops there,
+# and the sets are intersected in full instead. 0 means walks go on to the end of the set. Providers
+# with PREFIX_SET_MAX_SIZE or stop words are always queried with the script, whatever this is set to.
+READ_ONLY_QUERIES = getattr(settings, 'AUTOCOMPLETER_READ_ONLY_QUERIES', False)
+READ_ONLY_QUERY_MAX_WALK = getattr(settings, 'AUTOCOMPLETER_READ_ONLY_QUERY_MAX_WALK', 100)
+
+# Redis connection parameters: keyword arguments of redis.Redis, such as host, port, db,
+# unix_socket_path, socket_timeout, socket_keepalive and max_connections, or a 'url' along with
+# any of them. The client is created the first time it is used in each process.
+# Providers can set their own REDIS_CONNECTION to keep their keys on another server, in which case
+# suggest and exact_suggest query the servers of an autocompleter's providers concurrently. Cached
+# results stay on this server, and LUA_WRITES is only used for providers whose keys live here.
 REDIS_CONNECTION = getattr(settings, 'AUTOCOMPLETER_REDIS_CONNECTION', {})
 
+# List of connection parameters, like REDIS_CONNECTION, of read replicas that suggest, exact_suggest and result lookups
+# read from, and how to pick one of them per call: 'round_robin' or 'least_latency'. Writes always
+# go to REDIS_CONNECTION, as do queries unless READ_ONLY_QUERIES is on.
+REDIS_REPLICA_CONNECTIONS = getattr(settings, 'AUTOCOMPLETER_REDIS_REPLICA_CONNECTIONS', [])
+REDIS_REPLICA_SELECTION = getattr(settings, 'AUTOCOMPLETER_REDIS_REPLICA_SELECTION', 'round_robin')
+
+# Whether concurrent identical suggest and exact_suggest calls in a process are computed once,
+# with the other callers waiting for and sharing the results
+SINGLE_FLIGHT = getattr(settings, 'AUTOCOMPLETER_SINGLE_FLIGHT', False)
+
+# Whether a short Redis lock also lets only one process compute results missing from the result
+# cache, while other processes wait for them to be cached. Needs CACHE_TIMEOUT.
+SINGLE_FLIGHT_LOCK = getattr(settings, 'AUTOCOMPLETER_SINGLE_FLIGHT_LOCK', False)
+
+# Number of seconds callers wait for results another caller is computing before computing them
+# themselves. Also the number of seconds the Redis lock is held for at most.
+SINGLE_FLIGHT_TIMEOUT = getattr(settings, 'AUTOCOMPLETER_SINGLE_FLIGHT_TIMEOUT', 1)
+
+# Number of objects store_all fetches old state for and writes in a single pipeline
+STORE_BATCH_SIZE = getattr(settings, 'AUTOCOMPLETER_STORE_BATCH_SIZE', 1000)
+
+# Number of worker processes store_all uses. 1 means objects are stored in the calling process
+STORE_WORKERS = getattr(settings, 'AUTOCOMPLETER_STORE_WORKERS', 1)
+
+# Number of seconds rebuild waits after switching to the new generation of keys before
+# removing the old one, so requests already reading the old generation can finish
+REBUILD_GC_DELAY = getattr(settings, 'AUTOCOMPLETER_REBUILD_GC_DELAY', 5)
+
 # Name of variable autocompleter will look for to grab what term to search on.
 SUGGEST_PARAMETER_NAME = getattr(settings, 'AUTOCOMPLETER_SUGGEST_PARAMETER_NAME', 'q')
 
@@ -35,6 +103,23 @@ TEST_DATA = getattr(settings, 'AUTOCOMPLETER_TEST_DATA', False)
 # Maximum number of results returned per result type
 MAX_RESULTS = getattr(settings, 'AUTOCOMPLETER_MAX_RESULTS', 10)
 
+# Length up to which the results of suggest for single word prefixes without facets are
+# precomputed, so suggest reads them in its first round trip. These short prefixes match the most
+# objects and are the most expensive to query. Storing and removing objects keeps them up to
+# date. 0 means nothing is precomputed.
+PRECOMPUTE_PREFIX_LENGTH = getattr(settings, 'AUTOCOMPLETER_PRECOMPUTE_PREFIX_LENGTH', 0)
+
+# Number of seconds precomputed results are kept. It bounds how long results are served stale
+# when recomputing them failed after objects were stored, as store_all, rebuild and precompute
+# recompute all of them. 0 means they are kept until recomputed.
+PRECOMPUTE_TIMEOUT = getattr(settings, 'AUTOCOMPLETER_PRECOMPUTE_TIMEOUT', 86400)
+
+# Maximum number of variations of a term suggest queries. Each join character in a term doubles
+# its variations, see JOIN_CHARS, and each variation is an intersection of its own. Variations
+# with the same words, or whose matches another variation matches too, are left out first.
+# 0 means no maximum.
+MAX_TERM_VARIATIONS = getattr(settings, 'AUTOCOMPLETER_MAX_TERM_VARIATIONS', 16)
+
 # Whether to detect exact matches and move them to top of the results set (ignoring score)
 # This will obviously not work if MAX_EXACT_MATCH_WORDS == 0 for your install or your provider.
 MOVE_EXACT_MATCHES_TO_TOP = getattr(settings, 'AUTOCOMPLETER_MOVE_EXACT_MATCHES_TO_TOP', False)
@@ -42,10 +127,33 @@ MOVE_EXACT_MATCHES_TO_TOP = getattr(settings, 'AUTOCOMPLETER_MOVE_EXACT_MATCHES_
 
 # PROVIDER SETTINGS #
 
+# Whether storing or removing one of the provider's objects drops the cached results that object
+# may be part of, so CACHE_TIMEOUT can be long and edits still show up right away.
+INVALIDATE_CACHE_ON_STORE = getattr(settings, 'AUTOCOMPLETER_INVALIDATE_CACHE_ON_STORE', False)
+
 # Maximum number of words in term we should be able to match as exact match. Default is 0,
 # which means there is no exact matching at all.
 MAX_EXACT_MATCH_WORDS = getattr(settings, 'AUTOCOMPLETER_MAX_EXACT_MATCH_WORDS', 0)
 
+# Maximum number of objects kept in the sorted set of each prefix. Short prefixes match most
+# objects, yet suggest only reads the first few of them, so capping their sets bounds the memory
+# of the index. Queries a capped set can not answer on its own, like those combining several words
+# or filtering by facets, check the terms of the objects of a smaller set instead, or of all the
+# provider's objects. Should be well above MAX_RESULTS. 0 means prefix sets are not capped.
+# Changing it only applies to objects stored from then on, so rebuild after changing it.
+PREFIX_SET_MAX_SIZE = getattr(settings, 'AUTOCOMPLETER_PREFIX_SET_MAX_SIZE', 0)
+
+# Words, like 'of' or 'the', whose prefix sets are left out of the intersections of multi-word
+# queries, since they hold a large share of the objects and barely narrow the matches down.
+# Matches are checked for them against the objects' terms instead. Words whose prefix sets hold at
+# least STOP_WORD_MIN_SHARE of the provider's objects (between 0 and 1) are stop words too. 0 means
+# no words are found that way. Only the read only query script can check the terms of objects, so
+# queries of providers with stop words run in it even when READ_ONLY_QUERIES is off. They walk the
+# smallest set they intersect until they find all of their matches, whatever READ_ONLY_QUERY_MAX_WALK
+# is set to.
+STOP_WORDS = getattr(settings, 'AUTOCOMPLETER_STOP_WORDS', [])
+STOP_WORD_MIN_SHARE = getattr(settings, 'AUTOCOMPLETER_STOP_WORD_MIN_SHARE', 0)
+
 
 # AC/PROVIDER SETTINGS #
 
@@ -1,7 +1,8 @@
 from django.conf.urls import *
-from autocompleter.views import ExactSuggestView, SuggestView
+from autocompleter.views import ExactSuggestView, SuggestManyView, SuggestView
 
 urlpatterns = [
     url(r'^suggest/(?P<name>[0-9A-Za-z_-]+)$', SuggestView.as_view(), name='suggest'),
+    url(r'^suggest_many/(?P<name>[0-9A-Za-z_-]+)$', SuggestManyView.as_view(), name='suggest_many'),
     url(r'^exact_suggest/(?P<name>[0-9A-Za-z_-]+)$', ExactSuggestView.as_view(), name='exact_suggest'),
 ]
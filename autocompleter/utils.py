@@ -66,6 +66,20 @@ def get_norm_term_variations(term):
     return norm_terms
 
 
+def get_norm_term_prefixes(norm_terms):
+    """
+    Get the set of prefixes of every word in a list of normalized terms
+    """
+    prefixes = set()
+    for norm_term in norm_terms:
+        for norm_word in norm_term.split(' '):
+            word_prefix = ''
+            for char in norm_word:
+                word_prefix += char
+                prefixes.add(word_prefix)
+    return prefixes
+
+
 def get_aliased_variations(term, phrase_aliases):
     """
     Given the term and dict of phrase to phrase alias mappings,
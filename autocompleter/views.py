@@ -6,6 +6,11 @@ from django.views.generic import View
 from autocompleter import settings
 from autocompleter import Autocompleter
 
+try:
+    string_types = basestring
+except NameError:
+    string_types = str
+
 
 class SuggestView(View):
     def get(self, request, name):
@@ -47,6 +52,48 @@ class SuggestView(View):
         return True
 
 
+class SuggestManyView(View):
+    def get(self, request, name):
+        if settings.SUGGEST_PARAMETER_NAME in request.GET:
+            terms = request.GET[settings.SUGGEST_PARAMETER_NAME]
+            try:
+                terms = json.loads(terms)
+            except ValueError:
+                return HttpResponseBadRequest('Malformed search parameter.')
+            if not self.validate_terms(terms):
+                return HttpResponseBadRequest('Malformed search parameter.')
+            if len(terms) > settings.MAX_SUGGEST_MANY_TERMS:
+                return HttpResponseBadRequest('Too many search terms.')
+            ac = Autocompleter(name)
+            if settings.FACET_PARAMETER_NAME in request.GET:
+                facets = request.GET[settings.FACET_PARAMETER_NAME]
+                try:
+                    facets = json.loads(facets)
+                except ValueError:
+                    return HttpResponseBadRequest('Malformed facet parameter.')
+                if not SuggestView.validate_facets(facets):
+                    return HttpResponseBadRequest('Malformed facet parameter.')
+                results = ac.suggest_many(terms, facets=facets)
+            else:
+                results = ac.suggest_many(terms)
+
+            json_response = json.dumps(results)
+            return HttpResponse(json_response, content_type='application/json')
+        return HttpResponseServerError('Search parameter not found.')
+
+    @staticmethod
+    def validate_terms(terms):
+        """
+        Validates the search parameter is a list of terms.
+        """
+        if not isinstance(terms, list):
+            return False
+        for term in terms:
+            if not isinstance(term, string_types):
+                return False
+        return True
+
+
 class ExactSuggestView(View):
     def get(self, request, name):
         if settings.SUGGEST_PARAMETER_NAME in request.GET:
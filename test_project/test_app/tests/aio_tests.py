@@ -0,0 +1,177 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+import asyncio
+import json
+
+import redis
+
+from django.test import TestCase, override_settings
+
+try:
+    from django.core.urlresolvers import reverse
+except ImportError:
+    from django.urls import reverse
+
+from test_app.autocompleters import IndicatorAutocompleteProvider
+from test_app.tests.base import AutocompleterTestCase
+from autocompleter import aio, Autocompleter, registry
+from autocompleter import settings as auto_settings
+
+
+class AsyncSuggestTestCase(AutocompleterTestCase):
+    fixtures = ['stock_test_data_small.json', 'indicator_test_data_small.json']
+
+    def setUp(self):
+        super(AsyncSuggestTestCase, self).setUp()
+        setattr(auto_settings, 'MAX_EXACT_MATCH_WORDS', 10)
+        self.autocomp = Autocompleter('facet_stock_no_facet_ind')
+        self.autocomp.store_all()
+        self.facets = [
+            {
+                'type': 'or',
+                'facets': [
+                    {'key': 'sector', 'value': 'Technology'},
+                    {'key': 'sector', 'value': 'Financial Services'},
+                ]
+            },
+        ]
+        self.queries = [('a', []), ('aapl', []), ('us unemployment', []), ('a', self.facets), ('gobblygook', [])]
+
+    def tearDown(self):
+        setattr(auto_settings, 'MAX_EXACT_MATCH_WORDS', 0)
+        setattr(auto_settings, 'READ_ONLY_QUERIES', False)
+        setattr(auto_settings, 'CACHE_TIMEOUT', 0)
+        setattr(auto_settings, 'SINGLE_FLIGHT', False)
+        setattr(auto_settings, 'SINGLE_FLIGHT_LOCK', False)
+        self.autocomp.remove_all()
+
+    def gather(self, coroutines):
+        async def gather():
+            return await asyncio.gather(*coroutines)
+        return asyncio.run(gather())
+
+    def assert_matches_sync(self):
+        expected = [self.autocomp.suggest(term, facets=facets) for term, facets in self.queries]
+        expected_exact = [self.autocomp.exact_suggest(term) for term, facets in self.queries]
+        self.assertEqual(self.gather([self.autocomp.asuggest(term, facets=facets) for term, facets in self.queries]),
+                         expected)
+        self.assertEqual(self.gather([self.autocomp.aexact_suggest(term) for term, facets in self.queries]),
+                         expected_exact)
+
+    def test_async_suggest_matches_sync(self):
+        """
+        asuggest and aexact_suggest return the same results as suggest and exact_suggest
+        """
+        self.assert_matches_sync()
+        self.assertEqual(self.redis.keys('djac.test.results.*'), [])
+
+        setattr(auto_settings, 'READ_ONLY_QUERIES', True)
+        self.assert_matches_sync()
+
+    def test_async_suggest_cached(self):
+        """
+        With caching and single flight on, concurrent identical calls share cached results
+        """
+        setattr(auto_settings, 'CACHE_TIMEOUT', 3600)
+        setattr(auto_settings, 'SINGLE_FLIGHT', True)
+        setattr(auto_settings, 'SINGLE_FLIGHT_LOCK', True)
+        expected = self.autocomp.suggest('a')
+        self.autocomp.clear_cache()
+
+        coalesced = aio.single_flight.coalesced
+        self.assertEqual(self.gather([self.autocomp.asuggest('a') for i in range(5)]), [expected] * 5)
+        self.assertEqual(aio.single_flight.coalesced, coalesced + 4)
+        self.assertEqual(self.redis.keys('*.lock'), [])
+
+        # Results are now read from the cache
+        self.redis.delete(*self.redis.keys('djac.test.*.p.a'))
+        self.assertEqual(self.gather([self.autocomp.asuggest('a')]), [expected])
+
+    def test_async_suggest_across_servers(self):
+        """
+        asuggest merges the results of providers on different servers
+        """
+        connection = self.redis.connection_pool.connection_kwargs
+        shard_connection = {'host': connection['host'], 'port': connection['port'], 'db': connection['db'] + 1}
+        expected = [self.autocomp.suggest(term) for term in ('a', 'us')]
+        self.autocomp.remove_all()
+
+        registry.set_provider_setting(IndicatorAutocompleteProvider, 'REDIS_CONNECTION', shard_connection)
+        try:
+            self.autocomp.store_all()
+            self.assertNotEqual(redis.Redis(**shard_connection).keys('djac.test.ind*'), [])
+            self.assertEqual(self.gather([self.autocomp.asuggest(term) for term in ('a', 'us')]), expected)
+            self.autocomp.remove_all()
+        finally:
+            registry.del_provider_setting(IndicatorAutocompleteProvider, 'REDIS_CONNECTION')
+
+
+class AsyncSingleFlightTestCase(TestCase):
+    def test_concurrent_calls_coalesced(self):
+        """
+        Concurrent calls for the same key in an event loop are computed once and share the result
+        """
+        calls = []
+
+        async def compute():
+            calls.append(1)
+            await asyncio.sleep(0.05)
+            if len(calls) == 1:
+                return [1]
+            raise ValueError()
+
+        async def fail():
+            calls.append(1)
+            await asyncio.sleep(0.05)
+            raise ValueError()
+
+        async def run():
+            single_flight = aio.SingleFlight()
+            results = await asyncio.gather(*[single_flight.do('key', compute, 5) for i in range(5)])
+            self.assertEqual(single_flight.coalesced, 4)
+
+            # Callers waiting on a leader that fails compute the result themselves
+            failures = await asyncio.gather(*[single_flight.do('key', fail, 5) for i in range(3)],
+                                            return_exceptions=True)
+            self.assertEqual(len(failures), 3)
+            self.assertTrue(all(isinstance(failure, ValueError) for failure in failures))
+            return results
+        self.assertEqual(asyncio.run(run()), [[1]] * 5)
+        self.assertEqual(len(calls), 4)
+
+
+@override_settings(ROOT_URLCONF='autocompleter.async_urls')
+class AsyncViewsTestCase(AutocompleterTestCase):
+    fixtures = ['stock_test_data_small.json']
+
+    def setUp(self):
+        super(AsyncViewsTestCase, self).setUp()
+        setattr(auto_settings, 'MAX_EXACT_MATCH_WORDS', 10)
+        self.autocomp = Autocompleter('stock')
+        self.autocomp.store_all()
+
+    def tearDown(self):
+        setattr(auto_settings, 'MAX_EXACT_MATCH_WORDS', 0)
+        self.autocomp.remove_all()
+
+    def test_async_views(self):
+        """
+        The async views return the same results as the sync ones
+        """
+        url = reverse('suggest', kwargs={'name': 'stock'})
+        response = self.client.get(url, data={auto_settings.SUGGEST_PARAMETER_NAME: 'a'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(json.loads(response.content.decode('utf-8')), self.autocomp.suggest('a'))
+
+        response = self.client.get(url, data={auto_settings.FACET_PARAMETER_NAME: '[{"type": "not"}]',
+                                              auto_settings.SUGGEST_PARAMETER_NAME: 'a'})
+        self.assertEqual(response.status_code, 400)
+
+        url = reverse('exact_suggest', kwargs={'name': 'stock'})
+        response = self.client.get(url, data={auto_settings.SUGGEST_PARAMETER_NAME: 'aapl'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(json.loads(response.content.decode('utf-8')), self.autocomp.exact_suggest('aapl'))
+
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 500)
@@ -0,0 +1,9 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+import sys
+
+# The asyncio tests use async def and asyncio.run, which do not compile or exist before Python 3.7,
+# so they are only imported from there on
+if sys.version_info >= (3, 7):
+    from test_app.tests.aio_tests import *  # noqa
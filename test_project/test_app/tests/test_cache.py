@@ -0,0 +1,281 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+import json
+import threading
+import time
+
+from django.test import TestCase
+
+from test_app.autocompleters import StockAutocompleteProvider
+from test_app.models import Stock
+from test_app.tests.base import AutocompleterTestCase
+from autocompleter import base, Autocompleter
+from autocompleter import settings as auto_settings
+from autocompleter.cache import LocalResultCache, SingleFlight, local_cache
+
+
+class LocalResultCacheTestCase(TestCase):
+    def test_least_recently_used_evicted(self):
+        """
+        Entries beyond max size are evicted least recently used first
+        """
+        cache = LocalResultCache(max_size=2, timeout=60)
+        cache.set(('suggest', 'stock', 'a', ''), [1])
+        cache.set(('suggest', 'stock', 'b', ''), [2])
+        self.assertEqual(cache.get(('suggest', 'stock', 'a', '')), [1])
+        cache.set(('suggest', 'stock', 'c', ''), [3])
+
+        self.assertIsNone(cache.get(('suggest', 'stock', 'b', '')))
+        self.assertEqual(cache.get(('suggest', 'stock', 'a', '')), [1])
+        self.assertEqual(cache.get(('suggest', 'stock', 'c', '')), [3])
+        self.assertEqual(cache.get_stats(),
+            {'size': 2, 'max_size': 2, 'hits': 3, 'misses': 1, 'evictions': 1})
+
+    def test_expired_entries_not_returned(self):
+        """
+        Entries are no longer returned once their timeout has passed
+        """
+        cache = LocalResultCache(max_size=2, timeout=0.01)
+        cache.set(('suggest', 'stock', 'a', ''), [1])
+        time.sleep(0.02)
+        self.assertIsNone(cache.get(('suggest', 'stock', 'a', '')))
+
+    def test_delete_autocompleter(self):
+        """
+        Deleting an autocompleter's entries leaves those of other autocompleters
+        """
+        cache = LocalResultCache(max_size=10, timeout=60)
+        cache.set(('suggest', 'stock', 'a', ''), [1])
+        cache.set(('exact_suggest', 'stock', 'a'), [1])
+        cache.set(('suggest', 'ind', 'a', ''), [2])
+        cache.delete_autocompleter('stock')
+        self.assertEqual(len(cache), 1)
+        self.assertEqual(cache.get(('suggest', 'ind', 'a', '')), [2])
+
+    def test_results_computed_across_invalidation_not_kept(self):
+        """
+        Results are not kept if their provider's or autocompleter's entries were dropped since
+        they started being computed
+        """
+        cache = LocalResultCache(max_size=10, timeout=60)
+        tags = cache.get_tags(['stock'], 'prefix', ['a'])
+        sequence = cache.get_sequence()
+        cache.invalidate({'provider': 'ind', 'norm_terms': ['a'], 'exact_terms': []})
+        cache.set(('suggest', 'stock', 'a', ''), [1], tags, sequence)
+        self.assertEqual(cache.get(('suggest', 'stock', 'a', '')), [1])
+
+        cache.invalidate({'provider': 'stock', 'norm_terms': ['b'], 'exact_terms': []})
+        cache.set(('suggest', 'stock', 'b', ''), [2], tags, sequence)
+        self.assertIsNone(cache.get(('suggest', 'stock', 'b', '')))
+
+        sequence = cache.get_sequence()
+        cache.invalidate({'autocompleter': 'stock'})
+        cache.set(('suggest', 'stock', 'a', ''), [1], tags, sequence)
+        self.assertIsNone(cache.get(('suggest', 'stock', 'a', '')))
+
+
+class SingleFlightTestCase(TestCase):
+    def run_concurrently(self, single_flight, fn, num_callers=5):
+        results = []
+
+        def call():
+            try:
+                results.append(single_flight.do('key', fn, 5))
+            except ValueError:
+                pass
+        threads = [threading.Thread(target=call) for i in range(num_callers)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return results
+
+    def test_concurrent_calls_coalesced(self):
+        """
+        Concurrent calls for the same key are computed once and share the result
+        """
+        calls = []
+
+        def compute():
+            calls.append(1)
+            time.sleep(0.1)
+            return [len(calls)]
+        single_flight = SingleFlight()
+        results = self.run_concurrently(single_flight, compute)
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(results, [[1]] * 5)
+        self.assertEqual(single_flight.coalesced, 4)
+
+        # Once the leader is done, the next call computes again
+        self.assertEqual(single_flight.do('key', compute), [2])
+
+    def test_failed_leader_callers_compute(self):
+        """
+        Callers waiting on a leader that fails compute the result themselves
+        """
+        calls = []
+
+        def compute():
+            calls.append(1)
+            time.sleep(0.1)
+            if len(calls) == 1:
+                raise ValueError()
+            return [1]
+        results = self.run_concurrently(SingleFlight(), compute)
+        self.assertEqual(len(calls), 5)
+        self.assertEqual(results, [[1]] * 4)
+
+
+class LocalCacheMatchingTestCase(AutocompleterTestCase):
+    fixtures = ['stock_test_data_small.json']
+
+    def setUp(self):
+        super(LocalCacheMatchingTestCase, self).setUp()
+        self.autocomp = Autocompleter("stock")
+        self.autocomp.store_all()
+        setattr(auto_settings, 'LOCAL_CACHE_SIZE', 100)
+        # Entries cached before the listener is subscribed are dropped once it is
+        local_cache.listen(self.redis, base.CACHE_INVALIDATION_CHANNEL)
+        local_cache.subscribed.wait(5)
+
+    def tearDown(self):
+        setattr(auto_settings, 'LOCAL_CACHE_SIZE', 0)
+        local_cache.clear()
+        self.autocomp.remove_all()
+
+    def local_key(self, term):
+        return ('suggest', 'stock', term, Autocompleter.hash_facets([]))
+
+    def test_local_cache_serves_results_until_cleared(self):
+        """
+        Results are served from the in-process cache until the cache is cleared
+        """
+        matches = self.autocomp.suggest('aapl')
+        exact_matches = self.autocomp.exact_suggest('aapl')
+        self.assertEqual(len(matches), 1)
+
+        # Writing to Redis directly does not invalidate anything
+        self.redis.delete('djac.test.stock.p.aapl', 'djac.test.stock.e.aapl')
+        hits = local_cache.hits
+        self.assertEqual(self.autocomp.suggest('aapl'), matches)
+        self.assertEqual(self.autocomp.exact_suggest('aapl'), exact_matches)
+        self.assertEqual(local_cache.hits, hits + 2)
+
+        self.autocomp.clear_cache()
+        self.assertEqual(len(self.autocomp.suggest('aapl')), 0)
+
+    def test_store_and_remove_invalidate_affected_results(self):
+        """
+        Storing and removing an object drops the in-process results it may be part of
+        """
+        for lua_writes in (False, True):
+            setattr(auto_settings, 'LUA_WRITES', lua_writes)
+            self.assertEqual(len(self.autocomp.suggest('apple')), 1)
+            self.assertEqual(len(self.autocomp.suggest('pfizer')), 1)
+
+            aapl = Stock.objects.get(symbol='AAPL')
+            StockAutocompleteProvider(aapl).remove()
+            self.assertIsNone(local_cache.get(self.local_key('apple')))
+            self.assertIsNotNone(local_cache.get(self.local_key('pfizer')))
+            self.assertEqual(len(self.autocomp.suggest('apple')), 0)
+
+            StockAutocompleteProvider(aapl).store()
+            self.assertEqual(len(self.autocomp.suggest('apple')), 1)
+        setattr(auto_settings, 'LUA_WRITES', False)
+
+    def test_results_computed_during_store_not_cached(self):
+        """
+        Results computed while an object they may include is stored are not kept
+        """
+        aapl = Stock.objects.get(symbol='AAPL')
+        StockAutocompleteProvider(aapl).remove()
+
+        class StoringAutocompleter(Autocompleter):
+            def _get_results_from_payloads(self, provider_results, provider_payloads):
+                # The object is stored once the queries ran, before their results are kept
+                StockAutocompleteProvider(aapl).store()
+                return super(StoringAutocompleter, self)._get_results_from_payloads(
+                    provider_results, provider_payloads)
+
+        self.assertEqual(len(StoringAutocompleter('stock').suggest('apple')), 0)
+        self.assertIsNone(local_cache.get(self.local_key('apple')))
+        self.assertEqual(len(self.autocomp.suggest('apple')), 1)
+
+    def test_published_invalidation_drops_results(self):
+        """
+        Invalidation messages published by other processes drop the affected results
+        """
+        self.assertEqual(len(self.autocomp.suggest('apple')), 1)
+        self.assertEqual(len(self.autocomp.suggest('pfizer')), 1)
+
+        # Publish as another process would
+        self.redis.publish(base.CACHE_INVALIDATION_CHANNEL, json.dumps(
+            {'provider': 'stock', 'norm_terms': ['apple inc'], 'exact_terms': []}))
+        for i in range(100):
+            if local_cache.get(self.local_key('apple')) is None:
+                break
+            time.sleep(0.01)
+        self.assertIsNone(local_cache.get(self.local_key('apple')))
+        self.assertIsNotNone(local_cache.get(self.local_key('pfizer')))
+
+        self.redis.publish(base.CACHE_INVALIDATION_CHANNEL, json.dumps({'autocompleter': 'stock'}))
+        for i in range(100):
+            if len(local_cache) == 0:
+                break
+            time.sleep(0.01)
+        self.assertEqual(len(local_cache), 0)
+
+
+class SingleFlightMatchingTestCase(AutocompleterTestCase):
+    fixtures = ['stock_test_data_small.json']
+
+    def setUp(self):
+        super(SingleFlightMatchingTestCase, self).setUp()
+        self.autocomp = Autocompleter("stock")
+        self.autocomp.store_all()
+        setattr(auto_settings, 'CACHE_TIMEOUT', 3600)
+        setattr(auto_settings, 'SINGLE_FLIGHT', True)
+        setattr(auto_settings, 'SINGLE_FLIGHT_LOCK', True)
+
+    def tearDown(self):
+        setattr(auto_settings, 'CACHE_TIMEOUT', 0)
+        setattr(auto_settings, 'SINGLE_FLIGHT', False)
+        setattr(auto_settings, 'SINGLE_FLIGHT_LOCK', False)
+        self.autocomp.remove_all()
+
+    def test_suggest_with_single_flight(self):
+        """
+        Suggest returns the same results with single flight on, and leaves no lock behind
+        """
+        self.assertEqual(len(self.autocomp.suggest('aapl')), 1)
+        self.assertEqual(len(self.autocomp.exact_suggest('aapl')), 0)
+        self.assertEqual(self.redis.keys('*.lock'), [])
+
+    def test_waits_for_locked_results(self):
+        """
+        While another process holds the lock on a cache key, suggest waits for its results
+        """
+        cache_key = base.CACHE_BASE_NAME % (
+            'stock', self.autocomp.get_cache_generation(), 'aapl', Autocompleter.hash_facets([]))
+        lock_key = base.CACHE_LOCK_NAME % (cache_key,)
+        self.redis.set(lock_key, 'other process', px=5000)
+
+        def cache_results():
+            time.sleep(0.1)
+            self.redis.set(cache_key, json.dumps(['computed elsewhere']))
+            self.redis.delete(lock_key)
+        thread = threading.Thread(target=cache_results)
+        thread.start()
+        self.assertEqual(self.autocomp.suggest('aapl'), ['computed elsewhere'])
+        thread.join()
+
+    def test_computes_when_lock_released_without_results(self):
+        """
+        If the lock is released without results being cached, suggest computes them
+        """
+        cache_key = base.CACHE_BASE_NAME % (
+            'stock', self.autocomp.get_cache_generation(), 'aapl', Autocompleter.hash_facets([]))
+        lock_key = base.CACHE_LOCK_NAME % (cache_key,)
+        self.redis.set(lock_key, 'other process', px=100)
+        self.assertEqual(len(self.autocomp.suggest('aapl')), 1)
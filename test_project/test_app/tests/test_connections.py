@@ -0,0 +1,58 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.test import TestCase
+
+import redis
+
+from autocompleter.connections import LazyClient, create_client, import_client_class
+
+
+class ConnectionsTestCase(TestCase):
+    def setUp(self):
+        self.connection = dict(settings.AUTOCOMPLETER_REDIS_CONNECTION)
+
+    def test_create_client(self):
+        """
+        Clients are created from keyword arguments of redis.Redis, or from a URL
+        """
+        client = create_client(dict(self.connection, max_connections=3, socket_keepalive=True))
+        self.assertTrue(client.ping())
+        self.assertEqual(client.connection_pool.max_connections, 3)
+        self.assertTrue(client.connection_pool.connection_kwargs['socket_keepalive'])
+
+        client = create_client({
+            'url': 'redis://%(host)s:%(port)s/%(db)s' % self.connection,
+            'socket_timeout': 2,
+        })
+        self.assertTrue(client.ping())
+        self.assertEqual(client.connection_pool.connection_kwargs['socket_timeout'], 2)
+
+    def test_lazy_client(self):
+        """
+        A lazy client creates its client when first used, and again in each new process
+        """
+        client = LazyClient(self.connection)
+        script = client.register_script('return 1')
+        self.assertIsNone(client._client)
+
+        self.assertEqual(script(), 1)
+        actual_client = client.get_client()
+        self.assertIs(client.get_client(), actual_client)
+
+        # As if the process was forked since
+        client._key = -1
+        self.assertIsNot(client.get_client(), actual_client)
+        self.assertTrue(client.ping())
+
+    def test_import_client_class(self):
+        """
+        Client classes of newer redis-py versions are imported when available, and name the version
+        they need otherwise
+        """
+        self.assertIs(import_client_class('redis.client', 'Redis', '3.0'), redis.Redis)
+        with self.assertRaises(ImproperlyConfigured) as context:
+            import_client_class('redis.no_such_module', 'Redis', '99.0')
+        self.assertIn('redis-py 99.0 or later', str(context.exception))
@@ -1,11 +1,19 @@
 #!/usr/bin/python
 # -*- coding: utf-8 -*-
 
-from test_app.autocompleters import StockAutocompleteProvider, IndicatorAutocompleteProvider, CalcAutocompleteProvider
+import logging
+import redis
+import time
+
+from django.apps import apps
+from django.core.exceptions import ImproperlyConfigured
+
+from test_app.autocompleters import StockAutocompleteProvider, FacetedStockAutocompleteProvider, \
+    IndicatorAutocompleteProvider, CalcAutocompleteProvider
 from test_app.models import Stock
 from test_app.tests.base import AutocompleterTestCase
 
-from autocompleter import Autocompleter, registry
+from autocompleter import base, utils, Autocompleter, registry
 from autocompleter import settings as auto_settings
 
 
@@ -99,6 +107,120 @@ class StockMatchTestCase(AutocompleterTestCase):
         # Must set the setting back to where it was as it will persist
         setattr(auto_settings, 'CACHE_TIMEOUT', 0)
 
+    def test_clear_cache(self):
+        """
+        Clearing the cache bumps the cache generation so cached results are no longer read
+        """
+        setattr(auto_settings, 'CACHE_TIMEOUT', 3600)
+
+        self.assertEqual(len(self.autocomp.suggest('aapl')), 1)
+        StockAutocompleteProvider(Stock.objects.get(symbol='AAPL')).remove()
+        self.assertEqual(len(self.autocomp.suggest('aapl')), 1)
+
+        self.autocomp.clear_cache()
+        self.assertEqual(self.autocomp.get_cache_generation(), 1)
+        self.assertEqual(len(self.autocomp.suggest('aapl')), 0)
+
+        # Must set the setting back to where it was as it will persist
+        setattr(auto_settings, 'CACHE_TIMEOUT', 0)
+
+    def test_cache_cleared_by_other_process(self):
+        """
+        Cached results are no longer read once another process bumps the cache generation
+        """
+        setattr(auto_settings, 'CACHE_TIMEOUT', 3600)
+
+        self.assertEqual(len(self.autocomp.suggest('aapl')), 1)
+        StockAutocompleteProvider(Stock.objects.get(symbol='AAPL')).remove()
+        self.assertEqual(len(self.autocomp.suggest('aapl')), 1)
+
+        self.redis.incr(base.CACHE_GENERATION_BASE_NAME % ('stock',))
+        self.assertEqual(len(self.autocomp.suggest('aapl')), 0)
+        # The new cache generation is used from then on
+        self.assertEqual(len(self.redis.keys(base.CACHE_BASE_NAME % ('stock', 1, 'aapl', '*'))), 1)
+
+        # Must set the setting back to where it was as it will persist
+        setattr(auto_settings, 'CACHE_TIMEOUT', 0)
+
+    def test_store_invalidates_affected_cached_results(self):
+        """
+        Storing and removing an object drops only the cached results it may be part of
+        """
+        max_exact_match_words = auto_settings.MAX_EXACT_MATCH_WORDS
+        setattr(auto_settings, 'MAX_EXACT_MATCH_WORDS', 10)
+        self.autocomp.store_all()
+        setattr(auto_settings, 'CACHE_TIMEOUT', 3600)
+        setattr(auto_settings, 'INVALIDATE_CACHE_ON_STORE', True)
+
+        for lua_writes in (False, True):
+            setattr(auto_settings, 'LUA_WRITES', lua_writes)
+            self.assertEqual(len(self.autocomp.suggest('apple')), 1)
+            self.assertEqual(len(self.autocomp.exact_suggest('aapl')), 1)
+            self.assertEqual(len(self.autocomp.suggest('pfizer')), 1)
+            num_cache_keys = len(self.redis.keys('djac.test.stock.c.*'))
+
+            aapl = Stock.objects.get(symbol='AAPL')
+            StockAutocompleteProvider(aapl).remove()
+            self.assertEqual(len(self.redis.keys('djac.test.stock.c.*')), num_cache_keys - 1)
+            self.assertEqual(len(self.autocomp.suggest('apple')), 0)
+            self.assertEqual(len(self.autocomp.exact_suggest('aapl')), 0)
+
+            aapl.name = 'Pear Inc.'
+            StockAutocompleteProvider(aapl).store()
+            self.assertEqual(len(self.autocomp.suggest('pear')), 1)
+            self.assertEqual(len(self.autocomp.suggest('apple')), 0)
+            self.assertEqual(len(self.autocomp.exact_suggest('aapl')), 1)
+
+            aapl.name = 'Apple Inc.'
+            StockAutocompleteProvider(aapl).store()
+            self.assertEqual(len(self.autocomp.suggest('pear')), 0)
+            self.assertEqual(len(self.autocomp.suggest('apple')), 1)
+            self.assertEqual(len(self.autocomp.suggest('pfizer')), 1)
+
+        # Must set the settings back to where they were as they will persist
+        setattr(auto_settings, 'LUA_WRITES', False)
+        setattr(auto_settings, 'INVALIDATE_CACHE_ON_STORE', False)
+        setattr(auto_settings, 'CACHE_TIMEOUT', 0)
+        setattr(auto_settings, 'MAX_EXACT_MATCH_WORDS', max_exact_match_words)
+
+    def test_results_computed_during_store_not_cached(self):
+        """
+        Results computed while an object they may include is stored are not cached
+        """
+        max_exact_match_words = auto_settings.MAX_EXACT_MATCH_WORDS
+        setattr(auto_settings, 'MAX_EXACT_MATCH_WORDS', 10)
+        self.autocomp.store_all()
+        setattr(auto_settings, 'CACHE_TIMEOUT', 3600)
+        setattr(auto_settings, 'INVALIDATE_CACHE_ON_STORE', True)
+        aapl = Stock.objects.get(symbol='AAPL')
+
+        class StoringAutocompleter(Autocompleter):
+            def _get_results_from_payloads(self, provider_results, provider_payloads):
+                # The object is stored once the queries ran, before their results are cached
+                StockAutocompleteProvider(aapl).store()
+                return super(StoringAutocompleter, self)._get_results_from_payloads(
+                    provider_results, provider_payloads)
+
+        for lua_writes in (False, True):
+            setattr(auto_settings, 'LUA_WRITES', lua_writes)
+            StockAutocompleteProvider(aapl).remove()
+            self.assertEqual(len(StoringAutocompleter('stock').suggest('apple')), 0)
+            self.assertEqual(len(self.autocomp.suggest('apple')), 1)
+
+            StockAutocompleteProvider(aapl).remove()
+            self.assertEqual(len(StoringAutocompleter('stock').exact_suggest('aapl')), 0)
+            self.assertEqual(len(self.autocomp.exact_suggest('aapl')), 1)
+
+        # Results are cached when nothing was stored meanwhile
+        self.autocomp.suggest('pfizer')
+        self.assertEqual(len(self.redis.keys('djac.test.stock.c.*.pfizer.*')), 1)
+
+        # Must set the settings back to where they were as they will persist
+        setattr(auto_settings, 'LUA_WRITES', False)
+        setattr(auto_settings, 'INVALIDATE_CACHE_ON_STORE', False)
+        setattr(auto_settings, 'CACHE_TIMEOUT', 0)
+        setattr(auto_settings, 'MAX_EXACT_MATCH_WORDS', max_exact_match_words)
+
     def test_dropped_character_matching(self):
         """
         Searching for things that would be normalized to ' ' do not
@@ -163,6 +285,44 @@ class IndicatorMatchTestCase(AutocompleterTestCase):
         matches = self.autocomp.suggest('U-S/A')
         self.assertNotEqual(len(matches), 0)
 
+    def test_join_char_variations_collapsed(self):
+        """
+        Variations of a term with the same words or matching a subset of another's matches are
+        queried once, those with words in common share their intersection, and no more than
+        MAX_TERM_VARIATIONS are queried
+        """
+        self.assertEqual(self.autocomp._get_variation_words('a-a', utils.get_norm_term_variations('a-a')), [['a']])
+        self.assertEqual(self.autocomp._get_variation_words('ab/a', utils.get_norm_term_variations('ab/a')),
+                         [['a', 'ab']])
+        self.assertEqual(len(self.autocomp._get_variation_words('U-S/A', utils.get_norm_term_variations('U-S/A'))),
+                         4)
+
+        terms = ['mortgage-backed securities', 'U-S/A mortgage', 'mortgage-mort']
+        matches = [self.autocomp.suggest(term) for term in terms]
+        self.assertTrue(all(len(term_matches) > 0 for term_matches in matches))
+        setattr(auto_settings, 'READ_ONLY_QUERIES', True)
+        self.assertEqual([self.autocomp.suggest(term) for term in terms], matches)
+        setattr(auto_settings, 'READ_ONLY_QUERIES', False)
+
+        # Queries leaving out variations are logged at debug level
+        registry.set_autocompleter_setting('indicator', 'MAX_TERM_VARIATIONS', 1)
+        records = []
+        handler = logging.Handler(logging.DEBUG)
+        handler.emit = records.append
+        level = base.logger.level
+        base.logger.addHandler(handler)
+        base.logger.setLevel(logging.DEBUG)
+        try:
+            self.assertNotEqual(len(self.autocomp.suggest('U-S/A mortgage')), 0)
+            self.assertEqual(len(records), 1)
+            self.assertEqual(records[0].levelno, logging.DEBUG)
+            self.assertEqual(self.autocomp.suggest('mortgage-mort'), matches[2])
+            self.assertEqual(len(records), 1)
+        finally:
+            base.logger.removeHandler(handler)
+            base.logger.setLevel(level)
+        registry.del_autocompleter_setting('indicator', 'MAX_TERM_VARIATIONS')
+
     def test_min_letters_setting(self):
         """
         MIN_LETTERS is respected.
@@ -670,3 +830,719 @@ class MixedFacetProvidersMatchingTestCase(AutocompleterTestCase):
         self.assertEqual(len(matches['ind']), len(facet_matches['ind']))
 
         registry.del_autocompleter_setting('facet_stock_no_facet_ind', 'MAX_RESULTS')
+
+
+class ReadOnlyQueriesMatchingTestCase(AutocompleterTestCase):
+    fixtures = ['stock_test_data_small.json', 'indicator_test_data_small.json']
+
+    def setUp(self):
+        super(ReadOnlyQueriesMatchingTestCase, self).setUp()
+        self.max_exact_match_words = auto_settings.MAX_EXACT_MATCH_WORDS
+        setattr(auto_settings, 'MAX_EXACT_MATCH_WORDS', 10)
+        self.max_walk = auto_settings.READ_ONLY_QUERY_MAX_WALK
+        self.autocomp = Autocompleter('facet_stock_no_facet_ind')
+        self.autocomp.store_all()
+
+    def tearDown(self):
+        setattr(auto_settings, 'MAX_EXACT_MATCH_WORDS', self.max_exact_match_words)
+        setattr(auto_settings, 'READ_ONLY_QUERIES', False)
+        setattr(auto_settings, 'READ_ONLY_QUERY_MAX_WALK', self.max_walk)
+        self.autocomp.remove_all()
+
+    def get_write_calls(self):
+        stats = self.redis.info('commandstats')
+        return sum([stats.get('cmdstat_' + command, {}).get('calls', 0)
+                    for command in ('zinterstore', 'zunionstore', 'del', 'unlink')])
+
+    def test_read_only_queries_match(self):
+        """
+        Read only queries return the same results as queries storing intermediate results
+        """
+        setattr(auto_settings, 'MOVE_EXACT_MATCHES_TO_TOP', True)
+        facets = [
+            {
+                'type': 'or',
+                'facets': [
+                    {'key': 'sector', 'value': 'Technology'},
+                    {'key': 'sector', 'value': 'Financial Services'},
+                ]
+            },
+            {
+                'type': 'and',
+                'facets': [{'key': 'industry', 'value': 'Software'}]
+            }
+        ]
+        queries = [('a', []), ('ch', []), ('us unemployment', []), ('a', facets), ('s', facets[:1])]
+        expected = [self.autocomp.suggest(term, facets=query_facets) for term, query_facets in queries]
+        expected_exact = self.autocomp.exact_suggest('aapl')
+        self.assertEqual(len(expected_exact['faceted_stock']), 1)
+
+        setattr(auto_settings, 'READ_ONLY_QUERIES', True)
+        write_calls = self.get_write_calls()
+        for (term, query_facets), matches in zip(queries, expected):
+            self.assertEqual(self.autocomp.suggest(term, facets=query_facets), matches)
+        self.assertEqual(self.autocomp.exact_suggest('aapl'), expected_exact)
+        self.assertEqual(self.get_write_calls(), write_calls)
+        self.assertEqual(self.redis.keys('djac.test.results.*'), [])
+
+        setattr(auto_settings, 'MOVE_EXACT_MATCHES_TO_TOP', False)
+
+    def test_read_only_queries_planned(self):
+        """
+        Read only queries walk the smallest set when matches are expected early in it, and
+        intersect the sets in full otherwise, with the same results either way
+        """
+        facets = [{'type': 'or', 'facets': [{'key': 'sector', 'value': 'Technology'}]}]
+        terms = ['us unemployment', 'united states', 'a c']
+        registry.set_autocompleter_setting('facet_stock_no_facet_ind', 'MAX_RESULTS', 2)
+        expected = [self.autocomp.suggest(term) for term in terms]
+        expected_faceted = self.autocomp.suggest('a', facets=facets)
+
+        setattr(auto_settings, 'READ_ONLY_QUERIES', True)
+        self.assertEqual(self.autocomp.suggest('a', facets=facets), expected_faceted)
+        # Without facets, only walks check IDs with ZMSCORE
+        stats = self.redis.info('commandstats')
+        self.assertEqual([self.autocomp.suggest(term) for term in terms], expected)
+        new_stats = self.redis.info('commandstats')
+        for command in ('zinter', 'zmscore'):
+            self.assertGreater(new_stats['cmdstat_' + command]['calls'],
+                               stats.get('cmdstat_' + command, {}).get('calls', 0))
+        registry.del_autocompleter_setting('facet_stock_no_facet_ind', 'MAX_RESULTS')
+
+    def test_read_only_queries_walk_bounded(self):
+        """
+        Read only query walks stop after READ_ONLY_QUERY_MAX_WALK times MAX_RESULTS IDs of the
+        smallest set, and intersect the sets in full instead, with the same results either way
+        """
+        facets = [{'type': 'or', 'facets': [{'key': 'sector', 'value': 'Technology'}]}]
+        queries = [('us unemployment', []), ('united states', []), ('a c', []), ('a', facets)]
+        registry.set_autocompleter_setting('facet_stock_no_facet_ind', 'MAX_RESULTS', 2)
+        expected = [self.autocomp.suggest(term, facets=query_facets) for term, query_facets in queries]
+        self.assertNotEqual(expected[2]['faceted_stock'], [])
+
+        setattr(auto_settings, 'READ_ONLY_QUERIES', True)
+        for max_walk in (0, 1):
+            setattr(auto_settings, 'READ_ONLY_QUERY_MAX_WALK', max_walk)
+            self.assertEqual([self.autocomp.suggest(term, facets=query_facets) for term, query_facets in queries],
+                             expected)
+
+        # The first IDs of the smaller set of 'a c' do not match, so its walk gives up
+        zinter_calls = self.redis.info('commandstats').get('cmdstat_zinter', {}).get('calls', 0)
+        self.assertEqual(self.autocomp.suggest('a c'), expected[2])
+        self.assertGreater(self.redis.info('commandstats')['cmdstat_zinter']['calls'], zinter_calls)
+        registry.del_autocompleter_setting('facet_stock_no_facet_ind', 'MAX_RESULTS')
+
+
+class CappedPrefixSetsMatchingTestCase(AutocompleterTestCase):
+    fixtures = ['stock_test_data_small.json', 'indicator_test_data_small.json']
+
+    def setUp(self):
+        super(CappedPrefixSetsMatchingTestCase, self).setUp()
+        self.autocomp = Autocompleter('facet_stock_no_facet_ind')
+        self.providers = [FacetedStockAutocompleteProvider, IndicatorAutocompleteProvider]
+        facets = [
+            {
+                'type': 'or',
+                'facets': [
+                    {'key': 'sector', 'value': 'Technology'},
+                    {'key': 'sector', 'value': 'Financial Services'},
+                ]
+            },
+            {
+                'type': 'and',
+                'facets': [{'key': 'industry', 'value': 'Software'}]
+            }
+        ]
+        self.queries = [('a', []), ('ch', []), ('us unemployment', []), ('bank of', []), ('a', facets),
+                        ('s', facets[:1]), ('apple inc', facets), ('gobblygook', [])]
+
+    def tearDown(self):
+        for provider in self.providers:
+            registry.del_provider_setting(provider, 'PREFIX_SET_MAX_SIZE')
+        registry.del_autocompleter_setting('facet_stock_no_facet_ind', 'MAX_RESULTS')
+        setattr(auto_settings, 'LUA_WRITES', False)
+        self.autocomp.remove_all()
+
+    def set_max_size(self, max_size):
+        for provider in self.providers:
+            registry.set_provider_setting(provider, 'PREFIX_SET_MAX_SIZE', max_size)
+
+    def suggest_all(self):
+        return [self.autocomp.suggest(term, facets=facets) for term, facets in self.queries]
+
+    def test_capped_prefix_sets_match(self):
+        """
+        Capped prefix sets hold at most the set number of IDs, and queries still find the IDs
+        trimmed off them
+        """
+        self.autocomp.store_all()
+        expected = self.suggest_all()
+        self.assertNotEqual(expected[3]['faceted_stock'], [])
+        self.assertNotEqual(expected[5]['faceted_stock'], [])
+        self.autocomp.remove_all()
+
+        self.set_max_size(3)
+        for lua_writes in (False, True):
+            setattr(auto_settings, 'LUA_WRITES', lua_writes)
+            self.autocomp.store_all()
+            self.assertEqual(self.redis.zcard('djac.test.faceted_stock.p.a'), 3)
+            self.assertTrue(self.redis.sismember('djac.test.faceted_stock.pt', 'a'))
+            self.assertFalse(self.redis.sismember('djac.test.faceted_stock.pt', 'aapl'))
+            self.assertEqual(self.suggest_all(), expected)
+            self.autocomp.remove_all()
+            self.assertEqual(self.redis.keys('djac.test.faceted_stock.*'), [])
+
+    def test_capped_prefix_set_answers_single_prefix(self):
+        """
+        A capped prefix set holding enough IDs answers queries of its prefix on its own
+        """
+        registry.set_autocompleter_setting('facet_stock_no_facet_ind', 'MAX_RESULTS', 2)
+        self.autocomp.store_all()
+        expected = self.autocomp.suggest('a')
+        self.autocomp.remove_all()
+
+        self.set_max_size(3)
+        self.autocomp.store_all()
+        self.redis.delete('djac.test.faceted_stock.tm')
+        self.assertEqual(self.autocomp.suggest('a'), expected)
+
+    def test_store_and_remove_keep_capped_prefix_sets_complete(self):
+        """
+        Objects removed from capped prefix sets are not replaced by ones ranking after IDs that
+        were trimmed off, and objects stored again are found
+        """
+        aapl = Stock.objects.get(symbol='AAPL')
+        self.autocomp.store_all()
+        FacetedStockAutocompleteProvider(aapl).remove()
+        expected_removed = self.suggest_all()
+        FacetedStockAutocompleteProvider(aapl).store()
+        expected = self.suggest_all()
+        self.autocomp.remove_all()
+
+        self.set_max_size(3)
+        self.autocomp.store_all()
+        for lua_writes in (False, True):
+            setattr(auto_settings, 'LUA_WRITES', lua_writes)
+            FacetedStockAutocompleteProvider(aapl).remove()
+            self.assertEqual(self.suggest_all(), expected_removed)
+            FacetedStockAutocompleteProvider(aapl).store()
+            self.assertEqual(self.suggest_all(), expected)
+            self.assertLessEqual(self.redis.zcard('djac.test.faceted_stock.p.a'), 3)
+
+    def test_all_trimmed_prefix_sets_match(self):
+        """
+        Queries whose prefix sets are all trimmed, or were left with fewer IDs than they are asked
+        for by removals, still find every match
+        """
+        removed = [Stock.objects.get(symbol=symbol) for symbol in ('AAPL', 'T', 'PG')]
+        self.autocomp.store_all()
+        for stock in removed:
+            FacetedStockAutocompleteProvider(stock).remove()
+        expected = self.suggest_all()
+        self.assertGreaterEqual(len(expected[0]['faceted_stock']), 5)
+        self.autocomp.remove_all()
+
+        self.set_max_size(6)
+        for lua_writes in (False, True):
+            setattr(auto_settings, 'LUA_WRITES', lua_writes)
+            self.autocomp.store_all()
+            for stock in removed:
+                FacetedStockAutocompleteProvider(stock).remove()
+            self.assertTrue(self.redis.sismember('djac.test.faceted_stock.pt', 'a'))
+            self.assertEqual(self.redis.zcard('djac.test.faceted_stock.p.a'), 3)
+            self.assertEqual(self.suggest_all(), expected)
+            self.autocomp.remove_all()
+
+
+class StopWordsMatchingTestCase(AutocompleterTestCase):
+    fixtures = ['stock_test_data_small.json', 'indicator_test_data_small.json']
+
+    def setUp(self):
+        super(StopWordsMatchingTestCase, self).setUp()
+        self.autocomp = Autocompleter('facet_stock_no_facet_ind')
+        self.autocomp.store_all()
+        self.providers = [FacetedStockAutocompleteProvider, IndicatorAutocompleteProvider]
+        facets = [{'type': 'or', 'facets': [{'key': 'sector', 'value': 'Technology'}]}]
+        self.queries = [('bank of', []), ('bank of america', []), ('us unemployment', []), ('of', []),
+                        ('a c', []), ('s of', facets), ('the of', [])]
+
+    def tearDown(self):
+        for provider in self.providers:
+            registry.del_provider_setting(provider, 'STOP_WORDS')
+            registry.del_provider_setting(provider, 'STOP_WORD_MIN_SHARE')
+        self.autocomp.remove_all()
+
+    def suggest_all(self):
+        return [self.autocomp.suggest(term, facets=facets) for term, facets in self.queries]
+
+    def get_calls(self):
+        stats = self.redis.info('commandstats')
+        return sum([stats.get('cmdstat_' + command, {}).get('calls', 0)
+                    for command in ('zinter', 'zinterstore', 'zmscore')])
+
+    def test_stop_words_match(self):
+        """
+        Stop words, configured or found by the share of objects matching them, are left out of
+        intersections without changing the results
+        """
+        expected = self.suggest_all()
+        self.assertNotEqual(expected[0]['faceted_stock'], [])
+        indicator_autocomp = Autocompleter('indicator')
+        expected_indicators = indicator_autocomp.suggest('bank of')
+        self.assertNotEqual(expected_indicators, [])
+
+        for setting_name, value in (('STOP_WORDS', ['Of', 'the', 'US']), ('STOP_WORD_MIN_SHARE', 0.05)):
+            for provider in self.providers:
+                registry.set_provider_setting(provider, setting_name, value)
+            self.assertEqual(self.suggest_all(), expected)
+
+            # Indicators with 'of' outnumber those with 'bank', so only the set of 'bank' is read,
+            # and its IDs are checked for 'of' against their terms
+            calls = self.get_calls()
+            self.assertEqual(indicator_autocomp.suggest('bank of'), expected_indicators)
+            self.assertEqual(self.get_calls(), calls)
+            for provider in self.providers:
+                registry.del_provider_setting(provider, setting_name)
+
+    def test_stop_words_queried_with_script(self):
+        """
+        Providers with stop words are queried with the read only query script even when
+        READ_ONLY_QUERIES is off, whose walks checking stop words are not cut short by
+        READ_ONLY_QUERY_MAX_WALK
+        """
+        registry.set_autocompleter_setting('facet_stock_no_facet_ind', 'MAX_RESULTS', 2)
+        expected = self.suggest_all()
+        for provider in self.providers:
+            registry.set_provider_setting(provider, 'STOP_WORD_MIN_SHARE', 0.05)
+        self.assertFalse(auto_settings.READ_ONLY_QUERIES)
+        max_walk = auto_settings.READ_ONLY_QUERY_MAX_WALK
+        setattr(auto_settings, 'READ_ONLY_QUERY_MAX_WALK', 1)
+        try:
+            stats = self.redis.info('commandstats')
+            stored_calls = sum([stats.get('cmdstat_' + command, {}).get('calls', 0)
+                                for command in ('zinterstore', 'zunionstore')])
+            self.assertEqual(self.suggest_all(), expected)
+            stats = self.redis.info('commandstats')
+            self.assertEqual(sum([stats.get('cmdstat_' + command, {}).get('calls', 0)
+                                  for command in ('zinterstore', 'zunionstore')]), stored_calls)
+        finally:
+            setattr(auto_settings, 'READ_ONLY_QUERY_MAX_WALK', max_walk)
+            registry.del_autocompleter_setting('facet_stock_no_facet_ind', 'MAX_RESULTS')
+
+
+class ReplicaMatchingTestCase(AutocompleterTestCase):
+    fixtures = ['stock_test_data_small.json']
+
+    def setUp(self):
+        super(ReplicaMatchingTestCase, self).setUp()
+        self.autocomp = Autocompleter("stock")
+        self.autocomp.store_all()
+        self.replicas = list(base.REPLICAS)
+        # A database of the test server with none of the data stands in for a lagging replica
+        self.replica = redis.Redis(host=self.redis.connection_pool.connection_kwargs['host'],
+                                   port=self.redis.connection_pool.connection_kwargs['port'],
+                                   db=self.redis.connection_pool.connection_kwargs['db'] + 1)
+        self.unreachable_replica = redis.Redis(port=1, socket_connect_timeout=0.1)
+
+    def tearDown(self):
+        base.REPLICAS[:] = self.replicas
+        self.reset_latencies()
+        setattr(auto_settings, 'READ_ONLY_QUERIES', False)
+        setattr(auto_settings, 'REDIS_REPLICA_SELECTION', 'round_robin')
+        self.autocomp.remove_all()
+
+    def test_round_robin(self):
+        """
+        Replicas are used in turn, and the primary when there are none
+        """
+        self.assertIs(base.get_read_client(), base.REDIS)
+        base.REPLICAS[:] = [self.replica, self.redis]
+        clients = [base.get_read_client() for i in range(4)]
+        self.assertEqual(clients.count(self.replica), 2)
+        self.assertEqual(clients.count(self.redis), 2)
+        self.assertIsNot(clients[0], clients[1])
+
+    def reset_latencies(self):
+        if base._replica_latencies['thread'] is not None:
+            base._replica_latencies['thread'].join()
+        base._replica_latencies.update({'measured_at': None, 'latencies': [], 'thread': None})
+
+    def test_least_latency(self):
+        """
+        The fastest reachable replica is used, and the primary when none can be reached
+        """
+        setattr(auto_settings, 'REDIS_REPLICA_SELECTION', 'least_latency')
+        base.REPLICAS[:] = [self.unreachable_replica, self.replica]
+        base.get_read_client()
+        base._replica_latencies['thread'].join()
+        self.assertIs(base.get_read_client(), self.replica)
+
+        base.REPLICAS[:] = [self.unreachable_replica]
+        self.reset_latencies()
+        base.get_read_client()
+        base._replica_latencies['thread'].join()
+        self.assertIs(base.get_read_client(), base.REDIS)
+
+    def test_least_latency_measured_in_background(self):
+        """
+        Picking a replica does not wait for replicas to be measured, using them in turn until
+        they first were
+        """
+        class SlowReplica(redis.Redis):
+            def ping(self, **kwargs):
+                time.sleep(0.5)
+                return super(SlowReplica, self).ping(**kwargs)
+
+        setattr(auto_settings, 'REDIS_REPLICA_SELECTION', 'least_latency')
+        slow_replica = SlowReplica(host=self.redis.connection_pool.connection_kwargs['host'],
+                                   port=self.redis.connection_pool.connection_kwargs['port'])
+        base.REPLICAS[:] = [slow_replica, self.replica]
+        start = time.time()
+        clients = [base.get_read_client() for i in range(4)]
+        self.assertLess(time.time() - start, 0.25)
+        self.assertEqual(clients.count(slow_replica), 2)
+
+        base._replica_latencies['thread'].join()
+        self.assertIs(base.get_read_client(), self.replica)
+
+    def test_suggest_reads_from_replica(self):
+        """
+        Suggest queries go to the replica with read only queries on, and to the primary otherwise
+        """
+        base.REPLICAS[:] = [self.replica]
+        self.assertEqual(len(self.autocomp.suggest('aapl')), 1)
+        self.assertEqual(self.autocomp.get_provider_result_from_id('stock', '1'), {})
+
+        setattr(auto_settings, 'READ_ONLY_QUERIES', True)
+        self.assertEqual(len(self.autocomp.suggest('aapl')), 0)
+        self.assertEqual(self.autocomp.exact_suggest('aapl'), [])
+        self.assertEqual(self.replica.dbsize(), 0)
+
+        base.REPLICAS[:] = []
+        self.assertEqual(len(self.autocomp.suggest('aapl')), 1)
+
+
+class ClusterModeMatchingTestCase(AutocompleterTestCase):
+    fixtures = ['stock_test_data_small.json']
+
+    def setUp(self):
+        super(ClusterModeMatchingTestCase, self).setUp()
+        # The key schema of cluster mode is used against the single test server
+        setattr(auto_settings, 'CLUSTER_MODE', True)
+        self.provider_key_name = base.PROVIDER_KEY_NAME
+        base.PROVIDER_KEY_NAME = '{%s}'
+        self.autocomp = Autocompleter("stock")
+        self.autocomp.store_all()
+
+    def tearDown(self):
+        self.autocomp.remove_all()
+        base.PROVIDER_KEY_NAME = self.provider_key_name
+        setattr(auto_settings, 'CLUSTER_MODE', False)
+
+    def test_provider_keys_share_hash_tag(self):
+        """
+        All keys of a provider carry its hash tag
+        """
+        keys = [key.decode() for key in self.redis.keys('djac.test.*')]
+        self.assertTrue(len(keys) > 0)
+        for key in keys:
+            self.assertIn('{stock}', key)
+
+    def test_suggest(self):
+        """
+        Suggest matches the same way, and leaves no intermediate results behind
+        """
+        setattr(auto_settings, 'CLUSTER_MODE', False)
+        base.PROVIDER_KEY_NAME = self.provider_key_name
+        self.autocomp.store_all()
+        expected = [self.autocomp.suggest(term) for term in ['aapl', 'apple', 'apple inc', 'a']]
+        self.autocomp.remove_all()
+        setattr(auto_settings, 'CLUSTER_MODE', True)
+        base.PROVIDER_KEY_NAME = '{%s}'
+
+        self.assertEqual([self.autocomp.suggest(term) for term in ['aapl', 'apple', 'apple inc', 'a']],
+                         expected)
+        self.assertEqual(self.autocomp.suggest_many(['aapl', 'apple', 'apple inc', 'a']), expected)
+        self.assertEqual(self.redis.keys('djac.test.results.*'), [])
+
+    def test_unsupported_settings_rejected(self):
+        """
+        Settings cluster mode does not support, globally or for a provider, fail startup
+        """
+        app_config = apps.get_app_config('autocompleter')
+        app_config.ready()
+        for setting_name, value in [('LUA_WRITES', True), ('READ_ONLY_QUERIES', True),
+                                    ('INVALIDATE_CACHE_ON_STORE', True), ('PREFIX_SET_MAX_SIZE', 100),
+                                    ('STOP_WORDS', ['inc']), ('STOP_WORD_MIN_SHARE', 0.5)]:
+            old_value = getattr(auto_settings, setting_name)
+            setattr(auto_settings, setting_name, value)
+            with self.assertRaisesRegex(ImproperlyConfigured, setting_name):
+                app_config.ready()
+            setattr(auto_settings, setting_name, old_value)
+
+        registry.set_provider_setting(StockAutocompleteProvider, 'PREFIX_SET_MAX_SIZE', 100)
+        with self.assertRaisesRegex(ImproperlyConfigured, 'PREFIX_SET_MAX_SIZE'):
+            app_config.ready()
+        registry.del_provider_setting(StockAutocompleteProvider, 'PREFIX_SET_MAX_SIZE')
+
+        setattr(auto_settings, 'CLUSTER_MODE', False)
+        setattr(auto_settings, 'LUA_WRITES', True)
+        app_config.ready()
+        setattr(auto_settings, 'LUA_WRITES', False)
+        setattr(auto_settings, 'CLUSTER_MODE', True)
+
+    def test_rebuild(self):
+        """
+        Rebuilding switches generations of the tagged keys
+        """
+        self.autocomp.rebuild(gc_delay=0, wait_for_gc=True)
+        self.assertEqual(len(self.autocomp.suggest('aapl')), 1)
+        self.assertTrue(self.redis.exists('djac.test.{stock}.gen'))
+
+
+class ShardedProvidersMatchingTestCase(AutocompleterTestCase):
+    fixtures = ['stock_test_data_small.json', 'indicator_test_data_small.json']
+
+    def setUp(self):
+        super(ShardedProvidersMatchingTestCase, self).setUp()
+        self.autocomp = Autocompleter("mixed")
+        # A database of the test server stands in for the server of the indicator provider
+        connection = self.redis.connection_pool.connection_kwargs
+        self.shard_connection = {'host': connection['host'], 'port': connection['port'], 'db': connection['db'] + 1}
+        self.shard = redis.Redis(**self.shard_connection)
+
+    def tearDown(self):
+        self.autocomp.remove_all()
+        registry.del_provider_setting(IndicatorAutocompleteProvider, 'REDIS_CONNECTION')
+        self.autocomp.remove_all()
+
+    def test_provider_keys_live_on_its_server(self):
+        """
+        A provider with its own connection stores and removes its keys on its own server
+        """
+        registry.set_provider_setting(IndicatorAutocompleteProvider, 'REDIS_CONNECTION', self.shard_connection)
+        self.autocomp.store_all()
+        self.assertNotEqual(self.shard.keys('djac.test.ind*'), [])
+        self.assertEqual(self.redis.keys('djac.test.ind*'), [])
+        self.assertNotEqual(self.redis.keys('djac.test.stock*'), [])
+
+        self.autocomp.remove_all()
+        self.assertEqual(self.shard.keys('djac.test.*'), [])
+
+    def test_suggest_across_servers(self):
+        """
+        Suggest and exact suggest merge the results of providers on different servers
+        """
+        setattr(auto_settings, 'MAX_EXACT_MATCH_WORDS', 10)
+        self.autocomp.store_all()
+        terms = ['a', 'us', 'us unemployment rate', 'aapl']
+        expected = [self.autocomp.suggest(term) for term in terms]
+        expected_exact = [self.autocomp.exact_suggest(term) for term in terms]
+        self.autocomp.remove_all()
+
+        registry.set_provider_setting(IndicatorAutocompleteProvider, 'REDIS_CONNECTION', self.shard_connection)
+        self.autocomp.store_all()
+        self.assertEqual([self.autocomp.suggest(term) for term in terms], expected)
+        self.assertEqual([self.autocomp.exact_suggest(term) for term in terms], expected_exact)
+        self.assertEqual(self.shard.keys('djac.test.results.*'), [])
+        setattr(auto_settings, 'MAX_EXACT_MATCH_WORDS', 0)
+
+    def test_rebuild_across_servers(self):
+        """
+        Rebuilding switches the generation of providers on every server
+        """
+        registry.set_provider_setting(IndicatorAutocompleteProvider, 'REDIS_CONNECTION', self.shard_connection)
+        self.autocomp.store_all()
+        expected = self.autocomp.suggest('us')
+        self.autocomp.rebuild(gc_delay=0, wait_for_gc=True)
+        self.assertEqual(IndicatorAutocompleteProvider.get_generation(), 1)
+        self.assertEqual(self.shard.get('djac.test.ind.gen'), b'1')
+        self.assertEqual(self.autocomp.suggest('us'), expected)
+
+
+class SuggestManyMatchingTestCase(AutocompleterTestCase):
+    fixtures = ['stock_test_data_small.json', 'indicator_test_data_small.json']
+
+    def setUp(self):
+        super(SuggestManyMatchingTestCase, self).setUp()
+        self.autocomp = Autocompleter("mixed")
+        self.autocomp.store_all()
+        self.terms = ['a', 'aapl', 'US Initial Claims', 'm', '', 'gobblygook']
+
+    def tearDown(self):
+        setattr(auto_settings, 'MOVE_EXACT_MATCHES_TO_TOP', False)
+        setattr(auto_settings, 'READ_ONLY_QUERIES', False)
+        setattr(auto_settings, 'CACHE_TIMEOUT', 0)
+        self.autocomp.remove_all()
+
+    def get_exec_calls(self):
+        return self.redis.info('commandstats').get('cmdstat_exec', {}).get('calls', 0)
+
+    def test_suggest_many_matches_suggest(self):
+        """
+        suggest_many returns what suggest returns for each term, in a single round trip
+        """
+        registry.set_ac_provider_setting("mixed", IndicatorAutocompleteProvider, 'MIN_LETTERS', 2)
+        for move_exact_matches_to_top, read_only_queries in ((False, False), (True, False), (True, True)):
+            setattr(auto_settings, 'MOVE_EXACT_MATCHES_TO_TOP', move_exact_matches_to_top)
+            setattr(auto_settings, 'READ_ONLY_QUERIES', read_only_queries)
+            expected = [self.autocomp.suggest(term) for term in self.terms]
+
+            exec_calls = self.get_exec_calls()
+            self.assertEqual(self.autocomp.suggest_many(self.terms), expected)
+            # One transaction reading the generations, another sending the queries of all terms
+            self.assertEqual(self.get_exec_calls(), exec_calls + 2)
+        self.assertEqual(self.redis.keys('djac.test.results.*'), [])
+        registry.del_ac_provider_setting("mixed", IndicatorAutocompleteProvider, 'MIN_LETTERS')
+
+    def test_suggest_many_cached(self):
+        """
+        suggest_many reads the results suggest cached, and caches those it computes
+        """
+        setattr(auto_settings, 'CACHE_TIMEOUT', 3600)
+        expected = [self.autocomp.suggest(term) for term in self.terms[:2]]
+        matches = self.autocomp.suggest('m')
+        no_matches = self.autocomp.suggest('gobblygook')
+
+        # Writing to Redis directly does not invalidate anything, so only the terms not cached
+        # yet find nothing
+        self.redis.delete(*self.redis.keys('djac.test.*.p.*'))
+        self.assertEqual(self.autocomp.suggest_many(self.terms), expected + [no_matches, matches, [], no_matches])
+        self.assertEqual(len(self.redis.keys('djac.test.mixed.c.*')), 5)
+
+
+class PrecomputedPrefixesMatchingTestCase(AutocompleterTestCase):
+    fixtures = ['stock_test_data_small.json', 'indicator_test_data_small.json']
+
+    def setUp(self):
+        super(PrecomputedPrefixesMatchingTestCase, self).setUp()
+        self.autocomp = Autocompleter("mixed")
+        self.terms = ['a', 'A', 'ap', 'm', 'us', 'zz', 'app']
+
+    def tearDown(self):
+        registry.del_autocompleter_setting('mixed', 'PRECOMPUTE_PREFIX_LENGTH')
+        setattr(auto_settings, 'LUA_WRITES', False)
+        self.autocomp.remove_all()
+
+    def get_calls(self, command):
+        return self.redis.info('commandstats').get('cmdstat_' + command, {}).get('calls', 0)
+
+    def count_round_trips(self, func):
+        """
+        Return what func returns, along with the number of requests it sent to Redis, leaving out
+        the checks redis-py makes that scripts are loaded before pipelines running them
+        """
+        send_packed_command = redis.connection.AbstractConnection.send_packed_command
+        sent = []
+
+        def count_sent(connection, command, *args, **kwargs):
+            if b'SCRIPT\r\n$6\r\nEXISTS' not in b''.join(command if isinstance(command, list) else [command]):
+                sent.append(command)
+            return send_packed_command(connection, command, *args, **kwargs)
+        redis.connection.AbstractConnection.send_packed_command = count_sent
+        try:
+            return func(), len(sent)
+        finally:
+            redis.connection.AbstractConnection.send_packed_command = send_packed_command
+
+    def get_expected(self):
+        registry.del_autocompleter_setting('mixed', 'PRECOMPUTE_PREFIX_LENGTH')
+        expected = [self.autocomp.suggest(term) for term in self.terms]
+        registry.set_autocompleter_setting('mixed', 'PRECOMPUTE_PREFIX_LENGTH', 2)
+        return expected
+
+    def test_suggest_reads_precomputed_results(self):
+        """
+        store_all precomputes the results of short prefixes, which suggest reads in a single round
+        trip, along with the keyspaces and cached results it needs anyway when they are missing
+        """
+        registry.set_autocompleter_setting('mixed', 'PRECOMPUTE_PREFIX_LENGTH', 2)
+        self.autocomp.store_all()
+        self.assertTrue(self.redis.exists('djac.test.mixed.pc.a'))
+        self.assertTrue(self.redis.exists('djac.test.mixed.pc.us'))
+        self.assertFalse(self.redis.exists('djac.test.mixed.pc.app'))
+        expected = self.get_expected()
+
+        zrange_calls = self.get_calls('zrange')
+        self.assertEqual(self.count_round_trips(lambda: self.autocomp.suggest('a')), (expected[0], 1))
+        self.assertEqual(self.get_calls('zrange'), zrange_calls)
+
+        # Missing precomputed and cached results cost no extra round trip: reading them with the
+        # keyspaces, running the queries and caching the results
+        setattr(auto_settings, 'CACHE_TIMEOUT', 3600)
+        self.autocomp.suggest('ap')
+        self.redis.delete('djac.test.mixed.pc.zz')
+        self.assertEqual(self.count_round_trips(lambda: self.autocomp.suggest('zz')), (expected[5], 3))
+        self.assertEqual(self.count_round_trips(lambda: self.autocomp.suggest('zz')), (expected[5], 1))
+        setattr(auto_settings, 'CACHE_TIMEOUT', 0)
+
+        self.assertEqual([self.autocomp.suggest(term) for term in self.terms], expected)
+        self.assertEqual(self.autocomp.suggest_many(self.terms), expected)
+
+        self.autocomp.remove_all()
+        self.assertEqual(self.redis.keys('djac.test.mixed.pc.*'), [])
+
+    def test_store_and_remove_update_precomputed_results(self):
+        """
+        Storing and removing objects recomputes the precomputed results they may be part of
+        """
+        registry.set_autocompleter_setting('mixed', 'PRECOMPUTE_PREFIX_LENGTH', 2)
+        self.autocomp.store_all()
+        aapl = Stock.objects.get(symbol='AAPL')
+        for lua_writes in (False, True):
+            setattr(auto_settings, 'LUA_WRITES', lua_writes)
+            StockAutocompleteProvider(aapl).remove()
+            self.assertEqual([self.autocomp.suggest(term) for term in self.terms], self.get_expected())
+            self.assertEqual(self.autocomp.suggest('ap')['stock'], [])
+
+            aapl.name = 'Zzyzx Inc.'
+            StockAutocompleteProvider(aapl).store()
+            self.assertEqual([self.autocomp.suggest(term) for term in self.terms], self.get_expected())
+            self.assertEqual(len(self.autocomp.suggest('zz')['stock']), 1)
+
+            aapl.name = 'Apple Inc.'
+            StockAutocompleteProvider.store_many([aapl])
+            self.assertEqual([self.autocomp.suggest(term) for term in self.terms], self.get_expected())
+            self.assertEqual(self.autocomp.suggest('zz')['stock'], [])
+
+    def test_precomputed_results_written_in_order(self):
+        """
+        Results precomputed from older data are not written over those precomputed from newer
+        data meanwhile, and precomputed results expire after PRECOMPUTE_TIMEOUT seconds
+        """
+        registry.set_autocompleter_setting('mixed', 'PRECOMPUTE_PREFIX_LENGTH', 2)
+        self.autocomp.store_all()
+        self.assertGreater(self.redis.ttl('djac.test.mixed.pc.ap'), 0)
+        aapl = Stock.objects.get(symbol='AAPL')
+
+        class StoringAutocompleter(Autocompleter):
+            def _suggest_many(self, *args, **kwargs):
+                results = super(StoringAutocompleter, self)._suggest_many(*args, **kwargs)
+                # Storing the object recomputes the results before those computed so far are written
+                StockAutocompleteProvider(aapl).store()
+                return results
+
+        for lua_writes in (False, True):
+            setattr(auto_settings, 'LUA_WRITES', lua_writes)
+            StockAutocompleteProvider(aapl).remove()
+            self.assertEqual(self.autocomp.suggest('ap')['stock'], [])
+            StoringAutocompleter('mixed').precompute(['ap'])
+            self.assertEqual(len(self.autocomp.suggest('ap')['stock']), 1)
+
+        registry.set_autocompleter_setting('mixed', 'PRECOMPUTE_TIMEOUT', 0)
+        self.autocomp.precompute(['ap'])
+        self.assertEqual(self.redis.ttl('djac.test.mixed.pc.ap'), -1)
+        registry.del_autocompleter_setting('mixed', 'PRECOMPUTE_TIMEOUT')
+
+    def test_rebuild_precomputes_results(self):
+        """
+        Rebuilding precomputes results from the new generation
+        """
+        registry.set_autocompleter_setting('mixed', 'PRECOMPUTE_PREFIX_LENGTH', 1)
+        self.autocomp.store_all()
+        self.redis.delete('djac.test.mixed.pc.a')
+        self.redis.set('djac.test.mixed.pc._', '{}')
+        self.autocomp.rebuild(gc_delay=0, wait_for_gc=True)
+        self.assertTrue(self.redis.exists('djac.test.mixed.pc.a'))
+        self.assertFalse(self.redis.exists('djac.test.mixed.pc._'))
+        self.assertEqual([self.autocomp.suggest(term) for term in self.terms], self.get_expected())
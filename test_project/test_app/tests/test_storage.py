@@ -74,6 +74,158 @@ class StoringAndRemovingTestCase(AutocompleterTestCase):
         keys = self.redis.keys('djac.test.stock*')
         self.assertEqual(len(keys), 0)
 
+    def test_store_many(self):
+        """
+        Storing a batch of objects at once stores the same data as storing them one by one
+        """
+        stocks = list(Stock.objects.all())
+        StockAutocompleteProvider(stocks[0]).store()
+        old_keys = set(self.redis.keys('djac.test.stock*'))
+        StockAutocompleteProvider(stocks[0]).remove()
+
+        num_stored = StockAutocompleteProvider.store_many(stocks[:1])
+        self.assertEqual(num_stored, 1)
+        self.assertEqual(set(self.redis.keys('djac.test.stock*')), old_keys)
+
+        num_stored = StockAutocompleteProvider.store_many(stocks)
+        self.assertEqual(num_stored, 104)
+        keys = self.redis.hkeys('djac.test.stock')
+        self.assertEqual(len(keys), 104)
+
+        StockAutocompleteProvider.store_many([])
+        keys = self.redis.hkeys('djac.test.stock')
+        self.assertEqual(len(keys), 104)
+
+    def test_store_many_updates_repeated_objects(self):
+        """
+        When the same object appears twice in a batch, the last version wins and no orphans remain
+        """
+        aapl = Stock.objects.get(symbol='AAPL')
+        renamed_aapl = Stock.objects.get(symbol='AAPL')
+        renamed_aapl.name = 'Pear'
+        StockAutocompleteProvider.store_many([aapl, renamed_aapl])
+
+        autocomp = Autocompleter("stock")
+        self.assertEqual(len(autocomp.suggest('pear')), 1)
+        self.assertEqual(len(autocomp.suggest('apple')), 0)
+
+    def test_store_all_batch_size(self):
+        """
+        store_all stores every object regardless of batch size
+        """
+        autocomp = Autocompleter("stock")
+        autocomp.store_all(batch_size=7)
+        keys = self.redis.hkeys('djac.test.stock')
+        self.assertEqual(len(keys), 104)
+
+        autocomp.store_all(batch_size=1)
+        keys = self.redis.hkeys('djac.test.stock')
+        self.assertEqual(len(keys), 104)
+
+    def test_store_updates_changed_terms_only(self):
+        """
+        Restoring an object with changed terms and score moves it between prefixes and updates its score
+        """
+        aapl = Stock.objects.get(symbol='AAPL')
+        StockAutocompleteProvider(aapl).store()
+        self.assertIsNotNone(self.redis.zscore('djac.test.stock.p.inc', aapl.id))
+
+        aapl.name = 'Apple Computer'
+        aapl.market_cap = 10
+        provider = StockAutocompleteProvider(aapl)
+        provider.store()
+        self.assertIsNone(self.redis.zscore('djac.test.stock.p.inc', aapl.id))
+        self.assertEqual(self.redis.zscore('djac.test.stock.p.computer', aapl.id), provider._get_score())
+        self.assertEqual(self.redis.zscore('djac.test.stock.p.apple', aapl.id), provider._get_score())
+        self.assertEqual(self.redis.zscore('djac.test.stock.p.aapl', aapl.id), provider._get_score())
+
+        provider.remove()
+        keys = self.redis.keys('djac.test.stock*')
+        self.assertEqual(len(keys), 0)
+
+    def test_store_unchanged_object_is_noop(self):
+        """
+        Restoring an unchanged object queues no writes, and a payload-only change only writes the payload
+        """
+        aapl = Stock.objects.get(symbol='AAPL')
+        StockAutocompleteProvider(aapl).store()
+        fingerprint = self.redis.hget('djac.test.stock.fp', aapl.id).decode('utf-8')
+
+        provider = StockAutocompleteProvider(aapl)
+        old_norm_terms, old_facets, old_fingerprints = StockAutocompleteProvider.get_old_state_many([aapl.id])
+        self.assertEqual(old_fingerprints[aapl.id], fingerprint)
+        pipe = self.redis.pipeline()
+        provider._store(pipe, aapl.id, old_norm_terms[aapl.id], None, old_fingerprints[aapl.id], 'stock')
+        self.assertEqual(len(pipe.command_stack), 0)
+
+        provider.get_data = lambda: {'display_name': 'Apple'}
+        pipe = self.redis.pipeline()
+        provider._store(pipe, aapl.id, old_norm_terms[aapl.id], None, old_fingerprints[aapl.id], 'stock')
+        self.assertEqual(len(pipe.command_stack), 2)
+        pipe.execute()
+        self.assertEqual(provider._deserialize_data(self.redis.hget('djac.test.stock', aapl.id)),
+            {'display_name': 'Apple'})
+        self.assertNotEqual(self.redis.hget('djac.test.stock.fp', aapl.id).decode('utf-8'), fingerprint)
+
+        provider.remove()
+        keys = self.redis.keys('djac.test.stock*')
+        self.assertEqual(len(keys), 0)
+
+    def test_remove_all_in_batches(self):
+        """
+        Removing all objects and clearing the cache in small batches removes every key
+        """
+        setattr(auto_settings, 'CACHE_TIMEOUT', 3600)
+        setattr(auto_settings, 'MAINTENANCE_BATCH_SIZE', 7)
+        autocomp = Autocompleter("mixed")
+        autocomp.store_all()
+        for term in ('a', 'ap', 'app'):
+            autocomp.suggest(term)
+        self.assertNotEqual(len(self.redis.keys('djac.test.mixed.c.*')), 0)
+
+        autocomp.remove_all()
+        keys = self.redis.keys('djac.test.*')
+        self.assertEqual(len(keys), 0)
+
+        setattr(auto_settings, 'MAINTENANCE_BATCH_SIZE', 500)
+        setattr(auto_settings, 'CACHE_TIMEOUT', 0)
+
+    def test_partitions_cover_all_objects(self):
+        """
+        Model and dict providers split their objects into disjoint partitions covering every object
+        """
+        partitions = StockAutocompleteProvider.get_partitions(3)
+        self.assertEqual(len(partitions), 3)
+        ids = []
+        for partition in partitions:
+            ids += [stock.id for stock in StockAutocompleteProvider.get_partition_iterator(partition)]
+        self.assertEqual(sorted(ids), sorted(Stock.objects.values_list('id', flat=True)))
+
+        partitions = CalcAutocompleteProvider.get_partitions(3)
+        self.assertEqual(len(partitions), 3)
+        items = []
+        for partition in partitions:
+            items += list(CalcAutocompleteProvider.get_partition_iterator(partition))
+        self.assertEqual(items, calc_info.calc_dicts)
+
+    def test_store_all_parallel(self):
+        """
+        Storing all objects with multiple workers stores everything and reports counts per provider
+        """
+        autocomp = Autocompleter("mixed")
+        report = autocomp.store_all(workers=2)
+        self.assertEqual(report['errors'], [])
+        self.assertEqual(report['stored']['stock'], 104)
+        self.assertEqual(report['stored']['metric'], 8)
+        keys = self.redis.hkeys('djac.test.stock')
+        self.assertEqual(len(keys), 104)
+        keys = self.redis.hkeys('djac.test.ind')
+        self.assertEqual(len(keys), 100)
+        keys = self.redis.hkeys('djac.test.metric')
+        self.assertEqual(len(keys), 8)
+
+        autocomp.remove_all()
+
     def test_orphan_removal(self):
         """
         test orphan removal
@@ -215,6 +367,171 @@ class StoringAndRemovingTestCase(AutocompleterTestCase):
         self.assertEqual(len(keys), 0)
 
 
+class RebuildTestCase(AutocompleterTestCase):
+    fixtures = ['stock_test_data_small.json']
+
+    def test_rebuild_switches_generation(self):
+        """
+        Rebuilding stores into a new generation of keys, switches to it and removes the old one
+        """
+        autocomp = Autocompleter("stock")
+        autocomp.store_all()
+        self.assertEqual(StockAutocompleteProvider.get_generation(), 0)
+        self.assertEqual(len(autocomp.suggest('aapl')), 1)
+
+        report = autocomp.rebuild(gc_delay=0, wait_for_gc=True)
+        self.assertEqual(report['stored']['stock'], 104)
+        self.assertEqual(StockAutocompleteProvider.get_generation(), 1)
+        self.assertEqual(len(self.redis.hkeys('djac.test.stock')), 0)
+        self.assertEqual(len(self.redis.keys('djac.test.stock.p.*')), 0)
+        self.assertEqual(len(self.redis.hkeys('djac.test.stock.g1')), 104)
+        self.assertEqual(len(autocomp.suggest('aapl')), 1)
+        self.assertEqual(autocomp.get_provider_result_from_id('stock', '1')['id'], 1)
+
+        autocomp.remove_all()
+        keys = self.redis.keys('djac.test.stock*')
+        self.assertEqual(len(keys), 0)
+
+    def test_suggest_reads_live_generation_during_rebuild(self):
+        """
+        Objects stored into a generation that is not live yet are not suggested
+        """
+        autocomp = Autocompleter("stock")
+        autocomp.store_all()
+        aapl = Stock.objects.get(symbol='AAPL')
+        aapl.name = 'Pear'
+        StockAutocompleteProvider(aapl).store(generation=1)
+        self.assertEqual(len(autocomp.suggest('pear')), 0)
+        self.assertEqual(len(autocomp.suggest('apple')), 1)
+
+        autocomp.rebuild(gc_delay=0, wait_for_gc=True)
+        self.assertEqual(len(autocomp.suggest('apple')), 1)
+
+        # Signals store into the live generation after the switch
+        StockAutocompleteProvider(aapl).store()
+        self.assertEqual(len(autocomp.suggest('pear')), 1)
+        self.assertEqual(len(autocomp.suggest('apple')), 0)
+
+        autocomp.remove_all()
+        keys = self.redis.keys('djac.test.stock*')
+        self.assertEqual(len(keys), 0)
+
+
+class LuaWritesTestCase(AutocompleterTestCase):
+    fixtures = ['stock_test_data_small.json']
+
+    def setUp(self):
+        super(LuaWritesTestCase, self).setUp()
+        self.max_exact_match_words = auto_settings.MAX_EXACT_MATCH_WORDS
+        setattr(auto_settings, 'MAX_EXACT_MATCH_WORDS', 10)
+
+    def tearDown(self):
+        setattr(auto_settings, 'LUA_WRITES', False)
+        setattr(auto_settings, 'MAX_EXACT_MATCH_WORDS', self.max_exact_match_words)
+        super(LuaWritesTestCase, self).tearDown()
+
+    def get_stored_keys(self):
+        stored = {}
+        for key in self.redis.keys('djac.test.*'):
+            key_type = self.redis.type(key)
+            if key_type == b'zset':
+                stored[key] = self.redis.zrange(key, 0, -1, withscores=True)
+            elif key_type == b'set':
+                stored[key] = self.redis.smembers(key)
+            elif key_type == b'hash':
+                stored[key] = self.redis.hgetall(key)
+        return stored
+
+    def test_lua_store_matches_pipeline_store(self):
+        """
+        Storing with the Lua script writes exactly what storing with pipelines does
+        """
+        autocomp = Autocompleter("faceted_stock")
+        autocomp.store_all()
+        aapl = Stock.objects.get(symbol='AAPL')
+        aapl.name = 'Apple Computer'
+        aapl.sector = 'Consumer Goods'
+        FacetedStockAutocompleteProvider(aapl).store()
+        stored = self.get_stored_keys()
+        autocomp.remove_all()
+
+        setattr(auto_settings, 'LUA_WRITES', True)
+        autocomp.store_all()
+        aapl = Stock.objects.get(symbol='AAPL')
+        aapl.name = 'Apple Computer'
+        aapl.sector = 'Consumer Goods'
+        FacetedStockAutocompleteProvider(aapl).store()
+        lua_stored = self.get_stored_keys()
+        self.assertEqual(lua_stored, stored)
+        self.assertEqual(autocomp.suggest('computer')[0]['search_name'], 'AAPL')
+
+        autocomp.remove_all()
+
+    def test_lua_store_matches_pipeline_store_float_facets(self):
+        """
+        The Lua script names the facet sets of float facet values the way pipelines do
+        """
+        class FloatFacetedStockAutocompleteProvider(FacetedStockAutocompleteProvider):
+            def get_data(self):
+                data = super(FloatFacetedStockAutocompleteProvider, self).get_data()
+                data['industry'] = 2.0 if self.obj.symbol == 'AAPL' else 0.1 + 0.2
+                return data
+
+        stocks = Stock.objects.filter(symbol__in=['AAPL', 'XOM'])
+        for stock in stocks:
+            FloatFacetedStockAutocompleteProvider(stock).store()
+        stored = self.get_stored_keys()
+        self.assertIn(b'djac.test.faceted_stock.f.industry.2.0', stored)
+        self.assertIn(('djac.test.faceted_stock.f.industry.%s' % (0.1 + 0.2,)).encode('utf-8'), stored)
+        for stock in stocks:
+            FloatFacetedStockAutocompleteProvider(stock).remove()
+
+        setattr(auto_settings, 'LUA_WRITES', True)
+        for stock in stocks:
+            FloatFacetedStockAutocompleteProvider(stock).store()
+        self.assertEqual(self.get_stored_keys(), stored)
+        for stock in stocks:
+            FloatFacetedStockAutocompleteProvider(stock).remove()
+        self.assertEqual(self.redis.keys('djac.test.faceted_stock*'), [])
+
+    def test_lua_store_and_remove(self):
+        """
+        Storing and removing an item with the Lua script works and leaves no keys behind
+        """
+        setattr(auto_settings, 'LUA_WRITES', True)
+        aapl = Stock.objects.get(symbol='AAPL')
+        provider = FacetedStockAutocompleteProvider(aapl)
+        provider.store()
+        self.assertEqual(len(self.redis.hkeys('djac.test.faceted_stock')), 1)
+        facet_set_name = base.FACET_SET_BASE_NAME % ('faceted_stock', 'sector', 'Technology',)
+        self.assertEqual(self.redis.zcard(facet_set_name), 1)
+
+        # Storing an unchanged object is a no-op
+        self.assertEqual(base.STORE_SCRIPT(
+            keys=[base.GENERATION_BASE_NAME % ('faceted_stock',)],
+            args=['faceted_stock', '', str(aapl.id), 1, provider._get_store_state()[-1], '', '[]', '[]', '[]', '{}'],
+        ), 0)
+
+        provider.remove()
+        keys = self.redis.keys('djac.test.faceted_stock*')
+        self.assertEqual(len(keys), 0)
+
+    def test_lua_store_all_and_remove_all(self):
+        """
+        Storing all objects with the Lua script in one or several workers leaves no keys behind on removal
+        """
+        setattr(auto_settings, 'LUA_WRITES', True)
+        autocomp = Autocompleter("stock")
+        for workers in (1, 2):
+            report = autocomp.store_all(workers=workers)
+            self.assertEqual(report['stored']['stock'], 104)
+            self.assertEqual(len(autocomp.suggest('a')), 10)
+            for stock in Stock.objects.all():
+                StockAutocompleteProvider(stock).remove()
+            keys = self.redis.keys('djac.test.stock*')
+            self.assertEqual(len(keys), 0)
+
+
 class FacetedStoringAndRemovingTestCase(AutocompleterTestCase):
     fixtures = ['stock_test_data_small.json']
 
@@ -241,6 +558,23 @@ class FacetedStoringAndRemovingTestCase(AutocompleterTestCase):
         self.assertEqual(facet_data,
             [{'key': 'sector', 'value': aapl.sector}, {'key': 'industry', 'value': aapl.industry}])
 
+    def test_store_moves_changed_facet_value(self):
+        """
+        Restoring an object whose facet value changed moves it between facet sets
+        """
+        aapl = Stock.objects.get(symbol='AAPL')
+        FacetedStockAutocompleteProvider(aapl).store()
+
+        aapl.sector = 'Consumer Goods'
+        provider = FacetedStockAutocompleteProvider(aapl)
+        provider.store()
+
+        provider_name = provider.get_provider_name()
+        facet_set_name = base.FACET_SET_BASE_NAME % (provider_name, 'sector', 'Technology',)
+        self.assertEqual(self.redis.zcard(facet_set_name), 0)
+        facet_set_name = base.FACET_SET_BASE_NAME % (provider_name, 'sector', 'Consumer Goods',)
+        self.assertEqual(self.redis.zcard(facet_set_name), 1)
+
     def test_second_store_removes_old_facet_data(self):
         """
         Store removes outdated facet data and updates mapping
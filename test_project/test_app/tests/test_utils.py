@@ -1,5 +1,5 @@
 from django.test import TestCase
-from autocompleter import Autocompleter
+from autocompleter import Autocompleter, utils
 from autocompleter.views import SuggestView
 
 
@@ -253,3 +253,18 @@ class TestNormalizeRounding(TestCase):
         self.assertEqual(0, Autocompleter.normalize_rounding(.49))
         self.assertEqual(-1, Autocompleter.normalize_rounding(-.51))
         self.assertEqual(0, Autocompleter.normalize_rounding(-.49))
+
+
+class TestNormTermPrefixes(TestCase):
+    def test_prefixes_of_all_words(self):
+        """
+        Every prefix of every word of every term is returned once
+        """
+        prefixes = utils.get_norm_term_prefixes(['apple inc', 'aapl'])
+        self.assertEqual(prefixes, {'a', 'ap', 'app', 'appl', 'apple', 'i', 'in', 'inc', 'aa', 'aap', 'aapl'})
+
+    def test_no_terms(self):
+        """
+        No terms have no prefixes
+        """
+        self.assertEqual(utils.get_norm_term_prefixes([]), set())
@@ -159,3 +159,68 @@ class TextFacetSuggestView(AutocompleterTestCase):
         }
         response = self.client.get(suggest_url, data=data)
         self.assertEqual(response.status_code, 400)
+
+
+class TestSuggestManyView(AutocompleterTestCase):
+    fixtures = ['stock_test_data_small.json']
+
+    def setUp(self):
+        super(TestSuggestManyView, self).setUp()
+        self.autocomp = Autocompleter('faceted_stock')
+        self.autocomp.store_all()
+
+    def tearDown(self):
+        self.autocomp.remove_all()
+
+    def test_suggest_many_match(self):
+        """
+        SuggestManyView returns the results of each term, with or without facets
+        """
+        url = reverse('suggest_many', kwargs={'name': 'faceted_stock'})
+        terms = ['a', 'gobblygook', 'aapl']
+        response = self.client.get(url, data={settings.SUGGEST_PARAMETER_NAME: json.dumps(terms)})
+        self.assertEqual(response.status_code, 200)
+        json_response = json.loads(response.content.decode('utf-8'))
+        self.assertEqual(json_response, [self.autocomp.suggest(term) for term in terms])
+
+        facets = [
+            {
+                'type': 'or',
+                'facets': [{'key': 'sector', 'value': 'Technology'}]
+            }
+        ]
+        data = {
+            settings.SUGGEST_PARAMETER_NAME: json.dumps(terms),
+            settings.FACET_PARAMETER_NAME: json.dumps(facets)
+        }
+        response = self.client.get(url, data=data)
+        self.assertEqual(response.status_code, 200)
+        json_response = json.loads(response.content.decode('utf-8'))
+        self.assertEqual(json_response, [self.autocomp.suggest(term, facets=facets) for term in terms])
+
+    def test_malformed_terms(self):
+        """
+        SuggestManyView returns 400 status code when the search parameter is not a JSON list of
+        terms, or the facet parameter is not JSON
+        """
+        url = reverse('suggest_many', kwargs={'name': 'faceted_stock'})
+        for terms in ('"a"', '[1]', '{"a": "b"}', '["a"', 'a'):
+            response = self.client.get(url, data={settings.SUGGEST_PARAMETER_NAME: terms})
+            self.assertEqual(response.status_code, 400)
+
+        data = {settings.SUGGEST_PARAMETER_NAME: '["a"]', settings.FACET_PARAMETER_NAME: '[{'}
+        response = self.client.get(url, data=data)
+        self.assertEqual(response.status_code, 400)
+
+    def test_too_many_terms(self):
+        """
+        SuggestManyView returns 400 status code when given more than MAX_SUGGEST_MANY_TERMS terms
+        """
+        url = reverse('suggest_many', kwargs={'name': 'faceted_stock'})
+        max_terms = settings.MAX_SUGGEST_MANY_TERMS
+        setattr(settings, 'MAX_SUGGEST_MANY_TERMS', 2)
+        response = self.client.get(url, data={settings.SUGGEST_PARAMETER_NAME: json.dumps(['a', 'b'])})
+        self.assertEqual(response.status_code, 200)
+        response = self.client.get(url, data={settings.SUGGEST_PARAMETER_NAME: json.dumps(['a', 'b', 'c'])})
+        self.assertEqual(response.status_code, 400)
+        setattr(settings, 'MAX_SUGGEST_MANY_TERMS', max_terms)